@@ -306,6 +306,9 @@ class AlertSource:
         within a specific time interval after failover to prevent false positives.
 
     :cvar run_on_backup_node: set this to `false` to prevent running this alert on HA `BACKUP` node.
+
+    :cvar run_timeout: number of seconds after which the check is considered failed. The check itself is not
+        interrupted and its next run waits for it to complete.
     """
 
     schedule = IntervalSchedule(timedelta())
@@ -313,6 +316,7 @@ class AlertSource:
     products = ("CORE", "ENTERPRISE", ProductType.SCALE, ProductType.SCALE_ENTERPRISE)
     failover_related = False
     run_on_backup_node = True
+    run_timeout = 120
 
     def __init__(self, middleware):
         self.middleware = middleware
@@ -57,7 +57,10 @@ class RpcWebSocketApp(App):
         self.subscriptions = {}
 
     def send(self, data):
-        fut = asyncio.run_coroutine_threadsafe(self.ws.send_str(json.dumps(data)), self.middleware.loop)
+        self.send_serialized(json.dumps(data))
+
+    def send_serialized(self, data: str):
+        asyncio.run_coroutine_threadsafe(self.ws.send_str(data), self.middleware.loop)
 
     def send_error(self, id_: Any, code: int, message: str, data: Any = None):
         error = {
@@ -133,27 +136,33 @@ class RpcWebSocketApp(App):
         if shortname in self.middleware.event_source_manager.event_sources:
             await self.middleware.event_source_manager.subscribe_app(self, self.__esm_ident(ident), shortname, arg)
         else:
-            self.subscriptions[ident] = name
+            self.add_subscription(ident, name)
 
     async def unsubscribe(self, ident: str):
         if ident in self.subscriptions:
-            self.subscriptions.pop(ident)
+            self.remove_subscription(ident)
         elif self.__esm_ident(ident) in self.middleware.event_source_manager.idents:
             await self.middleware.event_source_manager.unsubscribe(self.__esm_ident(ident))
 
     def __esm_ident(self, ident):
         return self.session_id + ident
 
-    def send_event(self, name: str, event_type: str, **kwargs):
-        if (
-            not any(i in [name, "*"] for i in self.subscriptions.values()) and
-            (
-                self.middleware.event_source_manager.short_name_arg(name)[0] not in
-                self.middleware.event_source_manager.event_sources
-            )
-        ):
-            return
+    def add_subscription(self, ident: str, name: str):
+        """
+        Subscribe to events of the `name` collection sent using `Middleware.send_event`. Middleware keeps an index of
+        subscribed clients by collection name so that events are only encoded for and sent to interested clients.
+        """
+        if ident in self.subscriptions:
+            self.remove_subscription(ident)
 
+        self.subscriptions[ident] = name
+        self.middleware.subscribe_wsclient(self, name)
+
+    def remove_subscription(self, ident: str):
+        self.middleware.unsubscribe_wsclient(self, self.subscriptions.pop(ident))
+
+    @staticmethod
+    def event_payload(name: str, event_type: str, kwargs: dict) -> dict:
         event = {
             "msg": event_type.lower(),
             "collection": name,
@@ -167,7 +176,31 @@ class RpcWebSocketApp(App):
         if kwargs:
             event["extra"] = kwargs
 
-        self.send_notification("collection_update", event)
+        return event
+
+    @classmethod
+    def encode_event(cls, name: str, event_type: str, kwargs: dict) -> str:
+        """
+        Serialized event message. Every client of the same class receives the same message so `Middleware.send_event`
+        only encodes it once per client class.
+        """
+        return json.dumps({
+            "jsonrpc": "2.0",
+            "method": "collection_update",
+            "params": cls.event_payload(name, event_type, kwargs),
+        })
+
+    def send_event(self, name: str, event_type: str, **kwargs):
+        if (
+            not any(i in [name, "*"] for i in self.subscriptions.values()) and
+            (
+                self.middleware.event_source_manager.short_name_arg(name)[0] not in
+                self.middleware.event_source_manager.event_sources
+            )
+        ):
+            return
+
+        self.send_serialized(self.encode_event(name, event_type, kwargs))
 
     def notify_unsubscribed(self, collection: str, error: Exception | None):
         params = {"collection": collection, "error": None}
@@ -0,0 +1,124 @@
+import threading
+
+
+class StopSampling(Exception):
+    """ Raised by `Sampler.setup()` or `Sampler.sample()` to end all subscriptions without an error """
+
+
+class Sampler:
+    """
+    Periodically produces event payload in a single thread and hands it out to every subscribed
+    event source, so that the cost of gathering the data does not grow with the number of
+    subscribers. Subclasses implement `sample()` (and optionally `setup()`).
+
+    A sampler runs until its last subscriber unsubscribes. If `setup()` or `sample()` raise,
+    the error is passed to all subscribers and the sampler stops (see also `StopSampling`).
+    """
+
+    def __init__(self, registry, key, middleware, interval):
+        self.registry = registry
+        self.key = key
+        self.middleware = middleware
+        self.interval = interval
+        self.subscribers = set()
+        self.last_sample = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True, name=f'{type(self).__name__}({key})')
+
+    def setup(self):
+        """ Called once in sampler thread before first `sample()` """
+
+    def sample(self):
+        raise NotImplementedError
+
+    def run(self):
+        try:
+            self.setup()
+            while not self.stopped.is_set():
+                data = self.sample()
+                with self.registry.lock:
+                    self.last_sample = data
+                    subscribers = list(self.subscribers)
+
+                for subscriber in subscribers:
+                    subscriber.on_sample(data)
+
+                self.stopped.wait(self.interval)
+        except StopSampling:
+            self.registry.fail(self, None)
+        except Exception as e:
+            self.registry.fail(self, e)
+
+
+class SamplerRegistry:
+    """
+    Process-wide registry of running samplers of type `sampler_class` keyed by `key` passed to
+    `subscribe()` (usually the interval).
+    """
+
+    def __init__(self, sampler_class):
+        self.sampler_class = sampler_class
+        self.lock = threading.Lock()
+        self.samplers = {}
+
+    def subscribe(self, key, subscriber, middleware, interval):
+        with self.lock:
+            if (sampler := self.samplers.get(key)) is None:
+                sampler = self.samplers[key] = self.sampler_class(self, key, middleware, interval)
+                sampler.thread.start()
+
+            sampler.subscribers.add(subscriber)
+            last_sample = sampler.last_sample
+
+        if last_sample is not None:
+            # Do not make new subscriber wait for the next sample
+            subscriber.on_sample(last_sample)
+
+        return sampler
+
+    def unsubscribe(self, sampler, subscriber):
+        with self.lock:
+            sampler.subscribers.discard(subscriber)
+            if not sampler.subscribers:
+                sampler.stopped.set()
+                if self.samplers.get(sampler.key) is sampler:
+                    del self.samplers[sampler.key]
+
+    def fail(self, sampler, error):
+        with self.lock:
+            if self.samplers.get(sampler.key) is sampler:
+                del self.samplers[sampler.key]
+
+            subscribers = list(sampler.subscribers)
+
+        for subscriber in subscribers:
+            subscriber.on_error(error)
+
+
+class SampledEventSourceMixin:
+    """
+    EventSource mixin that sends `ADDED` events with payload produced by a sampler from
+    `SAMPLERS` registry shared with other subscriptions with the same `interval` argument.
+    """
+
+    SAMPLERS = NotImplemented
+
+    def run_sync(self):
+        self.error = None
+        interval = self.arg['interval']
+        sampler = self.SAMPLERS.subscribe(interval, self, self.middleware, interval)
+        try:
+            self._cancel_sync.wait()
+        finally:
+            self.SAMPLERS.unsubscribe(sampler, self)
+
+        if self.error is not None:
+            raise self.error
+
+    def on_sample(self, data):
+        self.send_event('ADDED', fields=data)
+
+    def on_error(self, error):
+        # `error` is None when sampler stopped with `StopSampling`
+        self.error = error
+        self._cancel_sync.set()
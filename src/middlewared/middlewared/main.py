@@ -28,11 +28,12 @@ from .utils.origin import ConnectionOrigin
 from .utils.os import close_fds
 from .utils.plugins import LoadPluginsMixin
 from .utils.privilege import credential_has_full_admin
+from .utils.process_pool import ProcessPool
 from .utils.profile import profile_wrap
 from .utils.rate_limit.cache import RateLimitCache
 from .utils.service.call import ServiceCallMixin
 from .utils.service.crud import real_crud_method
-from .utils.syslog import syslog_message
+from .utils.syslog import syslog_message, SyslogSender
 from .utils.threading import set_thread_name, IoThreadPoolExecutor, io_thread_pool_executor
 from .utils.time_utils import utc_now
 from .utils.type import copy_function_metadata
@@ -42,14 +43,13 @@ from aiohttp import web
 from aiohttp.http_websocket import WSCloseCode
 from aiohttp.web_exceptions import HTTPPermanentRedirect
 from aiohttp.web_middlewares import normalize_path_middleware
-from collections import defaultdict
+from collections import Counter, defaultdict
 
 import argparse
 import asyncio
 import binascii
 from collections import namedtuple
 import concurrent.futures
-import concurrent.futures.process
 import concurrent.futures.thread
 import contextlib
 from dataclasses import dataclass
@@ -79,7 +79,6 @@ import urllib.parse
 import uuid
 import tracemalloc
 
-from anyio import create_connected_unix_datagram_socket
 import psutil
 from systemd.daemon import notify as systemd_notify
 
@@ -123,7 +122,6 @@ class Application(RpcWebSocketApp):
         # Allow at most 10 concurrent calls and only queue up until 20
         self._softhardsemaphore = SoftHardSemaphore(10, 20)
         self._py_exceptions = False
-        self.__subscribed = {}
 
     def _send(self, data: typing.Dict[str, typing.Any]):
         serialized = json.dumps(data)
@@ -239,7 +237,7 @@ class Application(RpcWebSocketApp):
         if shortname in self.middleware.event_source_manager.event_sources:
             await self.middleware.event_source_manager.subscribe_app(self, self.__esm_ident(ident), shortname, arg)
         else:
-            self.__subscribed[ident] = name
+            self.add_subscription(ident, name)
 
         self._send({
             'msg': 'ready',
@@ -247,35 +245,17 @@ class Application(RpcWebSocketApp):
         })
 
     async def unsubscribe(self, ident):
-        if ident in self.__subscribed:
-            self.__subscribed.pop(ident)
+        if ident in self.subscriptions:
+            self.remove_subscription(ident)
         elif self.__esm_ident(ident) in self.middleware.event_source_manager.idents:
             await self.middleware.event_source_manager.unsubscribe(self.__esm_ident(ident))
 
     def __esm_ident(self, ident):
         return self.session_id + ident
 
-    def send_event(self, name, event_type, **kwargs):
-        if (
-            not any(i == name or i == '*' for i in self.__subscribed.values()) and
-            self.middleware.event_source_manager.short_name_arg(
-                name
-            )[0] not in self.middleware.event_source_manager.event_sources
-        ):
-            return
-        event = {
-            'msg': event_type.lower(),
-            'collection': name,
-        }
-        kwargs = kwargs.copy()
-        if 'id' in kwargs:
-            event['id'] = kwargs.pop('id')
-        if event_type in ('ADDED', 'CHANGED'):
-            if 'fields' in kwargs:
-                event['fields'] = kwargs.pop('fields')
-        if kwargs:
-            event['extra'] = kwargs
-        self._send(event)
+    @classmethod
+    def encode_event(cls, name, event_type, kwargs):
+        return json.dumps(cls.event_payload(name, event_type, kwargs))
 
     def notify_unsubscribed(self, collection, error):
         error_dict = {}
@@ -884,6 +864,8 @@ class Middleware(LoadPluginsMixin, ServiceCallMixin):
         multiprocessing.set_start_method('spawn')  # Spawn new processes for ProcessPool instead of forking
         self.__init_procpool()
         self.__wsclients = {}
+        # Collection name -> {session_id: number of subscriptions of that client}
+        self.__wsclient_subscriptions = defaultdict(Counter)
         self.role_manager = RoleManager(ROLES)
         self.events = Events(self.role_manager)
         self.event_source_manager = EventSourceManager(self)
@@ -897,6 +879,7 @@ class Middleware(LoadPluginsMixin, ServiceCallMixin):
         self.jobs = JobsQueue(self)
         self.mocks: typing.Dict[str, list[tuple[list, typing.Callable]]] = defaultdict(list)
         self.tasks = set()
+        self.audit_sender = SyslogSender('/dev/log', self.logger)
 
     def create_task(self, coro, *, name=None):
         task = self.loop.create_task(coro, name=name)
@@ -1181,6 +1164,31 @@ class Middleware(LoadPluginsMixin, ServiceCallMixin):
 
     def unregister_wsclient(self, client):
         self.__wsclients.pop(client.session_id)
+        for name in client.subscriptions.values():
+            self.unsubscribe_wsclient(client, name)
+
+    def subscribe_wsclient(self, client, name):
+        self.__wsclient_subscriptions[name][client.session_id] += 1
+
+    def unsubscribe_wsclient(self, client, name):
+        if (subscriptions := self.__wsclient_subscriptions.get(name)) is None:
+            return
+
+        subscriptions[client.session_id] -= 1
+        if subscriptions[client.session_id] <= 0:
+            subscriptions.pop(client.session_id)
+            if not subscriptions:
+                self.__wsclient_subscriptions.pop(name)
+
+    def __event_wsclients(self, name):
+        if self.event_source_manager.short_name_arg(name)[0] in self.event_source_manager.event_sources:
+            return list(self.__wsclients.values())
+
+        session_ids = set(self.__wsclient_subscriptions.get(name, ())) | set(self.__wsclient_subscriptions.get('*', ()))
+        return list(filter(None, map(self.__wsclients.get, session_ids)))
+
+    async def __send_event_messages(self, messages):
+        await asyncio.gather(*[ws.send_str(data) for ws, data in messages], return_exceptions=True)
 
     def register_hook(self, name, method, *, blockable=False, inline=False, order=0, raise_error=False, sync=True):
         """
@@ -1314,21 +1322,13 @@ class Middleware(LoadPluginsMixin, ServiceCallMixin):
         return await self.run_in_executor(io_thread_pool_executor, method, *args, **kwargs)
 
     def __init_procpool(self):
-        self.__procpool = concurrent.futures.ProcessPoolExecutor(
-            max_workers=5,
-            max_tasks_per_child=20,
-            initializer=functools.partial(worker_init, self.debug_level, self.log_handler)
-        )
+        self.__procpool = ProcessPool(functools.partial(worker_init, self.debug_level, self.log_handler))
 
     async def run_in_proc(self, method, *args, **kwargs):
-        retries = 2
-        for i in range(retries):
-            try:
-                return await self.run_in_executor(self.__procpool, method, *args, **kwargs)
-            except concurrent.futures.process.BrokenProcessPool:
-                if i == retries - 1:
-                    raise
-                self.__init_procpool()
+        return await self.__procpool.run(None, None, method, *args, **kwargs)
+
+    def process_pool_stats(self):
+        return self.__procpool.stats()
 
     def pipe(self, buffered=False):
         """
@@ -1418,7 +1418,13 @@ class Middleware(LoadPluginsMixin, ServiceCallMixin):
         return await self.run_in_executor(prepared_call.executor, methodobj, *prepared_call.args)
 
     async def _call_worker(self, name, *args, job=None):
-        return await self.run_in_proc(main_worker, name, args, job)
+        service_name = name.rsplit('.', 1)[0]
+        try:
+            concurrency = self.get_service(service_name)._config.process_pool_concurrency
+        except KeyError:
+            concurrency = None
+
+        return await self.__procpool.run(service_name, concurrency, main_worker, name, args, job)
 
     def dump_args(self, args, method=None, method_name=None):
         if method is None:
@@ -1633,8 +1639,7 @@ class Middleware(LoadPluginsMixin, ServiceCallMixin):
             }
         })
 
-        async with await create_connected_unix_datagram_socket("/dev/log") as s:
-            await s.send(syslog_message(message))
+        await self.audit_sender.send(syslog_message(message))
 
     async def call(self, name, *params, app=None, audit_callback=None, job_on_progress_cb=None, pipes=None,
                    profile=False):
@@ -1759,12 +1764,22 @@ class Middleware(LoadPluginsMixin, ServiceCallMixin):
 
         self.logger.trace(f'Sending event {name!r}:{event_type!r}:{kwargs!r}')
 
-        for session_id, wsclient in list(self.__wsclients.items()):
+        # Only encode the event once for every client class (i.e. API protocol) and send it to all subscribed clients
+        # in a single event loop iteration
+        encoded = {}
+        messages = []
+        for wsclient in self.__event_wsclients(name):
             try:
                 if should_send_event is None or should_send_event(wsclient):
-                    wsclient.send_event(name, event_type, **kwargs)
+                    if (data := encoded.get(wsclient.__class__)) is None:
+                        data = encoded[wsclient.__class__] = wsclient.encode_event(name, event_type, kwargs)
+
+                    messages.append((wsclient.ws, data))
             except Exception:
-                self.logger.warn('Failed to send event {} to {}'.format(name, session_id), exc_info=True)
+                self.logger.warn('Failed to send event {} to {}'.format(name, wsclient.session_id), exc_info=True)
+
+        if messages:
+            asyncio.run_coroutine_threadsafe(self.__send_event_messages(messages), loop=self.loop)
 
         async def wrap(handler):
             try:
@@ -2108,7 +2123,7 @@ class Middleware(LoadPluginsMixin, ServiceCallMixin):
         self.create_task(self.jobs.run())
 
         # Start up middleware worker process pool
-        self.__procpool._start_executor_manager_thread()
+        self.__procpool.start()
 
         self.runner = web.AppRunner(app, handle_signals=False, access_log=None)
         await self.runner.setup()
@@ -2170,6 +2185,11 @@ class Middleware(LoadPluginsMixin, ServiceCallMixin):
                 except Exception:
                     self.logger.error('Failed to terminate %s', service_name, exc_info=True)
 
+        try:
+            await asyncio.wait_for(self.audit_sender.flush(), 10)
+        except asyncio.TimeoutError:
+            self.logger.error('Timed out sending queued audit messages')
+
         for task in asyncio.all_tasks(loop=self.loop):
             if task != self.__terminate_task:
                 self.logger.trace("Canceling %r", task)
@@ -25,7 +25,7 @@ import middlewared.sqlalchemy as sa
 from middlewared.utils import run, filter_list
 from middlewared.utils.crypto import generate_nt_hash, sha512_crypt
 from middlewared.utils.directoryservices.constants import DSType, DSStatus
-from middlewared.utils.filesystem.copy import copytree, CopyTreeConfig
+from middlewared.utils.filesystem.copy import copytree, CopyTreeConfig, DEF_CP_THREADS
 from middlewared.utils.nss import pwd, grp
 from middlewared.utils.nss.nss_common import NssModule
 from middlewared.utils.privilege import credential_has_full_admin, privileges_group_mapping
@@ -34,6 +34,9 @@ from middlewared.utils.sid import db_id_to_rid, DomainRid
 from middlewared.plugins.account_.constants import (
     ADMIN_UID, ADMIN_GID, SKEL_PATH, DEFAULT_HOME_PATH, DEFAULT_HOME_PATHS
 )
+from middlewared.plugins.account_.utils import (
+    GROUP_SQL_FIELDS, USER_SQL_FIELDS, selects_key, split_sql_filters, sql_order_by, sql_paginate_options,
+)
 from middlewared.plugins.smb_.constants import SMBBuiltin
 from middlewared.plugins.idmap_.idmap_constants import (
     BASE_SYNTHETIC_DATASTORE_ID,
@@ -211,7 +214,8 @@ class UserService(CRUDService):
                 )
             }),
             'user_api_keys': user_api_keys,
-            'roles_mapping': {i['id']: i['roles'] for i in group_roles}
+            'roles_mapping': {i['id']: i['roles'] for i in group_roles},
+            'sshpubkey': extra.get('sshpubkey', True),
         }
 
     @private
@@ -231,8 +235,11 @@ class UserService(CRUDService):
         if user['email'] == '':
             user['email'] = None
 
-        # Get authorized keys
-        user['sshpubkey'] = await self.middleware.run_in_thread(self._read_authorized_keys, user['home'])
+        # Get authorized keys (unless user.query caller does not need them)
+        if ctx['sshpubkey']:
+            user['sshpubkey'] = await self.middleware.run_in_thread(self._read_authorized_keys, user['home'])
+        else:
+            user['sshpubkey'] = None
 
         user['immutable'] = user['builtin'] or (user['uid'] == ADMIN_UID)
         user['twofactor_auth_configured'] = bool(ctx['user_2fa_mapping'][user['id']])
@@ -288,6 +295,10 @@ class UserService(CRUDService):
         options['extend'] = self._config.datastore_extend
         options['extend_context'] = self._config.datastore_extend_context
         options['prefix'] = self._config.datastore_prefix
+        # Reading authorized_keys requires a file open in every home directory
+        options['extra'] = options.get('extra', {}) | {
+            'sshpubkey': selects_key('sshpubkey', filters, options),
+        }
 
         datastore_options = options.copy()
         datastore_options.pop('count', None)
@@ -315,8 +326,16 @@ class UserService(CRUDService):
                         # FIXME - map twofactor_auth_configured hint for LDAP users
                         pass
 
+        sql_filters, exact = split_sql_filters(filters, USER_SQL_FIELDS)
+        if exact and not ds_users:
+            if (order_by := sql_order_by(options.get('order_by', []), USER_SQL_FIELDS)) is not None:
+                # Let datastore paginate so that only returned rows are extended
+                return await self.middleware.call(
+                    'datastore.query', self._config.datastore, sql_filters, sql_paginate_options(options, order_by)
+                )
+
         result = await self.middleware.call(
-            'datastore.query', self._config.datastore, [], datastore_options
+            'datastore.query', self._config.datastore, sql_filters, datastore_options
         )
 
         return await self.middleware.run_in_thread(
@@ -1204,7 +1223,7 @@ class UserService(CRUDService):
 
         perm_job.wait_sync()
 
-        return asdict(copytree(home_old, home_new, CopyTreeConfig(exist_ok=True, job=job)))
+        return asdict(copytree(home_old, home_new, CopyTreeConfig(exist_ok=True, job=job, threads=DEF_CP_THREADS)))
 
     @private
     async def common_validation(self, verrors, data, schema, group_ids, old=None):
@@ -1628,8 +1647,16 @@ class GroupService(CRUDService):
             if ds['type'] is not None and ds['status'] == DSStatus.HEALTHY.name:
                 ds_groups = await self.middleware.call('directoryservices.cache.query', 'GROUP', filters, options)
 
+        sql_filters, exact = split_sql_filters(filters, GROUP_SQL_FIELDS)
+        if exact and not ds_groups:
+            if (order_by := sql_order_by(options.get('order_by', []), GROUP_SQL_FIELDS)) is not None:
+                # Let datastore paginate so that only returned rows are extended
+                return await self.middleware.call(
+                    'datastore.query', self._config.datastore, sql_filters, sql_paginate_options(options, order_by)
+                )
+
         result = await self.middleware.call(
-            'datastore.query', self._config.datastore, [], datastore_options
+            'datastore.query', self._config.datastore, sql_filters, datastore_options
         )
 
         return await self.middleware.run_in_thread(
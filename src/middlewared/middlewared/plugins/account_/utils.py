@@ -0,0 +1,110 @@
+from middlewared.utils import filter_getattrs
+
+# Keys of local user.query / group.query entries that hold the value of an SQL column
+# unchanged by the extend method, mapped to (column name without prefix, column type).
+USER_SQL_FIELDS = {
+    'id': ('id', int),
+    'uid': ('uid', int),
+    'username': ('username', str),
+    'home': ('home', str),
+    'shell': ('shell', str),
+    'full_name': ('full_name', str),
+    'builtin': ('builtin', bool),
+    'smb': ('smb', bool),
+    'password_disabled': ('password_disabled', bool),
+    'ssh_password_enabled': ('ssh_password_enabled', bool),
+    'locked': ('locked', bool),
+}
+GROUP_SQL_FIELDS = {
+    'id': ('id', int),
+    'gid': ('gid', int),
+    'group': ('group', str),
+    'name': ('group', str),
+    'builtin': ('builtin', bool),
+    'smb': ('smb', bool),
+}
+# Operators that are evaluated by SQL in the same way as by `filter_list`
+SQL_EXACT_OPS = ('=', 'in')
+
+
+def _local_filter_is_noop(filter_):
+    """ Filter on `local` that is true for every local account """
+    return filter_[0] == 'local' and filter_[1:] in (['=', True], ['!=', False])
+
+
+def _sql_filter(filter_, sql_fields):
+    if len(filter_) != 3 or (field := sql_fields.get(filter_[0])) is None or filter_[1] not in SQL_EXACT_OPS:
+        return None
+
+    column, column_type = field
+    values = [filter_[2]] if filter_[1] == '=' else filter_[2]
+    if not isinstance(values, list) or not all(isinstance(v, column_type) for v in values):
+        # Value of different type (or null) may compare differently in SQL
+        return None
+
+    return [column, filter_[1], filter_[2]]
+
+
+def split_sql_filters(filters, sql_fields):
+    """
+    Convert user.query / group.query `filters` to `datastore.query` filters that select
+    local accounts which may match them.
+
+    Returns tuple `(sql_filters, exact)` where `exact` is True when `sql_filters` select
+    exactly the local accounts matching `filters`. Otherwise `filters` still need to be
+    applied to the extended rows.
+    """
+    sql_filters = []
+    exact = True
+    for filter_ in filters:
+        if (sql_filter := _sql_filter(filter_, sql_fields)) is not None:
+            sql_filters.append(sql_filter)
+        elif not _local_filter_is_noop(filter_):
+            exact = False
+
+    return sql_filters, exact
+
+
+def sql_order_by(order_by, sql_fields):
+    """
+    Convert query `order_by` to `datastore.query` order_by or return None if it
+    can not be evaluated by SQL.
+    """
+    result = []
+    for order in order_by:
+        desc = order.startswith('-')
+        if (field := sql_fields.get(order.removeprefix('-'))) is None:
+            return None
+
+        result.append(f'{"-" if desc else ""}{field[0]}')
+
+    # Make page boundaries stable
+    return result + ['id']
+
+
+def selects_key(key, filters, options):
+    """
+    Whether `key` of entries is needed to evaluate `filters` and `options` (and so
+    has to be generated by the extend method).
+    """
+    if not (select := options.get('select')):
+        return True
+
+    if key in filter_getattrs(filters):
+        return True
+
+    if any(order.split(':')[-1].removeprefix('-') == key for order in options.get('order_by', [])):
+        return True
+
+    return any((i[0] if isinstance(i, list) else i) == key for i in select)
+
+
+def sql_paginate_options(options, order_by):
+    """
+    `datastore.query` options that return the page of local accounts requested by query `options`.
+    """
+    options = options | {'order_by': order_by}
+    if options.get('get'):
+        options['limit'] = 1
+
+    return options
@@ -1,8 +1,10 @@
+import asyncio
 from dataclasses import dataclass
 from collections import defaultdict, namedtuple
 import copy
 from datetime import datetime, timezone
 import errno
+import functools
 from itertools import zip_longest
 import os
 import textwrap
@@ -56,6 +58,10 @@ DEFAULT_POLICY = "IMMEDIATELY"
 ALERT_SOURCES = {}
 ALERT_SERVICES_FACTORIES = {}
 SEND_ALERTS_ON_READY = False
+# How many alert sources are checked at the same time
+ALERT_SOURCES_CONCURRENCY = 8
+# Extra time given to the other controller to report its own alert source timeout before the remote call times out
+ALERT_SOURCE_REMOTE_TIMEOUT_MARGIN = 10
 
 AlertSourceLock = namedtuple("AlertSourceLock", ["source_name", "expires_at"])
 
@@ -153,6 +159,11 @@ class AlertPolicy:
         self.last_key_value_alerts.pop(alert.uuid, None)
 
 
+def alert_key(alert):
+    """ Key of the `AlertService.alerts` entry of `alert` """
+    return alert.node, alert.source, alert.klass, alert.key
+
+
 def get_alert_level(alert, classes):
     return AlertLevel[classes.get(alert.klass.name, {}).get("level", alert.klass.level.name)]
 
@@ -226,7 +237,11 @@ class AlertService(Service):
             "max": 0,
             "total_count": 0,
             "total_time": 0,
+            "last_lag": [],
+            "max_lag": 0,
         })
+        # Checks that are still running after their source has timed out
+        self.sources_checks = {}
 
     @private
     def load_impl(self):
@@ -256,7 +271,7 @@ class AlertService(Service):
             if await self.middleware.call("failover.node") == "B":
                 self.node = "B"
 
-        self.alerts = []
+        self.alerts = {}
         if load:
             alerts_uuids = set()
             alerts_by_classes = defaultdict(list)
@@ -288,7 +303,8 @@ class AlertService(Service):
                 if isinstance(alerts[0].klass, OneShotAlertClass):
                     alerts = await alerts[0].klass.load(alerts)
 
-                self.alerts.extend(alerts)
+                for alert in alerts:
+                    self.alerts[alert_key(alert)] = alert
         else:
             await self.flush_alerts()
 
@@ -301,7 +317,7 @@ class AlertService(Service):
             "NEVER": AlertPolicy(lambda d: None),
         }
         for policy in self.policies.values():
-            policy.receive_alerts(utc_now(), self.alerts)
+            policy.receive_alerts(utc_now(), self.alerts.values())
 
     @private
     async def terminate(self):
@@ -359,7 +375,7 @@ class AlertService(Service):
         return [
             await as_.serialize(alert)
             for alert in sorted(
-                self.alerts,
+                self.alerts.values(),
                 key=lambda alert: (
                     -get_alert_level(alert, classes).value,
                     alert.klass.title,
@@ -396,7 +412,7 @@ class AlertService(Service):
 
     def __alert_by_uuid(self, uuid):
         try:
-            return [a for a in self.alerts if a.uuid == uuid][0]
+            return [a for a in self.alerts.values() if a.uuid == uuid][0]
         except IndexError:
             return None
 
@@ -412,7 +428,7 @@ class AlertService(Service):
 
         if issubclass(alert.klass, DismissableAlertClass):
             related_alerts, unrelated_alerts = bisect(lambda a: (a.node, a.klass) == (alert.node, alert.klass),
-                                                      self.alerts)
+                                                      self.alerts.values())
             left_alerts = await alert.klass(self.middleware).dismiss(related_alerts, alert)
             for deleted_alert in related_alerts:
                 if deleted_alert not in left_alerts:
@@ -424,11 +440,7 @@ class AlertService(Service):
             await self._send_alert_changed_event(alert)
 
     def _delete_on_dismiss(self, alert):
-        try:
-            self.alerts.remove(alert)
-            removed = True
-        except ValueError:
-            removed = False
+        removed = self.alerts.pop(alert_key(alert), None) is not None
 
         for policy in self.policies.values():
             policy.delete_alert(alert)
@@ -490,14 +502,14 @@ class AlertService(Service):
 
         now = utc_now()
         for policy_name, policy in self.policies.items():
-            gone_alerts, new_alerts = policy.receive_alerts(now, self.alerts)
+            gone_alerts, new_alerts = policy.receive_alerts(now, self.alerts.values())
 
             for alert_service_desc in await self.middleware.call("datastore.query", "system.alertservice",
                                                                  [["enabled", "=", True]]):
                 service_level = AlertLevel[alert_service_desc["level"]]
 
                 service_alerts = [
-                    alert for alert in self.alerts
+                    alert for alert in self.alerts.values()
                     if (
                         product_type in alert.klass.products and
                         get_alert_level(alert, classes).value >= service_level.value and
@@ -674,7 +686,7 @@ class AlertService(Service):
         locked = self.blocked_sources[name]
         if locked:
             self.logger.debug("Not running alert source %r because it is blocked", name)
-            for i in filter(lambda x: x.source == name, self.alerts):
+            for i in filter(lambda x: x.source == name, self.alerts.values()):
                 if i.node == this_node:
                     this_node_alerts.append(i)
                 elif i.node == other_node:
@@ -686,7 +698,10 @@ class AlertService(Service):
         other_node_alerts = []
         try:
             try:
-                for alert in await self.middleware.call("failover.call_remote", "alert.run_source", [name]):
+                for alert in await self.middleware.call(
+                    "failover.call_remote", "alert.run_source", [name],
+                    {"timeout": ALERT_SOURCES[name].run_timeout + ALERT_SOURCE_REMOTE_TIMEOUT_MARGIN},
+                ):
                     other_node_alerts.append(
                         Alert(**dict(
                             {k: v for k, v in alert.items() if k in keys},
@@ -716,6 +731,7 @@ class AlertService(Service):
             if source_lock.expires_at <= time.monotonic():
                 await self.unblock_source(k)
 
+        due_sources = []
         for alert_source in ALERT_SOURCES.values():
             if product_type not in alert_source.products:
                 continue
@@ -727,6 +743,36 @@ class AlertService(Service):
                 continue
 
             self.alert_source_last_run[alert_source.name] = utc_now()
+            due_sources.append(alert_source)
+
+        # Sources are independent of each other so a slow one should not delay the rest
+        semaphore = asyncio.Semaphore(ALERT_SOURCES_CONCURRENCY)
+        scheduled_at = time.monotonic()
+        results = await asyncio.gather(*[
+            self.__run_alert_source(alert_source, fi, semaphore, scheduled_at) for alert_source in due_sources
+        ])
+
+        for this_node_alerts, other_node_alerts in results:
+            for talert, oalert in zip_longest(this_node_alerts, other_node_alerts, fillvalue=None):
+                if talert is not None:
+                    talert.node = fi.this_node
+                    self.__handle_alert(talert)
+                if oalert is not None:
+                    oalert.node = fi.other_node
+                    self.__handle_alert(oalert)
+
+        ran_sources = {alert_source.name for alert_source in due_sources}
+        self.alerts = {k: a for k, a in self.alerts.items() if a.source not in ran_sources}
+        for this_node_alerts, other_node_alerts in results:
+            for alert in this_node_alerts + other_node_alerts:
+                self.alerts[alert_key(alert)] = alert
+
+    async def __run_alert_source(self, alert_source, fi, semaphore, scheduled_at):
+        async with semaphore:
+            lag = time.monotonic() - scheduled_at
+            source_stat = self.sources_run_times[alert_source.name]
+            source_stat["last_lag"] = source_stat["last_lag"][-9:] + [lag]
+            source_stat["max_lag"] = max(source_stat["max_lag"], lag)
 
             this_node_alerts, other_node_alerts, locked = await self.__handle_locked_alert_source(
                 alert_source.name, fi.this_node, fi.other_node
@@ -741,26 +787,10 @@ class AlertService(Service):
                 if fi.run_on_backup_node and alert_source.run_on_backup_node:
                     other_node_alerts = await self.__run_other_node_alert_source(alert_source.name)
 
-            for talert, oalert in zip_longest(this_node_alerts, other_node_alerts, fillvalue=None):
-                if talert is not None:
-                    talert.node = fi.this_node
-                    self.__handle_alert(talert)
-                if oalert is not None:
-                    oalert.node = fi.other_node
-                    self.__handle_alert(oalert)
-
-            self.alerts = (
-                [a for a in self.alerts if a.source != alert_source.name] + this_node_alerts + other_node_alerts
-            )
+            return this_node_alerts, other_node_alerts
 
     def __handle_alert(self, alert):
-        try:
-            existing_alert = [
-                a for a in self.alerts
-                if (a.node, a.source, a.klass, a.key) == (alert.node, alert.source, alert.klass, alert.key)
-            ][0]
-        except IndexError:
-            existing_alert = None
+        existing_alert = self.alerts.get(alert_key(alert))
 
         if existing_alert is None:
             alert.uuid = self.__uuid()
@@ -779,7 +809,7 @@ class AlertService(Service):
             alert.dismissed = existing_alert.dismissed
 
     def __expire_alerts(self):
-        self.alerts = list(filter(lambda alert: not self.__should_expire_alert(alert), self.alerts))
+        self.alerts = {k: alert for k, alert in self.alerts.items() if not self.__should_expire_alert(alert)}
 
     def __should_expire_alert(self, alert):
         if issubclass(alert.klass, OneShotAlertClass):
@@ -824,14 +854,38 @@ class AlertService(Service):
         # This values come from observation from support of how long a M-series boot can take.
         self.blocked_failover_alerts_until = time.monotonic() + 900
 
+    def __source_check_done(self, source_name, check):
+        self.sources_checks.pop(source_name, None)
+        # Nobody might be waiting for a check that has timed out, retrieve its exception so that it is not reported
+        # as never retrieved (it has already been handled or will be by the run that is waiting for it).
+        if not check.cancelled():
+            check.exception()
+
     async def __run_source(self, source_name):
         alert_source = ALERT_SOURCES[source_name]
 
+        # A check that has timed out keeps running, the next run waits for it instead of starting another one
+        if (check := self.sources_checks.get(source_name)) is None:
+            check = self.sources_checks[source_name] = asyncio.ensure_future(alert_source.check())
+            check.add_done_callback(functools.partial(self.__source_check_done, source_name))
+
         start = time.monotonic()
         try:
-            alerts = (await alert_source.check()) or []
+            alerts = (await asyncio.wait_for(asyncio.shield(check), alert_source.run_timeout)) or []
         except UnavailableException:
             raise
+        except asyncio.TimeoutError:
+            if source_name not in self.alert_sources_errors:
+                self.logger.error("Timed out checking for alert %r", alert_source.name)
+                self.alert_sources_errors.add(source_name)
+
+            alerts = [
+                Alert(AlertSourceRunFailedAlertClass,
+                      args={
+                          "source_name": alert_source.name,
+                          "traceback": f"Timed out after {alert_source.run_timeout} seconds",
+                      })
+            ]
         except Exception as e:
             if source_name not in self.alert_sources_errors:
                 self.logger.error("Error checking for alert %r", alert_source.name, exc_info=True)
@@ -880,7 +934,7 @@ class AlertService(Service):
 
         await self.middleware.call("datastore.delete", "system.alert", [])
 
-        for alert in self.alerts:
+        for alert in self.alerts.values():
             d = alert.__dict__.copy()
             d["klass"] = d["klass"].name
             del d["mail"]
@@ -918,7 +972,7 @@ class AlertService(Service):
 
         self.__handle_alert(alert)
 
-        self.alerts = [a for a in self.alerts if a.uuid != alert.uuid] + [alert]
+        self.alerts[alert_key(alert)] = alert
 
         await self.middleware.call("alert.send_alerts")
 
@@ -951,11 +1005,11 @@ class AlertService(Service):
                 raise CallError(f"Alert class {klassname!r} is not a one-shot alert source")
 
             related_alerts, unrelated_alerts = bisect(lambda a: (a.node, a.klass) == (self.node, klass),
-                                                      self.alerts)
+                                                      self.alerts.values())
             left_alerts = await klass(self.middleware).delete(related_alerts, query)
             for deleted_alert in related_alerts:
                 if deleted_alert not in left_alerts:
-                    self.alerts.remove(deleted_alert)
+                    self.alerts.pop(alert_key(deleted_alert), None)
                     deleted = True
 
         if deleted:
@@ -1,10 +1,20 @@
+import os
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
 from .utils import get_docker_client, PROJECT_KEY
 
 
+CGROUP_ROOT = '/sys/fs/cgroup'
+# Location of container cgroup depends on the cgroup driver docker uses (systemd / cgroupfs)
+CONTAINER_CGROUPS = ('system.slice/docker-{id}.scope', 'docker/{id}')
+# Number of containers queried over the docker API at the same time when their
+# stats can not be read from cgroup v2 files
+API_STATS_WORKERS = 8
+
+
 def get_default_stats():
     return defaultdict(lambda: {
         'cpu_usage': 0,
@@ -29,24 +39,120 @@ def list_resources_stats_by_project(project_name: str | None = None) -> dict:
                 raise
 
 
+def container_cgroup_path(container_id: str) -> str | None:
+    for cgroup in CONTAINER_CGROUPS:
+        if os.path.exists(path := os.path.join(CGROUP_ROOT, cgroup.format(id=container_id), 'cgroup.procs')):
+            return os.path.dirname(path)
+
+
+def read_net_dev(pid: int) -> dict:
+    """
+    Network interface counters of the network namespace of `pid`. Empty for processes in the
+    host namespace (docker does not report network stats for containers with host networking).
+    """
+    if os.stat(f'/proc/{pid}/ns/net').st_ino == os.stat('/proc/self/ns/net').st_ino:
+        return {}
+
+    networks = {}
+    with open(f'/proc/{pid}/net/dev') as f:
+        # skip two header lines
+        for line in f.readlines()[2:]:
+            name, counters = line.split(':', 1)
+            if (name := name.strip()) == 'lo':
+                continue
+
+            counters = counters.split()
+            networks[name] = {'rx_bytes': int(counters[0]), 'tx_bytes': int(counters[8])}
+
+    return networks
+
+
+def read_cgroup_stats(path: str) -> dict:
+    """
+    Stats of container with cgroup v2 at `path` in the same units as reported by docker API.
+    """
+    stats = {'cpu_usage': 0, 'memory': 0, 'networks': {}, 'blkio': {'read': 0, 'write': 0}}
+    with open(os.path.join(path, 'cpu.stat')) as f:
+        for line in f:
+            key, value = line.split()
+            if key == 'usage_usec':
+                stats['cpu_usage'] = int(value) * 1000
+                break
+
+    with open(os.path.join(path, 'memory.current')) as f:
+        stats['memory'] = int(f.read())
+
+    with open(os.path.join(path, 'io.stat')) as f:
+        for line in f:
+            for field in line.split()[1:]:
+                key, value = field.split('=', 1)
+                if key == 'rbytes':
+                    stats['blkio']['read'] += int(value)
+                elif key == 'wbytes':
+                    stats['blkio']['write'] += int(value)
+
+    with open(os.path.join(path, 'cgroup.procs')) as f:
+        if pid := f.readline().strip():
+            stats['networks'] = read_net_dev(int(pid))
+
+    return stats
+
+
+def read_api_stats(container) -> dict:
+    stats = container.stats(stream=False, decode=None, one_shot=True)
+    blkio_container_stats = stats.get('blkio_stats', {}).get('io_service_bytes_recursive') or {}
+    result = {
+        'cpu_usage': stats.get('cpu_stats', {}).get('cpu_usage', {}).get('total_usage', 0),
+        'memory': stats.get('memory_stats', {}).get('usage', 0),
+        'networks': stats.get('networks', {}),
+        'blkio': {'read': 0, 'write': 0},
+    }
+    for entry in filter(lambda x: x['op'] in ('read', 'write'), blkio_container_stats):
+        result['blkio'][entry['op']] += entry['value']
+
+    return result
+
+
+def add_container_stats(project_stats: dict, stats: dict):
+    project_stats['cpu_usage'] += stats['cpu_usage']
+    project_stats['memory'] += stats['memory']
+    project_stats['blkio']['read'] += stats['blkio']['read']
+    project_stats['blkio']['write'] += stats['blkio']['write']
+    for net_name, net_values in stats['networks'].items():
+        project_stats['networks'][net_name]['rx_bytes'] += net_values.get('rx_bytes', 0)
+        project_stats['networks'][net_name]['tx_bytes'] += net_values.get('tx_bytes', 0)
+
+
 def list_resources_stats_by_project_internal(project_name: str | None = None) -> dict:
     projects = get_default_stats()
     with get_docker_client() as client:
         label_filter = {'label': f'{PROJECT_KEY}={project_name}' if project_name else PROJECT_KEY}
-        for container in client.containers.list(all=True, filters=label_filter, sparse=False):
-            stats = container.stats(stream=False, decode=None, one_shot=True)
-            project = container.labels.get(PROJECT_KEY)
-            if not project:
+        # Sparse listing does not inspect every container, labels and state are already there
+        api_containers = []
+        for container in client.containers.list(all=True, filters=label_filter, sparse=True):
+            if not (project := (container.attrs.get('Labels') or {}).get(PROJECT_KEY)):
                 continue
 
-            blkio_container_stats = stats.get('blkio_stats', {}).get('io_service_bytes_recursive') or {}
+            # Project of stopped containers is still reported, just without any usage
             project_stats = projects[project]
-            project_stats['cpu_usage'] += stats.get('cpu_stats', {}).get('cpu_usage', {}).get('total_usage', 0)
-            project_stats['memory'] += stats.get('memory_stats', {}).get('usage', 0)
-            for entry in filter(lambda x: x['op'] in ('read', 'write'), blkio_container_stats):
-                project_stats['blkio'][entry['op']] += entry['value']
-            for net_name, net_values in stats.get('networks', {}).items():
-                project_stats['networks'][net_name]['rx_bytes'] += net_values.get('rx_bytes', 0)
-                project_stats['networks'][net_name]['tx_bytes'] += net_values.get('tx_bytes', 0)
+            if container.status != 'running':
+                continue
+
+            if (path := container_cgroup_path(container.id)) is None:
+                api_containers.append((project_stats, container))
+                continue
+
+            try:
+                add_container_stats(project_stats, read_cgroup_stats(path))
+            except (FileNotFoundError, ProcessLookupError):
+                # Container has stopped in the meantime
+                pass
+
+        if api_containers:
+            with ThreadPoolExecutor(min(API_STATS_WORKERS, len(api_containers))) as executor:
+                for (project_stats, container), stats in zip(
+                    api_containers, executor.map(lambda i: read_api_stats(i[1]), api_containers)
+                ):
+                    add_container_stats(project_stats, stats)
 
     return projects
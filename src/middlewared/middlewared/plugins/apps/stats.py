@@ -1,5 +1,4 @@
-import time
-
+from middlewared.common.event_source.sampler import SampledEventSourceMixin, Sampler, SamplerRegistry, StopSampling
 from middlewared.event import EventSource
 from middlewared.plugins.docker.state_utils import Status
 from middlewared.schema import Dict, Int, Str, List
@@ -10,7 +9,30 @@ from .ix_apps.docker.stats import list_resources_stats_by_project
 from .stats_util import normalize_projects_stats
 
 
-class AppStatsEventSource(EventSource):
+class AppStatsSampler(Sampler):
+
+    def setup(self):
+        if not self.middleware.call_sync('docker.state.validate', False):
+            raise CallError('Apps are not available')
+
+        self.old_projects_stats = list_resources_stats_by_project()
+        self.stopped.wait(self.interval)
+
+    def sample(self):
+        try:
+            project_stats = list_resources_stats_by_project()
+        except Exception:
+            if self.middleware.call_sync('docker.status')['status'] != Status.RUNNING.value:
+                raise StopSampling()
+
+            raise
+
+        data = normalize_projects_stats(project_stats, self.old_projects_stats, self.interval)
+        self.old_projects_stats = project_stats
+        return data
+
+
+class AppStatsEventSource(SampledEventSourceMixin, EventSource):
 
     """
     Retrieve statistics of apps.
@@ -47,27 +69,7 @@ class AppStatsEventSource(EventSource):
         ]
     )
 
-    def run_sync(self):
-        if not self.middleware.call_sync('docker.state.validate', False):
-            raise CallError('Apps are not available')
-
-        old_projects_stats = list_resources_stats_by_project()
-        interval = self.arg['interval']
-        time.sleep(interval)
-
-        while not self._cancel_sync.is_set():
-            try:
-                project_stats = list_resources_stats_by_project()
-                self.send_event(
-                    'ADDED', fields=normalize_projects_stats(project_stats, old_projects_stats, interval)
-                )
-                old_projects_stats = project_stats
-                time.sleep(interval)
-            except Exception:
-                if self.middleware.call_sync('docker.status')['status'] != Status.RUNNING.value:
-                    return
-
-                raise
+    SAMPLERS = SamplerRegistry(AppStatsSampler)
 
 
 def setup(middleware):
@@ -1,10 +1,12 @@
 import asyncio
 import csv
 import errno
+import itertools
 import json
 import middlewared.sqlalchemy as sa
 import os
 import shutil
+import textwrap
 import time
 import uuid
 import yaml
@@ -20,6 +22,9 @@ from .utils import (
     AUDIT_DEFAULT_FILL_WARNING,
     AUDIT_REPORTS_DIR,
     AUDITED_SERVICES,
+    AUDIT_QUERY_CHUNK_SIZE,
+    merge_query_results,
+    order_query_results,
     parse_query_filters,
     requires_python_filtering,
 )
@@ -31,7 +36,7 @@ from middlewared.schema import (
     accepts, Bool, Datetime, Dict, Int, List, Patch, Ref, returns, Str, UUID
 )
 from middlewared.service import filterable, filterable_returns, job, private, ConfigService
-from middlewared.service_exception import CallError, ValidationErrors, ValidationError
+from middlewared.service_exception import CallError, MatchNotFound, ValidationErrors, ValidationError
 from middlewared.utils import filter_list
 from middlewared.utils.mount import getmntinfo
 from middlewared.utils.functools_ import cache
@@ -160,6 +165,13 @@ class AuditService(ConfigService):
         converted into a more efficient form for better performance. This will
         not be possible if filters use keys within `svc_data` and `event_data`.
 
+        When multiple `services` are queried, `order_by`, `offset` and `limit`
+        apply to their combined results. The first `order_by` entry is the
+        primary sort key and nulls are ordered as the smallest values (unless
+        `nulls_first:` / `nulls_last:` is specified). This is the case for any
+        number of services, including queries that order by or filter on keys
+        within `service_data` and `event_data`.
+
         HA systems may direct the query to the 'remote' controller by
         including 'remote_controller=True'.  The default is the 'current' controller.
 
@@ -198,8 +210,6 @@ class AuditService(ConfigService):
         event message succeeded.
         """
 
-        verrors = ValidationErrors()
-
         # If HA, handle the possibility of remote controller requests
         if await self.middleware.call('failover.licensed') and data['remote_controller']:
             data.pop('remote_controller')
@@ -226,6 +236,49 @@ class AuditService(ConfigService):
                 self.logger.exception('Unexpected failure querying remote node for audit entries')
                 raise
 
+        services, filters, options, python_filtering = self.__plan_query(data)
+
+        if python_filtering:
+            results = []
+            for op in await asyncio.gather(*[
+                self.middleware.call('auditbackend.query', svc, filters, {})
+                for svc in services
+            ]):
+                results += op
+
+            return self.__filter_list(results, data)
+
+        if options['count']:
+            return sum(await asyncio.gather(*[
+                self.middleware.call('auditbackend.query', svc, filters, options)
+                for svc in services
+            ]))
+
+        if len(services) == 1:
+            return await self.middleware.call('auditbackend.query', services[0], filters, options)
+
+        # Each database returns its first `offset + limit` entries in requested order, which is enough to
+        # produce the requested page from them.
+        results = await asyncio.gather(*[
+            self.middleware.call('auditbackend.query', svc, filters, self.__merged_backend_options(options))
+            for svc in services
+        ])
+        entries = list(self.__merge_entries(results, options))
+        if options['get']:
+            try:
+                return entries[0]
+            except IndexError:
+                raise MatchNotFound() from None
+
+        return entries
+
+    def __plan_query(self, data):
+        """
+        Validate query `data` and decide how it should be executed. Returns a tuple of services to query (in
+        strict order), filters and options that should be passed to `auditbackend.query` and whether the
+        results have to be passed through `filter_list` with original query filters and options.
+        """
+        verrors = ValidationErrors()
         sql_filters = data['query-options']['force_sql_filters']
 
         if (select := data['query-options'].get('select')):
@@ -251,36 +304,98 @@ class AuditService(ConfigService):
 
         verrors.check()
 
-        if sql_filters:
-            filters = data['query-filters']
-            options = data['query-options']
-        else:
-            # Check whether we can pass to SQL backend directly
-            if requires_python_filtering(services_to_check, data['query-filters'], filters, data['query-options']):
-                options = {}
-            else:
-                options = data['query-options']
-                # set sql_filters so that we don't pass through filter_list
-                sql_filters = True
-
-        if options.get('count'):
-            results = 0
-        else:
-            results = []
-
         # `services_to_check` is a set and so ordering isn't guaranteed;
         # however, strict ordering when multiple databases are queried is
         # a requirement for pagination and consistent results.
-        for op in await asyncio.gather(*[
-            self.middleware.call('auditbackend.query', svc, filters, options)
-            for svc in ALL_AUDITED if svc in services_to_check
-        ]):
-            results += op
+        services = [svc for svc in ALL_AUDITED if svc in services_to_check]
 
         if sql_filters:
-            return results
+            return services, data['query-filters'], data['query-options'], False
+
+        # Check whether we can pass to SQL backend directly
+        if requires_python_filtering(services, data['query-filters'], filters, data['query-options']):
+            return services, filters, {}, True
 
-        return filter_list(results, data['query-filters'], data['query-options'])
+        return services, filters, data['query-options'], False
+
+    def __filter_list(self, entries, data):
+        """
+        `filter_list` of audit entries with query `data`. Entries are ordered by `order_query_results`
+        rather than `filter_list` so that the order is the same as if the query was evaluated in SQL.
+        """
+        options = data['query-options']
+        if not options['order_by']:
+            return filter_list(entries, data['query-filters'], options)
+
+        entries = order_query_results(filter_list(entries, data['query-filters']), options['order_by'])
+        return filter_list(entries, [], options | {'order_by': []})
+
+    def __merged_backend_options(self, options):
+        limit = 1 if options['get'] else options['limit']
+        return options | {
+            'offset': 0,
+            'limit': options['offset'] + limit if limit else 0,
+            'get': False,
+            # Columns used for ordering are needed to merge the results
+            'select': [],
+        }
+
+    def __merge_entries(self, results, options):
+        """
+        Lazily merge ordered results of multiple databases and apply `offset`, `limit` and `select` of
+        query `options` to them.
+        """
+        limit = 1 if options['get'] else options['limit']
+        entries = itertools.islice(
+            merge_query_results(results, options['order_by']),
+            options['offset'],
+            options['offset'] + limit if limit else None,
+        )
+        if select := options['select']:
+            entries = ({k: v for k, v in entry.items() if k in select} for entry in entries)
+
+        return entries
+
+    def __iter_entries(self, data):
+        """
+        Generator of audit entries matching query `data` that fetches them from databases in chunks. Also
+        returns the number of entries if it can be determined upfront.
+        """
+        services, filters, options, python_filtering = self.__plan_query(data)
+
+        def query_chunks(svc, options):
+            return self.middleware.call_sync('auditbackend.iter_query', svc, filters, options)
+
+        if python_filtering:
+            chunks = itertools.chain.from_iterable(query_chunks(svc, {}) for svc in services)
+            if data['query-options']['order_by']:
+                # All entries have to be retrieved before they can be ordered
+                entries = self.__filter_list(itertools.chain.from_iterable(chunks), data)
+                return iter(entries), len(entries)
+
+            offset = data['query-options']['offset']
+            limit = data['query-options']['limit']
+            entries = itertools.chain.from_iterable(
+                filter_list(chunk, data['query-filters'], {'select': data['query-options']['select']})
+                for chunk in chunks
+            )
+            return itertools.islice(entries, offset, offset + limit if limit else None), None
+
+        count = sum(
+            self.middleware.call_sync('auditbackend.query', svc, filters, {'count': True})
+            for svc in services
+        )
+        count = max(count - options['offset'], 0)
+        if options['limit']:
+            count = min(count, options['limit'])
+
+        if len(services) == 1:
+            return itertools.chain.from_iterable(query_chunks(services[0], options)), count
+
+        return self.__merge_entries([
+            itertools.chain.from_iterable(query_chunks(svc, self.__merged_backend_options(options)))
+            for svc in services
+        ], options), count
 
     @accepts(
         Patch(
@@ -311,9 +426,12 @@ class AuditService(ConfigService):
 
         export_format = data.pop('export_format')
         job.set_progress(0, f'Quering data for {export_format} audit report')
-        if not (res := self.middleware.call_sync('audit.query', data)):
+        entries, count = self.__iter_entries(data)
+        if (first := next(entries, None)) is None:
             raise CallError('No entries were returned by query.', errno.ENOENT)
 
+        entries = itertools.chain([first], entries)
+
         if job.credentials:
             username = job.credentials.user['username']
         else:
@@ -324,23 +442,41 @@ class AuditService(ConfigService):
 
         filename = f'{uuid.uuid4()}.{export_format.lower()}'
         destination = os.path.join(target_dir, filename)
+        written = 0
         with open(destination, 'w') as f:
-            job.set_progress(50, f'Writing audit report to {destination}.')
+            job.set_progress(0, f'Writing audit report to {destination}.')
             match export_format:
                 case 'CSV':
-                    fieldnames = res[0].keys()
-                    writer = csv.DictWriter(f, fieldnames=fieldnames)
+                    writer = csv.DictWriter(f, fieldnames=first.keys())
                     writer.writeheader()
-                    for entry in res:
-                        if entry.get('service_data'):
-                            entry['service_data'] = ejson.dumps(entry['service_data'])
-                        if entry.get('event_data'):
-                            entry['event_data'] = ejson.dumps(entry['event_data'])
-                        writer.writerow(entry)
                 case 'JSON':
-                    ejson.dump(res, f, indent=4)
-                case 'YAML':
-                    yaml.dump(res, f)
+                    f.write('[')
+
+            # Entries are written in chunks so that the whole report is never held in memory
+            while chunk := list(itertools.islice(entries, AUDIT_QUERY_CHUNK_SIZE)):
+                match export_format:
+                    case 'CSV':
+                        for entry in chunk:
+                            if entry.get('service_data'):
+                                entry['service_data'] = ejson.dumps(entry['service_data'])
+                            if entry.get('event_data'):
+                                entry['event_data'] = ejson.dumps(entry['event_data'])
+                            writer.writerow(entry)
+                    case 'JSON':
+                        for i, entry in enumerate(chunk, written):
+                            f.write(',\n' if i else '\n')
+                            f.write(textwrap.indent(ejson.dumps(entry, indent=4), '    '))
+                    case 'YAML':
+                        yaml.dump(chunk, f)
+
+                written += len(chunk)
+                if count:
+                    job.set_progress(min(written * 100 // count, 99), f'Written {written} of {count} audit entries.')
+                else:
+                    job.set_progress(50, f'Written {written} audit entries.')
+
+            if export_format == 'JSON':
+                f.write('\n]')
 
         job.set_progress(100, f'Audit report completed and available at {destination}')
         return os.path.join(target_dir, destination)
@@ -598,6 +734,14 @@ class AuditService(ConfigService):
             await self.middleware.call('alert.oneshot_create', 'AuditSetup', None)
             self.logger.error('Failed to apply auditing dataset configuration.', exc_info=True)
 
+    @private
+    async def sender_stats(self):
+        """
+        Health of sending middleware audit messages to syslog: number of queued, sent and dropped messages
+        and time spent in the queue.
+        """
+        return self.middleware.audit_sender.stats()
+
     @private
     @filterable
     async def json_schemas(self, filters, options):
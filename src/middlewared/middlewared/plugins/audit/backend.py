@@ -3,19 +3,26 @@ import threading
 import time
 
 from sqlalchemy import create_engine, inspect
-from sqlalchemy import and_, func, select
+from sqlalchemy import and_, func, literal_column, select
 from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import Session
 from sqlalchemy.sql.expression import nullsfirst, nullslast
 
-from middlewared.schema import accepts, Ref, Str
+from middlewared.schema import accepts, Int, Ref, Str
 from middlewared.service import periodic, private, Service
 from middlewared.service_exception import CallError, MatchNotFound
 
-from middlewared.plugins.audit.utils import AUDITED_SERVICES, audit_file_path, AUDIT_TABLES
+from middlewared.plugins.audit.utils import (
+    AUDITED_SERVICES, AUDIT_INDEX_PREFIX, AUDIT_QUERY_CHUNK_SIZE, audit_file_path, audit_indexes, audit_json_path,
+    AUDIT_TABLES,
+)
 from middlewared.plugins.datastore.filter import FilterMixin
 from middlewared.plugins.datastore.schema import SchemaMixin
 
+# Building an index gives up (and is retried by the next `auditbackend.ensure_indexes` run) if syslog-ng holds
+# the database write lock for longer than this many milliseconds
+AUDIT_INDEX_BUSY_TIMEOUT = 1000
+
 
 class SQLConn:
     def __init__(self, svc, vers):
@@ -26,6 +33,8 @@ class SQLConn:
         self.table = AUDIT_TABLES[svc]
         self.table_name = f'audit_{svc}_{str(vers).replace(".", "_")}'
         self.path = audit_file_path(svc)
+        self.indexes = audit_indexes(svc, self.table_name)
+        self.indexed = False
         self.engine = None
         self.connection = None
         self.lock = threading.RLock()
@@ -60,21 +69,59 @@ class SQLConn:
             self.connection.connection.execute('VACUUM')
             self.connection.execute('PRAGMA journal_mode=WAL')
             self.dbfd = os.open(self.path, os.O_PATH)
+            self.indexed = False
+
+    def ensure_indexes(self):
+        """
+        Create missing managed indexes (and drop the ones that are no longer managed). Table is created by
+        syslog-ng on first insertion so this is retried until it exists.
+
+        Indexing a large table takes a while. A separate connection is used so that queries are not blocked
+        meanwhile, and every index is built in its own transaction so that syslog-ng only has to wait for one
+        of them at a time.
+        """
+        with self.lock:
+            if self.engine is None or self.indexed or not self.audit_table_exists():
+                return
+
+            engine = self.engine
+
+        with engine.connect() as connection:
+            connection.exec_driver_sql(f'PRAGMA busy_timeout = {AUDIT_INDEX_BUSY_TIMEOUT}')
+            existing = {
+                row[0] for row in connection.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND name LIKE ?",
+                    [self.table_name, f'{AUDIT_INDEX_PREFIX}%'],
+                )
+            }
+            for name in existing - set(self.indexes):
+                connection.execute(f'DROP INDEX IF EXISTS "{name}"')
+
+            for name, expression in self.indexes.items():
+                if name not in existing:
+                    connection.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{self.table_name}" ({expression})')
 
-    def fetchall(self, query, params=None):
         with self.lock:
-            if (st := os.fstat(self.dbfd)).st_nlink == 0:
+            if self.engine is engine:
+                self.indexed = True
+
+    def check_database(self):
+        if (st := os.fstat(self.dbfd)).st_nlink == 0:
+            raise RuntimeError(
+                f'{self.path}: audit database was unexpectedly deleted.'
+            )
+
+        try:
+            if os.lstat(self.path).st_ino != st.st_ino:
                 raise RuntimeError(
-                    f'{self.path}: audit database was unexpectedly deleted.'
+                    f'{self.path}: audit database was unexpectedly replaced.'
                 )
+        except FileNotFoundError:
+            raise RuntimeError(f'{self.path}: audit database was renamed.')
 
-            try:
-                if os.lstat(self.path).st_ino != st.st_ino:
-                    raise RuntimeError(
-                        f'{self.path}: audit database was unexpectedly replaced.'
-                    )
-            except FileNotFoundError:
-                raise RuntimeError(f'{self.path}: audit database was renamed.')
+    def fetchall(self, query, params=None):
+        with self.lock:
+            self.check_database()
 
             try:
                 cursor = self.connection.execute(query, params or [])
@@ -91,6 +138,32 @@ class SQLConn:
             finally:
                 cursor.close()
 
+    def iterate(self, query, chunk_size):
+        """
+        Yield results of `query` in lists of at most `chunk_size` rows. A separate connection is used so
+        that other queries are not blocked while the caller processes the rows.
+        """
+        with self.lock:
+            self.check_database()
+            connection = self.engine.connect()
+
+        try:
+            try:
+                cursor = connection.execute(query)
+            except DBAPIError as e:
+                if not str(e.orig).startswith('no such table'):
+                    raise
+
+                return
+
+            try:
+                while rows := cursor.fetchmany(chunk_size):
+                    yield rows
+            finally:
+                cursor.close()
+        finally:
+            connection.close()
+
     def enforce_retention(self, days):
         if not days or days < 0:
             raise ValueError("Days must be positive value greater than zero.")
@@ -137,6 +210,15 @@ class AuditBackendService(Service, FilterMixin, SchemaMixin):
                     svc, exc_info=True
                 )
 
+    def _get_col(self, table, name, prefix=None):
+        if (json_path := audit_json_path(name)) is not None:
+            column, path = json_path
+            # Path has to be a literal (not a bound parameter) in order for SQLite to use expression indexes.
+            # It only consists of validated key names.
+            return func.json_extract(table.c[column], literal_column(f"'{path}'"))
+
+        return super()._get_col(table, name, prefix)
+
     @private
     def serialize_results(self, results, table, select):
         out = []
@@ -176,15 +258,56 @@ class AuditBackendService(Service, FilterMixin, SchemaMixin):
         audit backend and so it should generally not be used by websocket API
         consumers except in special circumstances.
         """
-        conn = self.connections[db_name]
-        order_by = options.get('order_by', []).copy()
-        from_ = conn.table
+        conn = self.__connection(db_name)
+        qs = self._build_query(conn, filters, options)
+
+        if options['count']:
+            if not (results := self.__fetchall(conn, qs)):
+                return 0
 
+            return results[0][0]
+
+        result = self.__fetchall(conn, qs)
+
+        if options['get']:
+            try:
+                return result[0]
+            except IndexError:
+                raise MatchNotFound() from None
+
+        return self.serialize_results(result, conn.table, options.get('select'))
+
+    @private
+    @accepts(
+        Str('db_name', enum=[svc[0] for svc in AUDITED_SERVICES], required=True),
+        Ref('query-filters'),
+        Ref('query-options'),
+        Int('chunk_size', default=AUDIT_QUERY_CHUNK_SIZE),
+    )
+    def iter_query(self, db_name, filters, options, chunk_size):
+        """
+        Same as `query` but returns a generator that yields the results in lists of at most `chunk_size`
+        entries so that they do not have to be held in memory all at once. `count` and `get` are not
+        supported.
+        """
+        conn = self.__connection(db_name)
+        qs = self._build_query(conn, filters, options | {'count': False})
+        for rows in conn.iterate(qs, chunk_size):
+            yield self.serialize_results(rows, conn.table, options.get('select'))
+
+    def __connection(self, db_name):
+        conn = self.connections[db_name]
         if conn.connection is None:
             raise CallError(
                 f'{db_name}: connection to audit database is not initialized.'
             )
 
+        return conn
+
+    def _build_query(self, conn, filters, options):
+        order_by = options.get('order_by', []).copy()
+        from_ = conn.table
+
         if options['count']:
             qs = select([func.count('ROW_ID')]).select_from(from_)
         else:
@@ -195,10 +318,7 @@ class AuditBackendService(Service, FilterMixin, SchemaMixin):
             qs = qs.where(and_(*self._filters_to_queryset(filters, conn.table, None, {})))
 
         if options['count']:
-            if not (results := self.__fetchall(conn, qs)):
-                return 0
-
-            return results[0][0]
+            return qs
 
         if order_by:
             for i, order in enumerate(order_by):
@@ -226,15 +346,23 @@ class AuditBackendService(Service, FilterMixin, SchemaMixin):
         if options['limit']:
             qs = qs.limit(options['limit'])
 
-        result = self.__fetchall(conn, qs)
+        return qs
 
-        if options['get']:
+    @private
+    @periodic(interval=600)
+    def ensure_indexes(self):
+        """
+        Build managed indexes of audit databases. This is done in the background rather than when connections
+        are set up or queried because indexing a large table takes a while and keeps syslog-ng from writing to
+        the database. Databases that are locked or do not have the audit table yet are retried by the next run.
+        """
+        for svc, conn in self.connections.items():
             try:
-                return result[0]
-            except IndexError:
-                raise MatchNotFound() from None
-
-        return self.serialize_results(result, conn.table, options.get('select'))
+                conn.ensure_indexes()
+            except DBAPIError:
+                self.logger.debug('%s: failed to create audit database indexes', svc, exc_info=True)
+            except Exception:
+                self.logger.error('%s: failed to create audit database indexes', svc, exc_info=True)
 
     @private
     @periodic(interval=86400)
@@ -1,9 +1,14 @@
+import heapq
+import itertools
 import middlewared.sqlalchemy as sa
+import operator
 import os
+import re
 
 from sqlalchemy import Table
 from sqlalchemy.orm import declarative_base
 from .schema.common import AuditEventParam
+from middlewared.utils import get, NULLS_FIRST, NULLS_LAST, OrderKey, REVERSE_CHAR
 
 AUDIT_DATASET_PATH = '/audit'
 AUDITED_SERVICES = [('MIDDLEWARE', 0.1), ('SMB', 0.1), ('SUDO', 0.1)]
@@ -24,6 +29,33 @@ SQL_SAFE_FIELDS = (
     AuditEventParam.EVENT.value,
     AuditEventParam.SUCCESS.value,
 )
+# Columns that results of several audit databases can be merged on in the order returned by SQL
+SQL_ORDER_FIELDS = SQL_SAFE_FIELDS + (AuditEventParam.TIMESTAMP.value,)
+# Number of rows fetched from audit database at once when iterating over large results
+AUDIT_QUERY_CHUNK_SIZE = 1000
+# JSON columns whose nested keys may be filtered in SQL with `json_extract`
+SQL_JSON_FIELDS = (
+    AuditEventParam.SERVICE_DATA.value,
+    AuditEventParam.EVENT_DATA.value,
+)
+# Operations on nested JSON keys that evaluate in SQL the same way as in `filter_list`. A missing key or
+# `null` value never matches them in either.
+SQL_JSON_OPS = ('=', 'in')
+SQL_JSON_KEY = re.compile(r'^[A-Za-z0-9_]+$')
+SQL_JSON_VALUE_TYPES = (str, int, float)  # includes bool
+# Expression indexes maintained on audit tables (in addition to the ones present in all of them) so that
+# common queries do not need to scan the whole table. Index name suffix -> indexed expression.
+AUDIT_INDEXES = {
+    'event': 'event',
+    'username': 'username',
+    'message_timestamp': 'message_timestamp',
+}
+AUDIT_SERVICE_INDEXES = {
+    'SMB': {
+        'event_data_file_path': "json_extract(event_data, '$.file.path')",
+    },
+}
+AUDIT_INDEX_PREFIX = 'tnaudit_idx_'
 
 
 AuditBase = declarative_base()
@@ -83,6 +115,111 @@ def generate_audit_table(svc, vers):
     )
 
 
+def audit_json_path(name):
+    """
+    Split filter key `name` of a nested key of JSON column (e.g. `event_data.file.path`) into the column name
+    and SQLite JSON path (`event_data`, `$.file.path`). Returns None if `name` can not be evaluated in SQL.
+    """
+    column, *keys = name.split('.')
+    if column not in SQL_JSON_FIELDS or not keys:
+        return None
+
+    if not all(SQL_JSON_KEY.match(key) and not key.isdigit() for key in keys):
+        # Array indexes, wildcards and escaped dots are only supported by `filter_list`
+        return None
+
+    return column, '$.' + '.'.join(keys)
+
+
+def is_sql_json_filter(f):
+    if audit_json_path(f[0]) is None or f[1] not in SQL_JSON_OPS:
+        return False
+
+    values = f[2] if f[1] == 'in' else [f[2]]
+    if not isinstance(values, list):
+        return False
+
+    return all(isinstance(value, SQL_JSON_VALUE_TYPES) for value in values)
+
+
+def audit_indexes(svc, table_name):
+    """
+    Names and indexed expressions of managed indexes of audit table `table_name` of `svc`.
+    """
+    return {
+        f'{AUDIT_INDEX_PREFIX}{table_name}_{suffix}': expression
+        for suffix, expression in (AUDIT_INDEXES | AUDIT_SERVICE_INDEXES.get(svc, {})).items()
+    }
+
+
+def parse_order(order):
+    """
+    Split `order_by` entry into column name, whether nulls go first and whether the order is descending.
+    Without explicit `nulls_first:` / `nulls_last:` prefix nulls are ordered as SQLite does it: as the
+    smallest value.
+    """
+    nulls_first = None
+    for prefix in (NULLS_FIRST, NULLS_LAST):
+        if order.startswith(prefix):
+            nulls_first = prefix == NULLS_FIRST
+            order = order[len(prefix):]
+            break
+
+    if reverse := order.startswith(REVERSE_CHAR):
+        order = order[1:]
+
+    if nulls_first is None:
+        nulls_first = not reverse
+
+    return order, nulls_first, reverse
+
+
+def audit_order_key(order_by):
+    """
+    Sort key that orders audit entries the same way `auditbackend.query` orders them in SQL for `order_by`.
+    Unlike `filter_list`, the first `order_by` entry is the primary key. Nested keys of JSON fields
+    (e.g. `event_data.file.path`) that are missing are ordered as nulls, like `json_extract` returns them.
+    """
+    columns = []
+    directions = []
+    for order in order_by:
+        name, nulls_first, reverse = parse_order(order)
+        # Rank of nulls is flipped for descending columns so that reversing the order does not move them
+        null_rank = 0 if nulls_first != reverse else 1
+        getter = (lambda entry, name=name: get(entry, name)) if '.' in name else operator.itemgetter(name)
+        columns.append((getter, (null_rank, None), 1 - null_rank))
+        directions.append(reverse)
+
+    directions = tuple(directions)
+
+    def key(entry):
+        return OrderKey(tuple(
+            null_value if (value := getter(entry)) is None else (non_null_rank, value)
+            for getter, null_value, non_null_rank in columns
+        ), directions)
+
+    return key
+
+
+def order_query_results(entries, order_by):
+    """
+    Order audit entries that could not be ordered by `auditbackend.query` (e.g. because they had to be filtered
+    in python) with the same precedence and null ordering as the ones that were ordered in SQL.
+    """
+    return sorted(entries, key=audit_order_key(order_by))
+
+
+def merge_query_results(results, order_by):
+    """
+    Lazily merge results of several audit databases (each already ordered by `order_by`) into one iterator.
+    Without `order_by` results are concatenated.
+    """
+    if not order_by:
+        return itertools.chain.from_iterable(results)
+
+    return heapq.merge(*results, key=audit_order_key(order_by))
+
+
 def parse_query_filters(
     services: list,
     filters: list,
@@ -101,8 +238,9 @@ def parse_query_filters(
     SQL-safe filters.
 
     We err on side of caution here since we're dealing with audit results.
-    This means that we skip optimized filters if the field is a JSON one, and
-    do not try to pass disjunctions to sqlalchemy. In future if needed we
+    This means that we only pass filters on nested keys of JSON fields if
+    SQLite evaluates them exactly as `filter_list` would (see `is_sql_json_filter`),
+    and do not try to pass disjunctions to sqlalchemy. In future if needed we
     can loosen these restrictions with appropriate levels of testing and
     validation in auditbackend plugin.
     """
@@ -144,8 +282,8 @@ def parse_query_filters(
             # User has manually specified to pass all these filters to datastore
             continue
 
-        if f[0] not in SQL_SAFE_FIELDS:
-            # Keys that contain JSON data are not currently supported
+        if f[0] not in SQL_SAFE_FIELDS and not is_sql_json_filter(f):
+            # Keys that contain JSON data are only supported for simple matches on nested keys
             continue
 
         filters_out.append(f)
@@ -168,8 +306,8 @@ def requires_python_filtering(
 
     2. We are selecting a subkey within a JSON object.
 
-    3. Multiple services are being queried and pagination options are being used
-       or a specific ordering is specified.
+    3. Multiple services are being queried and results are ordered by a key that
+       can not be used to merge results of multiple databases (see `SQL_ORDER_FIELDS`).
     """
     if filters_in != filters_for_sql:
         # We will need to do additional filtering after retrieval
@@ -183,13 +321,10 @@ def requires_python_filtering(
                 return True
 
     if len(services) > 1:
-        # When we have more than one database being queried we
-        # often need to pass the aggregated results to filter_list
-        if options.get('offset') or options.get('limit'):
-            # We need to do pagination on total results.
-            return True
-        if options.get('order_by'):
-            return True
+        # Ordered results of multiple databases are merged with `merge_query_results`
+        for order in options.get('order_by', []):
+            if parse_order(order)[0] not in SQL_ORDER_FIELDS:
+                return True
 
     return False
 
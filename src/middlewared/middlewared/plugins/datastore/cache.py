@@ -0,0 +1,124 @@
+from collections import defaultdict, OrderedDict
+import copy
+import functools
+import threading
+
+from middlewared.utils import freeze
+
+__all__ = ['query_cache']
+
+QUERY_CACHE_SIZE = 1024
+# Query options that affect which rows are fetched from the database. Other options (`extend`, `select`, ...)
+# are applied to the cached rows on every call.
+QUERY_CACHE_OPTIONS = ('relationships', 'prefix', 'order_by', 'offset', 'limit', 'count')
+
+
+class QueryCache:
+    """
+    Read-through cache of serialized `datastore.query` results.
+
+    Every entry records the set of tables it was built from (the queried table, tables joined through foreign keys
+    and many-to-many relationship tables). Writes invalidate every entry that depends on the written table or on a
+    table whose rows can be changed by `ON DELETE` actions of the written table's foreign keys.
+
+    `datastore.query` runs in the event loop while writes run in the datastore thread so all state is protected by
+    a lock. `generation` is incremented on every invalidation: a result is only stored if no write happened while it
+    was being fetched.
+
+    Per-table versions are kept as well so that consumers (e.g. `etc` files generation) can tell whether the tables
+    they depend on were written to since they last looked at them.
+    """
+
+    def __init__(self, size=QUERY_CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.entries = OrderedDict()
+        self.keys_by_table = defaultdict(set)
+        self.cleared = 0
+        self.table_versions = defaultdict(int)
+
+    def key(self, table_name, filters, options):
+        try:
+            return table_name, freeze(filters), freeze(tuple(options[k] for k in QUERY_CACHE_OPTIONS))
+        except TypeError:
+            # Unhashable filter values, do not cache
+            return None
+
+    def get(self, key):
+        with self.lock:
+            try:
+                tables, result = self.entries[key]
+            except KeyError:
+                return None
+
+            self.entries.move_to_end(key)
+
+        return copy.deepcopy(result)
+
+    def put(self, key, tables, result, generation):
+        result = copy.deepcopy(result)
+        with self.lock:
+            if generation != self.generation:
+                return
+
+            self.entries[key] = (tables, result)
+            self.entries.move_to_end(key)
+            for table in tables:
+                self.keys_by_table[table].add(key)
+
+            while len(self.entries) > self.size:
+                self._discard(next(iter(self.entries)))
+
+    def invalidate(self, table):
+        with self.lock:
+            self.generation += 1
+            for name in dependent_tables(table):
+                self.table_versions[name] += 1
+                for key in list(self.keys_by_table.pop(name, ())):
+                    self._discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            # Any table might have been changed
+            self.cleared += 1
+            self.entries.clear()
+            self.keys_by_table.clear()
+
+    def versions(self, table_names):
+        with self.lock:
+            return self.cleared, tuple(self.table_versions.get(name, 0) for name in table_names)
+
+    def _discard(self, key):
+        tables, result = self.entries.pop(key, (set(), None))
+        for table in tables:
+            if (keys := self.keys_by_table.get(table)) is not None:
+                keys.discard(key)
+                if not keys:
+                    self.keys_by_table.pop(table)
+
+
+@functools.cache
+def dependent_tables(written):
+    """
+    Names of the tables whose contents can change when `written` table is written to (including itself).
+    """
+    result = {written.name}
+    pending = [written.name]
+    while pending:
+        name = pending.pop()
+        for table in written.metadata.tables.values():
+            if table.name in result:
+                continue
+
+            for column in table.c:
+                if any(fk.ondelete is not None and fk.column.table.name == name for fk in column.foreign_keys):
+                    result.add(table.name)
+                    pending.append(table.name)
+                    break
+
+    return frozenset(result)
+
+
+query_cache = QueryCache()
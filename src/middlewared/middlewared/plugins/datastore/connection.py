@@ -9,6 +9,8 @@ from middlewared.service import private, Service
 
 from middlewared.plugins.config import FREENAS_DATABASE
 
+from .cache import query_cache
+
 thread_pool = ThreadPoolExecutor(1)
 
 
@@ -57,6 +59,8 @@ class DatastoreService(Service):
 
     @private
     def setup(self):
+        query_cache.clear()
+
         if self.engine is not None:
             self.engine.dispose()
 
@@ -82,7 +86,23 @@ class DatastoreService(Service):
 
     @private
     def execute(self, *args):
-        return self.connection.execute(*args)
+        try:
+            return self.connection.execute(*args)
+        finally:
+            # Raw SQL, we can't tell which tables were changed
+            query_cache.clear()
+
+    @private
+    def execute_many(self, queries):
+        """
+        Execute raw SQL `queries` (a list of `(sql, params)`) in a single transaction.
+        """
+        try:
+            with self.connection.begin():
+                for sql, params in queries:
+                    self.connection.execute(sql, params)
+        finally:
+            query_cache.clear()
 
     @private
     def execute_write(self, stmt, options=None):
@@ -90,28 +110,81 @@ class DatastoreService(Service):
         options.setdefault('ha_sync', True)
         options.setdefault('return_last_insert_rowid', False)
 
-        compiled = stmt.compile(self.engine, compile_kwargs={"render_postcompile": True})
-
-        sql = compiled.string
-        binds = []
-        for param in compiled.positiontup:
-            bind = compiled.binds[param]
-            value = bind.value
-            bind_processor = compiled.binds[param].type.bind_processor(self.engine.dialect)
-            if bind_processor:
-                binds.append(bind_processor(value))
-            else:
-                binds.append(value)
-
-        result = self.connection.execute(sql, binds)
+        try:
+            # SQLAlchemy caches compiled statements (and their bind processors) by statement shape
+            result = self.connection.execute(stmt)
+        finally:
+            self._invalidate_query_cache(stmt)
 
-        self.middleware.call_hook_inline("datastore.post_execute_write", sql, binds, options)
+        self.middleware.call_hook_inline("datastore.post_execute_write", *self._executed_sql(result), options)
 
         if options['return_last_insert_rowid']:
             return self.fetchall("SELECT last_insert_rowid()")[0][0]
 
         return result
 
+    @private
+    def execute_write_many(self, stmts, options=None):
+        """
+        Execute write statements in a single transaction and replicate them with a single
+        `datastore.post_execute_write_many` hook call.
+
+        `stmts` is a list of `(stmt, children)` where `children` are statements that write rows related to the row
+        written by `stmt` (e.g. many-to-many relationships). If `stmt` is an insert, its primary key is passed to them
+        as the `pk` bind parameter. `stmt` can be None if only `children` need to be executed.
+
+        Returns the inserted primary key (for inserts) or the number of affected rows (None if there was no
+        statement) for every `stmt`.
+
+        If `single_row` option is set, every update `stmt` must change exactly one row, otherwise the whole
+        transaction is rolled back and `RuntimeError` is raised.
+        """
+        options = options or {}
+        options.setdefault('ha_sync', True)
+        options.setdefault('single_row', False)
+
+        rv = []
+        queries = []
+        try:
+            with self.connection.begin():
+                for stmt, children in stmts:
+                    params = {}
+                    if stmt is None:
+                        rv.append(None)
+                    else:
+                        result = self.connection.execute(stmt)
+                        queries.append(self._executed_sql(result))
+                        if stmt.is_insert:
+                            rv.append(result.inserted_primary_key[0])
+                            params = {'pk': rv[-1]}
+                        else:
+                            if options['single_row'] and result.rowcount != 1:
+                                raise RuntimeError('No rows were updated')
+
+                            rv.append(result.rowcount)
+
+                    for child in children:
+                        queries.append(self._executed_sql(self.connection.execute(child, **params)))
+        finally:
+            for stmt, children in stmts:
+                for written in ([] if stmt is None else [stmt]) + children:
+                    self._invalidate_query_cache(written)
+
+        if queries:
+            self.middleware.call_hook_inline("datastore.post_execute_write_many", queries, options)
+
+        return rv
+
+    def _invalidate_query_cache(self, stmt):
+        if (table := getattr(stmt, 'table', None)) is not None:
+            query_cache.invalidate(table)
+        else:
+            query_cache.clear()
+
+    def _executed_sql(self, result):
+        # Exactly what was sent to SQLite (with expanded `IN` parameters and processed bind values)
+        return result.context.statement, list(result.context.parameters[0]) if result.context.parameters else []
+
     @private
     def fetchall(self, query, params=None):
         cursor = self.connection.execute(query, params or [])
@@ -51,6 +51,22 @@ class DatastoreService(Service):
                 fields=fields[0],
             )
 
+    async def send_insert_many_events(self, datastore, rows):
+        for options in self.events[datastore]:
+            ids = [row[options["prefix"] + options["id"]] for row in rows]
+            fields = await self._fields_many(options, ids)
+            for id_ in ids:
+                if id_ in fields:
+                    await self._send_event(options, "ADDED", id=id_, fields=fields[id_])
+
+    async def send_update_many_events(self, datastore, ids):
+        for options in self.events[datastore]:
+            fields = await self._fields_many(options, ids)
+            for id_ in ids:
+                # Rows might have been deleted in the meantime
+                if id_ in fields:
+                    await self._send_event(options, "CHANGED", id=id_, fields=fields[id_])
+
     async def send_delete_events(self, datastore, id_):
         for options in self.events[datastore]:
             await self._send_event(options, "REMOVED", id=id_)
@@ -66,6 +82,18 @@ class DatastoreService(Service):
             query_options,
         )
 
+    async def _fields_many(self, options, ids):
+        query_options = {}
+        if options.get("extra"):
+            query_options["extra"] = options["extra"]
+
+        return {
+            row[options["id"]]: row
+            for row in await self.middleware.call(
+                f"{options['plugin']}.query", [[options["id"], "in", list(ids)]], query_options,
+            )
+        }
+
     async def _send_event(self, options, type_, **kwargs):
         if options["process_event"]:
             processed = await self.middleware.call(options["process_event"], type_, kwargs)
@@ -1,4 +1,4 @@
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 import re
 
 from sqlalchemy import and_, func, select
@@ -13,11 +13,16 @@ from middlewared.service_exception import MatchNotFound
 from middlewared.utils import filters
 from middlewared.validators import QueryFilters, QueryOptions
 
+from .cache import query_cache
 from .filter import FilterMixin
 from .schema import SchemaMixin
 
 
 do_select = filters().do_select
+QueryPlan = namedtuple('QueryPlan', 'aliases,columns,from_,tables,row_plan')
+# `columns` is a sequence of `(key, index)`, `foreign_keys` is a sequence of `(key, fk_index, pk_index, RowPlan)`
+RowPlan = namedtuple('RowPlan', 'columns,foreign_keys')
+query_plans = {}
 
 
 def regexp(expr, item):
@@ -88,27 +93,52 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
         # which might happen with "prefix"
         options = options.copy()
 
-        aliases = {}
+        cache_key = query_cache.key(table.name, filters, options)
+        result = query_cache.get(cache_key) if cache_key is not None else None
+        if result is None:
+            generation = query_cache.generation
+            result, tables = await self._query_rows(table, filters, options)
+            if cache_key is not None:
+                query_cache.put(cache_key, tables, result, generation)
+
         if options['count']:
-            qs = select([func.count(self._get_pk(table))])
-        else:
-            columns = list(table.c)
-            from_ = table
-            if options['relationships']:
-                aliases = self._get_queryset_joins(table)
-                for foreign_key, alias in aliases.items():
-                    columns.extend(list(alias.c))
-                    from_ = from_.outerjoin(alias, alias.c[foreign_key.column.name] == foreign_key.parent)
+            return result
+
+        result = await self._queryset_extend(
+            result, options['extend'], options['extend_context'], options['select'], options['extra'],
+        )
+
+        if options['get']:
+            try:
+                return result[0]
+            except IndexError:
+                raise MatchNotFound() from None
 
-            qs = select(columns).select_from(from_)
+        return result
 
+    async def _query_rows(self, table, filters, options):
+        """
+        Fetch and serialize rows (or row count) matching `filters`.
+
+        Returns the result and the set of table names it was built from.
+        """
         prefix = options['prefix']
+        plan = self._get_query_plan(table, options['relationships'], prefix)
+        tables = set(plan.tables)
+
+        aliases = {}
+        if options['count']:
+            qs = select([func.count(self._get_pk(table))])
+            tables = {table.name}
+        else:
+            aliases = plan.aliases
+            qs = select(plan.columns).select_from(plan.from_)
 
         if filters:
             qs = qs.where(and_(*self._filters_to_queryset(filters, table, prefix, aliases)))
 
         if options['count']:
-            return (await self.middleware.call("datastore.fetchall", qs))[0][0]
+            return (await self.middleware.call("datastore.fetchall", qs))[0][0], tables
 
         order_by = options['order_by']
         if order_by:
@@ -146,19 +176,10 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
             # This will only fetch many-to-many relationships for primary table, not for joins, but that's enough
             relationships = await self._fetch_many_to_many(table, result)
 
-        result = await self._queryset_serialize(
-            result,
-            table, aliases, relationships, options['extend'], options['extend_context'], options['prefix'],
-            options['select'], options['extra'],
-        )
-
-        if options['get']:
-            try:
-                return result[0]
-            except IndexError:
-                raise MatchNotFound() from None
-
-        return result
+        return [
+            self._serialize(row, plan.row_plan, relationships[i], prefix)
+            for i, row in enumerate(result)
+        ], tables
 
     @accepts(Str('name'), Ref('query-options'))
     async def config(self, name, options):
@@ -170,6 +191,70 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
         options['get'] = True
         return await self.query(name, [], options)
 
+    async def table_versions(self, names):
+        """
+        Opaque value that changes every time contents of any of `names` tables might have changed.
+        """
+        return query_cache.versions([self._get_table(name).name for name in names])
+
+    def _get_query_plan(self, table, relationships, field_prefix):
+        """
+        Join aliases, selected columns and row serialization plan only depend on the schema so they are only built
+        once for every table.
+        """
+        key = (table, relationships, field_prefix)
+        if (plan := query_plans.get(key)) is None:
+            plan = query_plans[key] = self._build_query_plan(table, relationships, field_prefix)
+
+        return plan
+
+    def _build_query_plan(self, table, relationships, field_prefix):
+        tables = {table.name}
+        columns = list(table.c)
+        from_ = table
+        aliases = {}
+        if relationships:
+            aliases = self._get_queryset_joins(table)
+            for foreign_key, alias in aliases.items():
+                columns.extend(list(alias.c))
+                from_ = from_.outerjoin(alias, alias.c[foreign_key.column.name] == foreign_key.parent)
+                tables.add(foreign_key.column.table.name)
+
+            for relationship in self._get_relationships(table).values():
+                tables.update({relationship.secondary.name, relationship.target.name})
+
+        positions = {column: i for i, column in enumerate(columns)}
+        return QueryPlan(
+            aliases, columns, from_, frozenset(tables),
+            self._build_row_plan(table, aliases, positions, field_prefix),
+        )
+
+    def _build_row_plan(self, table, aliases, positions, field_prefix=None):
+        columns = []
+        for column in table.c:
+            # aliases == {} when we are loading without relationships, let's leave fk values in that case
+            if not column.foreign_keys or not aliases:
+                columns.append((self._strip_prefix(str(column.name), field_prefix), positions[column]))
+
+        foreign_keys = []
+        for foreign_key, alias in aliases.items():
+            column = foreign_key.parent
+
+            if column.table != table:
+                continue
+
+            if not column.name.endswith('_id'):
+                raise RuntimeError('Foreign key column must end with _id')
+
+            foreign_keys.append((
+                self._strip_prefix(column.name[:-3], field_prefix),
+                positions[column],
+                positions[self._get_pk(alias)],
+                self._build_row_plan(alias, aliases, positions),
+            ))
+
+        return RowPlan(tuple(columns), tuple(foreign_keys))
+
     def _get_queryset_joins(self, table):
         result = {}
         for column in table.c:
@@ -186,13 +271,7 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
 
         return result
 
-    async def _queryset_serialize(
-        self, qs, table, aliases, relationships, extend, extend_context, field_prefix, select, extra_options,
-    ):
-        rows = []
-        for i, row in enumerate(qs):
-            rows.append(self._serialize(row, table, aliases, relationships[i], field_prefix))
-
+    async def _queryset_extend(self, rows, extend, extend_context, select, extra_options):
         if extend_context:
             extend_context_value = await self.middleware.call(extend_context, rows, extra_options)
         else:
@@ -203,11 +282,12 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
             for data in rows
         ]
 
-    def _serialize(self, obj, table, aliases, relationships, field_prefix):
-        data = self._serialize_row(obj, table, aliases)
-        data.update(relationships)
+    def _serialize(self, obj, row_plan, relationships, field_prefix):
+        data = self._serialize_row(obj, row_plan)
+        for k, v in relationships.items():
+            data[self._strip_prefix(k, field_prefix)] = v
 
-        return {self._strip_prefix(k, field_prefix): v for k, v in data.items()}
+        return data
 
     async def _extend(self, data, extend, extend_context, extend_context_value, select):
         if extend:
@@ -224,26 +304,13 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
     def _strip_prefix(self, k, field_prefix):
         return k[len(field_prefix):] if field_prefix and k.startswith(field_prefix) else k
 
-    def _serialize_row(self, obj, table, aliases):
-        data = {}
-
-        for column in table.c:
-            # aliases == {} when we are loading without relationships, let's leave fk values in that case
-            if not column.foreign_keys or not aliases:
-                data[str(column.name)] = obj[column]
-
-        for foreign_key, alias in aliases.items():
-            column = foreign_key.parent
-
-            if column.table != table:
-                continue
-
-            if not column.name.endswith('_id'):
-                raise RuntimeError('Foreign key column must end with _id')
+    def _serialize_row(self, obj, row_plan):
+        data = {key: obj[index] for key, index in row_plan.columns}
 
-            data[column.name[:-3]] = (
-                self._serialize_row(obj, alias, aliases)
-                if obj[column] is not None and obj[self._get_pk(alias)] is not None
+        for key, fk_index, pk_index, alias_row_plan in row_plan.foreign_keys:
+            data[key] = (
+                self._serialize_row(obj, alias_row_plan)
+                if obj[fk_index] is not None and obj[pk_index] is not None
                 else None
             )
 
@@ -2,6 +2,8 @@ from sqlalchemy import inspect
 
 from middlewared.sqlalchemy import Model
 
+relationships_cache = {}
+
 
 class SchemaMixin:
     def _get_table(self, name):
@@ -30,6 +32,12 @@ class SchemaMixin:
             return table.c[f'{name}_id']
 
     def _get_relationships(self, table):
+        if (relationships := relationships_cache.get(table)) is None:
+            relationships = relationships_cache[table] = self._find_relationships(table)
+
+        return relationships
+
+    def _find_relationships(self, table):
         for model in Model.registry._class_registry.values():
             if hasattr(model, "__tablename__") and model.__tablename__ == table.name:
                 break
@@ -1,7 +1,7 @@
-from sqlalchemy import and_, types
+from sqlalchemy import and_, bindparam, types
 from sqlalchemy.sql import sqltypes
 
-from middlewared.schema import accepts, Any, Bool, Dict, Str
+from middlewared.schema import accepts, Any, Bool, Dict, List, Str
 from middlewared.service import Service
 
 from .filter import FilterMixin
@@ -48,14 +48,7 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
         Insert a new entry to `name`.
         """
         table = self._get_table(name)
-        insert, relationships = self._extract_relationships(table, options['prefix'], data)
-
-        for column in table.c:
-            if column.default is not None:
-                insert.setdefault(column.name, column.default.arg)
-            if not column.nullable:
-                if isinstance(column.type, (types.String, types.Text)):
-                    insert.setdefault(column.name, '')
+        insert, relationships = self._insert_values(table, options['prefix'], data)
 
         pk_column = self._get_pk(table)
         return_last_insert_rowid = type(pk_column.type) == sqltypes.Integer
@@ -79,6 +72,45 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
 
         return pk
 
+    @accepts(
+        Str('name'),
+        List('data', items=[Dict('data', additional_attrs=True)]),
+        Dict(
+            'options',
+            Bool('ha_sync', default=True),
+            Str('prefix', default=''),
+            Bool('send_events', default=True),
+        ),
+    )
+    async def insert_many(self, name, data, options):
+        """
+        Insert multiple entries to `name` in a single transaction.
+
+        Returns the list of inserted primary keys.
+        """
+        table = self._get_table(name)
+        pk_column = self._get_pk(table)
+
+        inserts = []
+        stmts = []
+        for row in data:
+            insert, relationships = self._insert_values(table, options['prefix'], row)
+            inserts.append(insert)
+            stmts.append((
+                table.insert().values(**insert),
+                self._relationships_statements(bindparam('pk'), relationships),
+            ))
+
+        pks = await self.middleware.call('datastore.execute_write_many', stmts, {'ha_sync': options['ha_sync']})
+
+        if options['send_events']:
+            for insert, pk in zip(inserts, pks):
+                insert.setdefault(pk_column.name, pk)
+
+            await self.middleware.call('datastore.send_insert_many_events', name, inserts)
+
+        return pks
+
     @accepts(
         Str('name'),
         Any('id_or_filters'),
@@ -95,7 +127,6 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
         Update an entry `id` in `name`.
         """
         table = self._get_table(name)
-        data = data.copy()
 
         if isinstance(id_or_filters, list):
             rows = await self.middleware.call('datastore.query', name, id_or_filters, {'prefix': options['prefix']})
@@ -106,12 +137,7 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
         else:
             id_ = id_or_filters
 
-        for column in table.c:
-            if column.foreign_keys:
-                if column.name[:-3] in data:
-                    data[column.name] = data.pop(column.name[:-3])
-
-        update, relationships = self._extract_relationships(table, options['prefix'], data)
+        update, relationships = self._update_values(table, options['prefix'], data)
 
         if update:
             result = await self.middleware.call(
@@ -131,6 +157,69 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
 
         return id_
 
+    @accepts(
+        Str('name'),
+        List('updates', items=[List('update', items=[Any('id'), Dict('data', additional_attrs=True)])]),
+        Dict(
+            'options',
+            Bool('ha_sync', default=True),
+            Str('prefix', default=''),
+            Bool('send_events', default=True),
+        ),
+    )
+    async def update_many(self, name, updates, options):
+        """
+        Update multiple entries in `name` in a single transaction.
+
+        `updates` is a list of `[id, data]` pairs. Returns the list of updated ids.
+        """
+        table = self._get_table(name)
+        pk_column = self._get_pk(table)
+
+        ids = []
+        stmts = []
+        for update in updates:
+            if len(update) != 2:
+                raise ValueError(f'Invalid update {update!r}: must be an [id, data] pair')
+
+            id_, data = update
+            update, relationships = self._update_values(table, options['prefix'], data)
+            ids.append(id_)
+            stmts.append((
+                table.update().values(**update).where(pk_column == id_) if update else None,
+                self._relationships_statements(id_, relationships),
+            ))
+
+        await self.middleware.call(
+            'datastore.execute_write_many', stmts, {'ha_sync': options['ha_sync'], 'single_row': True},
+        )
+
+        if options['send_events']:
+            await self.middleware.call('datastore.send_update_many_events', name, ids)
+
+        return ids
+
+    def _insert_values(self, table, prefix, data):
+        insert, relationships = self._extract_relationships(table, prefix, data)
+
+        for column in table.c:
+            if column.default is not None:
+                insert.setdefault(column.name, column.default.arg)
+            if not column.nullable:
+                if isinstance(column.type, (types.String, types.Text)):
+                    insert.setdefault(column.name, '')
+
+        return insert, relationships
+
+    def _update_values(self, table, prefix, data):
+        data = data.copy()
+        for column in table.c:
+            if column.foreign_keys:
+                if column.name[:-3] in data:
+                    data[column.name] = data.pop(column.name[:-3])
+
+        return self._extract_relationships(table, prefix, data)
+
     def _extract_relationships(self, table, prefix, data):
         relationships = self._get_relationships(table)
 
@@ -146,6 +235,11 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
         return insert, insert_relationships
 
     async def _handle_relationships(self, pk, relationships):
+        for stmt in self._relationships_statements(pk, relationships):
+            await self.middleware.call('datastore.execute_write', stmt)
+
+    def _relationships_statements(self, pk, relationships):
+        stmts = []
         for relationship, values in relationships:
             assert len(relationship.synchronize_pairs) == 1
             assert len(relationship.secondary_synchronize_pairs) == 1
@@ -153,19 +247,15 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
             local_pk, relationship_local_pk = relationship.synchronize_pairs[0]
             remote_pk, relationship_remote_pk = relationship.secondary_synchronize_pairs[0]
 
-            await self.middleware.call(
-                'datastore.execute_write',
-                relationship_local_pk.table.delete().where(relationship_local_pk == pk)
-            )
+            stmts.append(relationship_local_pk.table.delete().where(relationship_local_pk == pk))
 
             for value in values:
-                await self.middleware.call(
-                    'datastore.execute_write',
-                    relationship_local_pk.table.insert().values({
-                        relationship_local_pk.name: pk,
-                        relationship_remote_pk.name: value,
-                    })
-                )
+                stmts.append(relationship_local_pk.table.insert().values({
+                    relationship_local_pk.name: pk,
+                    relationship_remote_pk.name: value,
+                }))
+
+        return stmts
 
     def _where_clause(self, table, id_or_filters, options):
         if isinstance(id_or_filters, list):
@@ -163,9 +163,9 @@ class DSCache(Service):
 
             return [entry] if entry else []
 
-        # options must be omitted to defer pagination logic to caller
-        entries = query_cache_entries(IDType[id_type], filters, {})
-        return sorted(entries, key=lambda i: i['id'])
+        # options must be omitted to defer pagination logic to caller. Entries
+        # are returned ordered by `id`.
+        return query_cache_entries(IDType[id_type], filters, {})
 
     def idmap_online_check_wait_wbclient(self, job):
         """
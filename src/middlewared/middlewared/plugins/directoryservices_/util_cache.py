@@ -7,7 +7,6 @@ from middlewared.utils.directoryservices.constants import (
     DSType
 )
 from middlewared.job import Job
-from middlewared.utils import filter_list
 from middlewared.utils.itertools import batched
 from middlewared.utils.nss import pwd, grp
 from middlewared.utils.nss.nss_common import NssModule
@@ -31,6 +30,7 @@ from middlewared.utils.tdb import (
 )
 from threading import Lock
 from uuid import uuid4
+from .util_cache_index import DSCacheIndex
 
 # Update progress of job every nth user / group, we expect possibly hundreds to
 # a few thousand users and groups, but some edge cases where they number in
@@ -41,6 +41,10 @@ LOG_CACHE_ENTRY_INTERVAL = 10  # Update progress of job every nth user / group
 
 TDB_LOCKS = defaultdict(Lock)
 
+# In-memory mirrors of the cache files keyed by DSCacheFile. Always accessed
+# through `get_cache_index()`, which rebuilds a mirror if its TDB file was replaced.
+DS_CACHE_INDEXES = {}
+
 CACHE_OPTIONS = TDBOptions(TDBPathType.PERSISTENT, TDBDataType.JSON)
 
 
@@ -52,6 +56,11 @@ class DSCacheFile(enum.Enum):
     def path(self):
         return os.path.join(TDBPathType.PERSISTENT.value, f'{self.value}.tdb')
 
+    @property
+    def index_keys(self):
+        """ keys of posix id and name in cache entries """
+        return ('uid', 'username') if self is DSCacheFile.USER else ('gid', 'name')
+
 
 class DSCacheFill:
     """
@@ -67,6 +76,8 @@ class DSCacheFill:
     """
     users_handle = None
     groups_handle = None
+    users = None
+    groups = None
 
     def __enter__(self):
         file_prefix = f'directory_service_cache_tmp_{uuid4()}'
@@ -77,6 +88,8 @@ class DSCacheFill:
         os.chmod(self.users_handle.full_path, 0o600)
         self.groups_handle.clear()
         os.chmod(self.groups_handle.full_path, 0o600)
+        self.users = []
+        self.groups = []
         return self
 
     def __exit__(self, tp, value, tb):
@@ -98,13 +111,21 @@ class DSCacheFill:
 
     def _commit(self):
         """
-        Rename our temporary caches over ones in-use by middleware.
+        Rename our temporary caches over ones in-use by middleware and replace
+        the in-memory indexes with ones built from the entries we just wrote.
 
         This will be detected on next call to read / insert into cache.
         Stale handle will be closed and new one opened.
         """
-        os.rename(self.users_handle.full_path, DSCacheFile.USER.path)
-        os.rename(self.groups_handle.full_path, DSCacheFile.GROUP.path)
+        for cache_file, handle, entries in (
+            (DSCacheFile.USER, self.users_handle, self.users),
+            (DSCacheFile.GROUP, self.groups_handle, self.groups),
+        ):
+            st = os.stat(handle.full_path)
+            index = DSCacheIndex(*cache_file.index_keys, entries, (st.st_dev, st.st_ino))
+            with TDB_LOCKS[cache_file]:
+                os.rename(handle.full_path, cache_file.path)
+                DS_CACHE_INDEXES[cache_file] = index
 
     def _add_sid_info_to_entries(
         self,
@@ -275,6 +296,7 @@ class DSCacheFill:
 
                 # Store forward and reverse entries
                 _tdb_add_entry(self.users_handle, user_data.pw_uid, user_data.pw_name, entry)
+                self.users.append(entry)
                 user_count += 1
 
         job.set_progress(70, 'Preparing to add groups to cache')
@@ -312,6 +334,7 @@ class DSCacheFill:
                     job.set_progress(80, f'{group_data.gr_name}: adding group to cache. Group count: {group_count}')
 
                 _tdb_add_entry(self.groups_handle, group_data.gr_gid, group_data.gr_name, entry)
+                self.groups.append(entry)
                 group_count += 1
 
         job.set_progress(100, f'Cached {user_count} users and {group_count} groups.')
@@ -335,6 +358,30 @@ def _tdb_add_entry(
     handle.store(f'NAME_{name}', entry)
 
 
+def get_cache_index(id_type: IDType) -> DSCacheIndex:
+    """
+    Return in-memory index of the cache of the specified type. The index is built from
+    the TDB file if middleware has not seen this file yet (e.g. after restart).
+
+    Raises:
+        RuntimeError via `tdb` library
+    """
+    cache_file = DSCacheFile[id_type.name]
+    with TDB_LOCKS[cache_file]:
+        with get_tdb_handle(cache_file.value, CACHE_OPTIONS) as handle:
+            st = os.fstat(handle.opath_fd)
+            file_id = (st.st_dev, st.st_ino)
+            if (index := DS_CACHE_INDEXES.get(cache_file)) is None or index.file_id != file_id:
+                index = DSCacheIndex(
+                    *cache_file.index_keys,
+                    list(handle.entries(include_keys=False, key_prefix='ID_')),
+                    file_id
+                )
+                DS_CACHE_INDEXES[cache_file] = index
+
+    return index
+
+
 def insert_cache_entry(
     id_type: IDType,
     xid: int,
@@ -348,32 +395,33 @@ def insert_cache_entry(
     Raises:
         RuntimeError via `tdb` library
     """
+    index = get_cache_index(id_type)
     with get_tdb_handle(DSCacheFile[id_type.name].value, CACHE_OPTIONS) as handle:
         handle.batch_op([
             TDBBatchOperation(action=TDBBatchAction.SET, key=f'ID_{xid}', value=entry),
-            TDBBatchOperation(action=TDBBatchAction.SET, key=f'NAME_{xid}', value=entry),
+            TDBBatchOperation(action=TDBBatchAction.SET, key=f'NAME_{name}', value=entry),
         ])
 
+    index.insert(entry)
+
 
 def retrieve_cache_entry(
     id_type: IDType,
     name: str,
     xid: int
-) -> None:
+) -> dict:
     """
-    Retrieve cache entry under lock using stored handle. If both name and xid
+    Retrieve cache entry from the in-memory index. If both name and xid
     are specified, preference is given to xid.
 
     Raises:
         MatchNotFound
     """
+    index = get_cache_index(id_type)
     if xid is not None:
-        key = f'ID_{xid}'
-    else:
-        key = f'NAME_{name}'
+        return index.get(index.xid_key, xid)
 
-    with get_tdb_handle(DSCacheFile[id_type.name].value, CACHE_OPTIONS) as handle:
-        return handle.get(key)
+    return index.get(index.name_key, name)
 
 
 def query_cache_entries(
@@ -381,5 +429,4 @@ def query_cache_entries(
     filters: list,
     options: dict
 ) -> list:
-    with get_tdb_handle(DSCacheFile[id_type.name].value, CACHE_OPTIONS) as handle:
-        return filter_list(handle.entries(include_keys=False, key_prefix='ID_'), filters, options)
+    return get_cache_index(id_type).query(filters, options)
@@ -0,0 +1,143 @@
+# In-memory mirror of the directory services user / group cache.
+#
+# The TDB files written by DSCacheFill remain the persistent copy of the cache,
+# but reading them means traversing every key and JSON-decoding every value.
+# DSCacheIndex holds the decoded entries along with hash indexes on posix id,
+# name and SID and an id-ordered list so that user.query and group.query are
+# answered without touching the TDB file.
+#
+# NOTE: tests are in src/middlewared/middlewared/pytest/unit/plugins/test_directoryservices_cache.py
+
+import bisect
+
+from middlewared.service_exception import MatchNotFound
+from middlewared.utils import filter_list
+from operator import itemgetter
+from threading import Lock
+
+# Filter operators on indexed keys that are answered from hash indexes (see `DSCacheIndex.lookup`)
+DS_CACHE_INDEXED_OPS = ('=', 'in')
+
+
+def copy_cache_entry(entry: dict) -> dict:
+    """
+    Cache entries are flat dictionaries whose container values (`groups`, `users`,
+    `sudo_commands`, ...) only hold scalars. Callers are free to modify entries they
+    receive and so they get a copy that does not share any container with the index.
+    """
+    return {k: v.copy() if isinstance(v, (dict, list)) else v for k, v in entry.items()}
+
+
+class DSCacheIndex:
+    """
+    Indexed set of cache entries of one type (users or groups).
+
+    `xid_key` / `name_key` - keys of the posix id and name in entries
+    (`uid` / `username` for users, `gid` / `name` for groups).
+
+    `file_id` - (st_dev, st_ino) of the TDB file the entries were read from. It is
+    used to tell whether the TDB file was replaced since the index was built.
+
+    Entries are ordered by `id`, which matches the order of results returned by
+    `directoryservices.cache.query`. Lookups and inserts may happen concurrently and
+    are serialized by a lock, queries work on a snapshot of the ordered list so that
+    they never hold the lock while evaluating filters.
+    """
+
+    def __init__(self, xid_key: str, name_key: str, entries: list[dict], file_id: tuple | None = None):
+        self.xid_key = xid_key
+        self.name_key = name_key
+        self.file_id = file_id
+        self.lock = Lock()
+        self.entries = sorted(entries, key=itemgetter('id'))
+        self.by_key = {xid_key: {}, name_key: {}, 'sid': {}}
+        for entry in self.entries:
+            self.__index(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __index(self, entry):
+        for key, index in self.by_key.items():
+            if (value := entry.get(key)) is not None:
+                index[value] = entry
+
+    def __unindex(self, entry):
+        for key, index in self.by_key.items():
+            if index.get(entry.get(key)) is entry:
+                index.pop(entry[key])
+
+    def insert(self, entry: dict) -> None:
+        """
+        Add `entry` to the index, replacing existing entry with the same posix id.
+        """
+        entry = copy_cache_entry(entry)
+        with self.lock:
+            # Queries in progress hold a reference to the old list, so modify a copy
+            entries = self.entries.copy()
+            if (existing := self.by_key[self.xid_key].get(entry[self.xid_key])) is not None:
+                self.__unindex(existing)
+                entries.remove(existing)
+
+            bisect.insort(entries, entry, key=itemgetter('id'))
+            self.__index(entry)
+            self.entries = entries
+
+    def get(self, key: str, value) -> dict:
+        """
+        Retrieve a copy of entry where `key` (posix id, name or `sid`) equals `value`.
+
+        Raises:
+            MatchNotFound
+        """
+        with self.lock:
+            entry = self.by_key[key].get(value)
+
+        if entry is None:
+            raise MatchNotFound(value)
+
+        return copy_cache_entry(entry)
+
+    def lookup(self, filters: list) -> list | None:
+        """
+        Answer query consisting of a single `=` or `in` filter on an indexed key
+        from the hash index. Returns None if `filters` can not be answered this way.
+        """
+        if len(filters) != 1 or len(filters[0]) != 3:
+            return None
+
+        key, op, value = filters[0]
+        if (index := self.by_key.get(key)) is None or op not in DS_CACHE_INDEXED_OPS:
+            return None
+
+        values = [value] if op == '=' else value
+        if not isinstance(values, (list, tuple, set)) or None in values:
+            # entries with null SID are not indexed
+            return None
+
+        try:
+            with self.lock:
+                found = {id(entry): entry for v in values if (entry := index.get(v)) is not None}
+        except TypeError:
+            # unhashable filter value
+            return None
+
+        return sorted(found.values(), key=itemgetter('id'))
+
+    def query(self, filters: list, options: dict) -> list:
+        """
+        Equivalent of `filter_list()` on all entries ordered by `id`. Returned entries
+        are copies.
+        """
+        if (entries := self.lookup(filters)) is None:
+            entries = filter_list(self.entries, filters, options)
+        else:
+            entries = filter_list(entries, [], options)
+
+        if options.get('count'):
+            return entries
+
+        if options.get('get'):
+            return copy_cache_entry(entries)
+
+        return [copy_cache_entry(entry) for entry in entries]
@@ -1,10 +1,13 @@
 import asyncio
 from collections import defaultdict
-import imp
+import copy
+import importlib.util
 import os
+import time
 
 from mako import exceptions
 from middlewared.service import CallError, Service
+from middlewared.utils import freeze
 from middlewared.utils.io import write_if_changed, FileChanges
 from middlewared.utils.mako import get_template
 
@@ -20,16 +23,25 @@ class MakoRenderer(object):
 
     def __init__(self, service):
         self.service = service
+        self.templates = {}
+
+    def get_template(self, path):
+        # `TemplateLookup` checks whether template file was modified on every lookup, templates are shipped
+        # with middleware and will not change while it is running.
+        if (tmpl := self.templates.get(path)) is None:
+            # Get the template by its relative path
+            tmpl = self.templates[path] = get_template(
+                os.path.relpath(path, os.path.dirname(os.path.dirname(__file__))) + ".mako"
+            )
+
+        return tmpl
 
     async def render(self, path, ctx):
         try:
             # Mako is not asyncio friendly so run it within a thread
             def do():
-                # Get the template by its relative path
-                tmpl = get_template(os.path.relpath(path, os.path.dirname(os.path.dirname(__file__))) + ".mako")
-
                 # Render the template
-                return tmpl.render(
+                return self.get_template(path).render(
                     middleware=self.service.middleware,
                     service=self.service,
                     FileShouldNotExist=FileShouldNotExist,
@@ -50,11 +62,19 @@ class PyRenderer(object):
 
     def __init__(self, service):
         self.service = service
+        self.modules = {}
+
+    def get_module(self, path):
+        if (mod := self.modules.get(path)) is None:
+            spec = importlib.util.spec_from_file_location(os.path.basename(path), f'{path}.py')
+            mod = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(mod)
+            self.modules[path] = mod
+
+        return mod
 
     async def render(self, path, ctx):
-        name = os.path.basename(path)
-        find = imp.find_module(name, [os.path.dirname(path)])
-        mod = imp.load_module(name, *find)
+        mod = self.get_module(path)
         args = [self.service, self.service.middleware]
         if ctx is not None:
             args.append(ctx)
@@ -67,6 +87,9 @@ class PyRenderer(object):
 
 class EtcService(Service):
 
+    # Entries that specify `datastore` are only rendered again when the group context, any of the listed datastore
+    # tables (that are read by the renderer itself) or the generated file changed since they were last rendered.
+    # Entries that depend on anything else (e.g. paths or services state) must not specify it.
     GROUPS = {
         'docker': [
             {'type': 'py', 'path': 'docker/daemon.json'},
@@ -79,7 +102,7 @@ class EtcService(Service):
                 {'method': 'user.query', 'args': [[['local', '=', True]]]},
             ],
             'entries': [
-                {'type': 'mako', 'path': 'shadow', 'group': 'shadow', 'mode': 0o0640},
+                {'type': 'mako', 'path': 'shadow', 'group': 'shadow', 'mode': 0o0640, 'datastore': []},
             ]
         },
         'user': {
@@ -88,11 +111,11 @@ class EtcService(Service):
                 {'method': 'group.query', 'args': [[['local', '=', True]]]},
             ],
             'entries': [
-                {'type': 'mako', 'path': 'group'},
-                {'type': 'mako', 'path': 'passwd', 'local_path': 'master.passwd'},
-                {'type': 'mako', 'path': 'shadow', 'group': 'shadow', 'mode': 0o0640},
-                {'type': 'mako', 'path': 'local/sudoers', 'mode': 0o440},
-                {'type': 'mako', 'path': 'aliases', 'local_path': 'mail/aliases'},
+                {'type': 'mako', 'path': 'group', 'datastore': []},
+                {'type': 'mako', 'path': 'passwd', 'local_path': 'master.passwd', 'datastore': []},
+                {'type': 'mako', 'path': 'shadow', 'group': 'shadow', 'mode': 0o0640, 'datastore': []},
+                {'type': 'mako', 'path': 'local/sudoers', 'mode': 0o440, 'datastore': []},
+                {'type': 'mako', 'path': 'aliases', 'local_path': 'mail/aliases', 'datastore': []},
                 {'type': 'py', 'path': 'web_ui_root_login_alert'},
             ]
         },
@@ -137,8 +160,8 @@ class EtcService(Service):
             {'type': 'py', 'path': 'fips', 'checkpoint': None},
         ],
         'keyboard': [
-            {'type': 'mako', 'path': 'default/keyboard'},
-            {'type': 'mako', 'path': 'vconsole.conf'},
+            {'type': 'mako', 'path': 'default/keyboard', 'datastore': ['system.settings']},
+            {'type': 'mako', 'path': 'vconsole.conf', 'datastore': ['system.settings']},
         ],
         'ldap': [
             {'type': 'mako', 'path': 'local/openldap/ldap.conf'},
@@ -200,7 +223,7 @@ class EtcService(Service):
                 {'type': 'mako', 'path': 'proftpd/proftpd.conf'},
                 {'type': 'mako', 'path': 'proftpd/proftpd.motd'},
                 {'type': 'mako', 'path': 'proftpd/tls.conf'},
-                {'type': 'mako', 'path': 'ftpusers'},
+                {'type': 'mako', 'path': 'ftpusers', 'datastore': []},
             ],
         },
         'kdump': [
@@ -243,7 +266,7 @@ class EtcService(Service):
 
         ],
         'motd': [
-            {'type': 'mako', 'path': 'motd'}
+            {'type': 'mako', 'path': 'motd', 'datastore': ['system.advanced']}
         ],
         'mdns': {
             'ctx': [
@@ -323,7 +346,7 @@ class EtcService(Service):
                 {'type': 'mako', 'path': 'pam.d/sshd', 'local_path': 'pam.d/sshd_linux'},
                 {'type': 'mako', 'path': 'local/users.oath', 'mode': 0o0600, 'checkpoint': 'pool_import'},
                 {'type': 'py', 'path': 'local/ssh/config'},
-                {'type': 'mako', 'path': 'login_banner', 'mode': 0o600},
+                {'type': 'mako', 'path': 'login_banner', 'mode': 0o600, 'datastore': []},
             ]
         },
         'ntpd': [
@@ -349,6 +372,13 @@ class EtcService(Service):
             {'type': 'mako', 'path': 'subgid', 'checkpoint': None},
         ],
     }
+    # Groups that have to be generated before the key group when generating a checkpoint (they must precede it in
+    # `GROUPS`). Other groups are generated concurrently unless they write the same files or one of them has `py`
+    # entries (see `group_dependencies`).
+    DEPENDENCIES = {
+        # `generate_ssl_certs` removes unexpected files from `/etc/certificates/CA`
+        'syslogd': ['ssl'],
+    }
     LOCKS = defaultdict(asyncio.Lock)
 
     checkpoints = ['initial', 'interface_sync', 'post_init', 'pool_import', 'pre_interface_sync']
@@ -365,17 +395,36 @@ class EtcService(Service):
             'mako': MakoRenderer(self),
             'py': PyRenderer(self),
         }
-
-    async def gather_ctx(self, methods):
-        rv = {}
+        self.checkpoint_reports = {}
+        self.fingerprints = {}
+
+    async def gather_ctx(self, methods, calls=None):
+        """
+        Call context `methods` concurrently. `calls` can be shared by multiple groups so that a method called with the
+        same arguments by these groups is only called once, every group gets its own copy of the result.
+        """
+        keys = []
+        futures = []
         for m in methods:
             method = m['method']
             args = m.get('args', [])
             prefix = m.get('ctx_prefix', None)
-            key = f'{prefix}.{method}' if prefix else method
-            rv[key] = await self.middleware.call(method, *args)
+            keys.append(f'{prefix}.{method}' if prefix else method)
 
-        return rv
+            if calls is None:
+                futures.append(self.middleware.call(method, *args))
+            else:
+                call_key = (method, freeze(args))
+                if (future := calls.get(call_key)) is None:
+                    future = calls[call_key] = asyncio.ensure_future(self.middleware.call(method, *args))
+
+                futures.append(asyncio.shield(future))
+
+        results = await asyncio.gather(*futures)
+        if calls is not None:
+            results = copy.deepcopy(results)
+
+        return dict(zip(keys, results))
 
     def get_perms_and_ownership(self, entry):
         user_name = entry.get('owner')
@@ -413,84 +462,220 @@ class EtcService(Service):
 
         return changes
 
-    async def generate(self, name, checkpoint=None):
+    def group_entries(self, name, checkpoint=None):
         group = self.GROUPS.get(name)
         if group is None:
             raise ValueError('{0} group not found'.format(name))
 
+        entries = group['entries'] if isinstance(group, dict) else group
+        if checkpoint:
+            entries = [entry for entry in entries if entry.get('checkpoint', 'initial') == checkpoint]
+
+        return entries
+
+    def entry_outfile(self, entry):
+        return f'/etc/{entry["path"].removeprefix("local/")}'
+
+    def group_dependencies(self, checkpoint):
+        """
+        Groups that have entries for `checkpoint` mapped to the groups that have to be generated before them.
+
+        `py` renderers may read and write files other than their declared output, so groups that have `py` entries
+        are generated in `GROUPS` order with respect to all other groups: after every group that precedes them and
+        before every group that follows them. Only consecutive groups that render `mako` templates (which only write
+        their own output file) are generated concurrently.
+        """
+        dependencies = {}
+        outfiles = {}
+        # Last group with `py` entries and groups that follow it
+        barrier = None
+        after_barrier = []
+        for name in self.GROUPS:
+            if not (entries := self.group_entries(name, checkpoint)):
+                continue
+
+            dependencies[name] = set(self.DEPENDENCIES.get(name, []))
+            for entry in entries:
+                outfile = self.entry_outfile(entry)
+                if outfile in outfiles:
+                    dependencies[name].add(outfiles[outfile])
+
+                outfiles[outfile] = name
+
+            if any(entry['type'] == 'py' for entry in entries):
+                dependencies[name].update(after_barrier or ([barrier] if barrier else []))
+                barrier = name
+                after_barrier = []
+            else:
+                if barrier:
+                    dependencies[name].add(barrier)
+
+                after_barrier.append(name)
+
+        return {
+            name: {dependency for dependency in names if dependency in dependencies}
+            for name, names in dependencies.items()
+        }
+
+    async def generate(self, name, checkpoint=None):
+        return await self._generate(name, checkpoint)
+
+    async def _generate(self, name, checkpoint=None, calls=None, timings=None):
+        group = self.GROUPS.get(name)
+        entries = self.group_entries(name, checkpoint)
+
         output = []
         async with self.LOCKS[name]:
+            if not entries:
+                # Nothing to render, do not gather context
+                return output
+
+            # Must be retrieved before the context and rendering so that any change made meanwhile triggers
+            # rendering next time
+            tables = list({table for entry in entries for table in entry.get('datastore', [])})
+            table_versions = dict(zip(tables, await asyncio.gather(*[
+                self.middleware.call('datastore.table_versions', [table]) for table in tables
+            ])))
+
             if isinstance(group, dict):
-                ctx = await self.gather_ctx(group['ctx'])
-                entries = group['entries']
+                ctx = await self.gather_ctx(group['ctx'], calls)
             else:
                 ctx = None
-                entries = group
+
+            try:
+                frozen_ctx = freeze(ctx)
+            except TypeError:
+                frozen_ctx = None
 
             for entry in entries:
                 renderer = self._renderers.get(entry['type'])
                 if renderer is None:
                     raise ValueError(f'Unknown type: {entry["type"]}')
 
-                if checkpoint:
-                    entry_checkpoint = entry.get('checkpoint', 'initial')
-                    if entry_checkpoint != checkpoint:
+                started = time.monotonic()
+                outfile = self.entry_outfile(entry)
+                fingerprint_key = (name, outfile)
+                fingerprint = None
+                if 'datastore' in entry and frozen_ctx is not None:
+                    fingerprint = (frozen_ctx, tuple(table_versions[table] for table in entry['datastore']))
+                    if self.fingerprints.get(fingerprint_key) == (fingerprint, await self.outfile_stat(outfile)):
+                        self.logger.trace('Inputs of %s did not change', outfile)
                         continue
 
-                path = os.path.join(self.files_dir, entry.get('local_path') or entry['path'])
-                entry_path = entry['path']
-                if entry_path.startswith('local/'):
-                    entry_path = entry_path[len('local/'):]
-                outfile = f'/etc/{entry_path}'
-
+                self.fingerprints.pop(fingerprint_key, None)
                 try:
-                    rendered = await renderer.render(path, ctx)
-                except FileShouldNotExist:
-                    try:
-                        await self.middleware.run_in_thread(os.unlink, outfile)
-                        self.logger.debug(f'{entry["type"]}:{entry["path"]} file removed.')
-                        output.append({
-                            'path': outfile,
-                            'status': 'REMOVED',
-                            'changes': FileChanges.dump(FileChanges.CONTENTS)
-                        })
-                    except FileNotFoundError:
-                        # Nothing to log
-                        pass
-
-                    continue
+                    result = await self._generate_entry(renderer, entry, ctx)
                 except Exception:
                     self.logger.error(f'Failed to render {entry["type"]}:{entry["path"]}', exc_info=True)
                     continue
 
-                if rendered is None:
-                    # TODO: scripts that write config files internally should be refacorted
-                    # to return bytes or str so that we can properly monitor for changes
-                    continue
-
-                changes = await self.middleware.run_in_thread(self.make_changes, outfile, entry, rendered)
+                if result is not None:
+                    output.append(result)
 
-                if not changes:
-                    self.logger.trace('No new changes for %s', outfile)
+                if fingerprint is not None:
+                    self.fingerprints[fingerprint_key] = (fingerprint, await self.outfile_stat(outfile))
 
-                else:
-                    output.append({
-                        'path': outfile,
-                        'status': 'CHANGED',
-                        'changes': FileChanges.dump(changes)
-                    })
+                if timings is not None:
+                    timings[outfile] = time.monotonic() - started
 
         return output
 
+    async def outfile_stat(self, outfile):
+        try:
+            st = await self.middleware.run_in_thread(os.stat, outfile)
+        except FileNotFoundError:
+            return None
+
+        return st.st_ino, st.st_mtime_ns, st.st_size, st.st_mode, st.st_uid, st.st_gid
+
+    async def _generate_entry(self, renderer, entry, ctx):
+        path = os.path.join(self.files_dir, entry.get('local_path') or entry['path'])
+        outfile = self.entry_outfile(entry)
+
+        try:
+            rendered = await renderer.render(path, ctx)
+        except FileShouldNotExist:
+            try:
+                await self.middleware.run_in_thread(os.unlink, outfile)
+                self.logger.debug(f'{entry["type"]}:{entry["path"]} file removed.')
+                return {
+                    'path': outfile,
+                    'status': 'REMOVED',
+                    'changes': FileChanges.dump(FileChanges.CONTENTS)
+                }
+            except FileNotFoundError:
+                # Nothing to log
+                return
+
+        if rendered is None:
+            # TODO: scripts that write config files internally should be refacorted
+            # to return bytes or str so that we can properly monitor for changes
+            return
+
+        changes = await self.middleware.run_in_thread(self.make_changes, outfile, entry, rendered)
+
+        if not changes:
+            self.logger.trace('No new changes for %s', outfile)
+
+        else:
+            return {
+                'path': outfile,
+                'status': 'CHANGED',
+                'changes': FileChanges.dump(changes)
+            }
+
     async def generate_checkpoint(self, checkpoint):
         if checkpoint not in await self.get_checkpoints():
             raise CallError(f'"{checkpoint}" not recognised')
 
-        for name in self.GROUPS.keys():
+        started = time.monotonic()
+        dependencies = self.group_dependencies(checkpoint)
+        calls = {}
+        report = {}
+        tasks = {}
+
+        async def generate_group(name, after):
+            await asyncio.gather(*after, return_exceptions=True)
+
+            group_started = time.monotonic()
+            timings = {}
             try:
-                await self.generate(name, checkpoint)
+                await self._generate(name, checkpoint, calls, timings)
             except Exception:
                 self.logger.error(f'Failed to generate {name} group', exc_info=True)
+            finally:
+                report[name] = {'time': time.monotonic() - group_started, 'files': timings}
+
+        def schedule(name):
+            if name not in tasks:
+                tasks[name] = asyncio.ensure_future(
+                    generate_group(name, [schedule(dependency) for dependency in dependencies[name]])
+                )
+
+            return tasks[name]
+
+        for name in dependencies:
+            schedule(name)
+
+        await asyncio.gather(*tasks.values())
+
+        self.checkpoint_reports[checkpoint] = {
+            'time': time.monotonic() - started,
+            'groups': {name: report[name] for name in sorted(report, key=lambda k: report[k]['time'], reverse=True)},
+        }
+        self.logger.debug(
+            '%r checkpoint generated in %.2f seconds, slowest groups: %s', checkpoint,
+            self.checkpoint_reports[checkpoint]['time'],
+            ', '.join(f'{name} ({group["time"]:.2f}s)' for name, group in list(
+                self.checkpoint_reports[checkpoint]['groups'].items()
+            )[:5]),
+        )
+
+    async def checkpoint_report(self, checkpoint):
+        """
+        Time spent generating each group and file of the last `checkpoint` generation.
+        """
+        return self.checkpoint_reports.get(checkpoint)
 
     async def get_checkpoints(self):
         return self.checkpoints
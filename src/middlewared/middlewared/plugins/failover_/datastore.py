@@ -3,6 +3,7 @@
 # Licensed under the terms of the TrueNAS Enterprise License Agreement
 # See the file LICENSE.IX for complete terms and conditions
 
+import asyncio
 import os
 import time
 
@@ -12,8 +13,14 @@ from middlewared.plugins.datastore.connection import thread_pool
 from middlewared.utils.threading import start_daemon_thread, set_thread_name
 from middlewared.utils import db as db_utils
 
+from .replication_log import ReplicationLog
+
 FREENAS_DATABASE_REPLICATED = f'{FREENAS_DATABASE}.replicated'
 RAISE_ALERT_SYNC_RETRY_TIME = 1200  # 20mins (some platforms take 15-20mins to reboot)
+REPLICATION_BATCH_SIZE = 500  # log entries sent in a single call
+REPLICATION_RETRY_INTERVAL = 5
+# Writes of this node to be replicated to the other node
+REPLICATION_LOG = ReplicationLog()
 
 
 class FailoverDatastoreService(Service):
@@ -23,26 +30,44 @@ class FailoverDatastoreService(Service):
         private = True
         thread_pool = thread_pool
 
-    async def sql(self, data, sql, params):
+    # Position in the replication log of the remote node up to which its writes were received
+    received = {'epoch': None, 'seq': 0}
+    apply_lock = asyncio.Lock()
+
+    async def position(self):
+        return self.received
+
+    async def apply(self, data, entries):
+        """
+        Apply replication log `entries` following the already received ones in order. Returns position of the
+        last applied entry (or None if this controller does not accept replicated writes).
+        """
         if await self.middleware.call('system.version') != data['version']:
             return
 
         if await self.middleware.call('failover.status') != 'BACKUP':
-            # We can't query failover.status on `MASTER` node (please see `hook_datastore_execute_write` for
-            # explanations). Non-BACKUP nodes are responsible for checking their failover status.
+            # Replication log is shipped by the node that considers itself `MASTER`, but we must not apply it
+            # unless we are sure that we are the standby.
             return
 
-        await self.middleware.call('datastore.execute', sql, params)
+        async with self.apply_lock:
+            if data['epoch'] == self.received['epoch']:
+                # Entries may be sent again if acknowledgement was lost
+                entries = [entry for entry in entries if entry[0] > self.received['seq']]
+                if entries and entries[0][0] == self.received['seq'] + 1:
+                    await self.middleware.call(
+                        'datastore.execute_many', [query for seq, queries in entries for query in queries],
+                    )
+                    self.received = {'epoch': data['epoch'], 'seq': entries[-1][0]}
 
-    failure = False
+            return self.received
 
-    def is_failure(self):
-        return self.failure
+    failure = False
 
     def set_failure(self):
         self.failure = True
         try:
-            # This is executed in `hook_datastore_execute_write` so we can't query local failover status here and we'll
+            # This can be executed in the SQLite thread so we can't query local failover status here and we'll
             # have to rely on remote.
             if (fs := self.middleware.call_sync('failover.call_remote', 'failover.status')) == 'BACKUP':
                 self.send()
@@ -84,14 +109,18 @@ class FailoverDatastoreService(Service):
             start_daemon_thread(target=send_retry)
 
     def send(self):
+        # This runs in the SQLite thread so the database contains exactly the writes logged so far
+        position = REPLICATION_LOG.position()
+
         token = self.middleware.call_sync('failover.call_remote', 'auth.generate_token')
         self.middleware.call_sync('failover.send_file', token, FREENAS_DATABASE, FREENAS_DATABASE_REPLICATED, {'mode': db_utils.FREENAS_DATABASE_MODE})
-        self.middleware.call_sync('failover.call_remote', 'failover.datastore.receive')
+        self.middleware.call_sync('failover.call_remote', 'failover.datastore.receive', [position])
 
+        REPLICATION_LOG.acknowledge(position['seq'])
         self.failure = False
         self.middleware.call_sync('alert.oneshot_delete', 'FailoverSyncFailed', None)
 
-    def receive(self):
+    def receive(self, position=None):
         # Take the following example:
         # 1. upgrade both HA controllers
         # 2. standby controller reboots (by design) into the newly OS version
@@ -131,45 +160,114 @@ class FailoverDatastoreService(Service):
 
         os.rename(FREENAS_DATABASE_REPLICATED, FREENAS_DATABASE)
         self.middleware.call_sync('datastore.setup')
+        if position is not None:
+            self.received = position
 
     async def force_send(self):
         if await self.middleware.call('failover.status') == 'MASTER':
             await self.middleware.call('failover.datastore.set_failure')
 
 
+def remote_log_seq(position):
+    """
+    Sequence number of the last replication log entry received by the remote node (None if it does not follow
+    our replication log).
+    """
+    if position['epoch'] != REPLICATION_LOG.epoch:
+        return None
+
+    return position['seq']
+
+
+def ship_replication_log(middleware):
+    """
+    Send replication log to the remote node in batches as it gets written until it acknowledges all the entries.
+    """
+    set_thread_name('failover_datastore_log')
+
+    service = middleware.get_service('failover.datastore')
+    remote_seq = None
+    failing_since = None
+    while True:
+        if not REPLICATION_LOG.wait(REPLICATION_RETRY_INTERVAL):
+            continue
+
+        if service.failure:
+            # Database send (that includes all logged writes) is in progress
+            time.sleep(REPLICATION_RETRY_INTERVAL)
+            continue
+
+        try:
+            if (
+                not middleware.call_sync('failover.licensed') or
+                middleware.call_sync('failover.status') != 'MASTER'
+            ):
+                REPLICATION_LOG.acknowledge(REPLICATION_LOG.position()['seq'])
+                remote_seq = None
+                continue
+
+            if remote_seq is None:
+                remote_seq = remote_log_seq(middleware.call_sync(
+                    'failover.call_remote', 'failover.datastore.position', [], {'timeout': 10},
+                ))
+
+            if remote_seq is None or (entries := REPLICATION_LOG.tail(remote_seq, REPLICATION_BATCH_SIZE)) is None:
+                # Remote node has missed writes that are no longer in the log
+                service.logger.warning('Remote node database is behind the replication log, sending the database')
+                middleware.call_sync('failover.datastore.set_failure')
+                remote_seq = None
+                continue
+
+            if not entries:
+                REPLICATION_LOG.acknowledge(remote_seq)
+                continue
+
+            position = middleware.call_sync(
+                'failover.call_remote',
+                'failover.datastore.apply',
+                [{'version': middleware.call_sync('system.version'), 'epoch': REPLICATION_LOG.epoch}, entries],
+                {'timeout': 10},
+            )
+            # `None` means that the remote node does not accept replicated writes
+            remote_seq = entries[-1][0] if position is None else remote_log_seq(position)
+            if remote_seq is not None:
+                REPLICATION_LOG.acknowledge(remote_seq)
+        except Exception as e:
+            if failing_since is None:
+                service.logger.warning('Error replicating SQL on the remote node: %r', e)
+                failing_since = time.monotonic()
+            elif time.monotonic() - failing_since > RAISE_ALERT_SYNC_RETRY_TIME:
+                middleware.call_sync(
+                    'alert.oneshot_create', 'FailoverSyncFailed', {'mins': RAISE_ALERT_SYNC_RETRY_TIME / 60},
+                )
+                failing_since = time.monotonic()
+
+            # Whatever was sent might have been applied
+            remote_seq = None
+            time.sleep(REPLICATION_RETRY_INTERVAL)
+        else:
+            if failing_since is not None:
+                failing_since = None
+                middleware.call_sync('alert.oneshot_delete', 'FailoverSyncFailed', None)
+
+
 def hook_datastore_execute_write(middleware, sql, params, options):
-    # This code is executed in SQLite thread and blocks it (in order to avoid replication query race conditions)
-    # No switching to the async context that will yield to database queries is allowed here as it will result in
-    # a deadlock. That's why we can't query failover status and will always try to replicate all queries to the other
-    # node. The other node will check its own failover status upon receiving them.
+    replicate(middleware, [[sql, params]], options)
 
-    if not options['ha_sync']:
-        return
 
-    if not middleware.call_sync('failover.licensed'):
-        return
+def hook_datastore_execute_write_many(middleware, queries, options):
+    # All the queries of a bulk write are replicated in a single log entry and executed in a single transaction
+    replicate(middleware, queries, options)
 
-    if middleware.call_sync('failover.datastore.is_failure'):
+
+def replicate(middleware, queries, options):
+    # This code is executed in SQLite thread and blocks it (in order to avoid replication query race conditions)
+    # so it only appends queries to the replication log. They are sent to the other node by the
+    # `ship_replication_log` thread.
+    if not options['ha_sync']:
         return
 
-    try:
-        middleware.call_sync(
-            'failover.call_remote',
-            'failover.datastore.sql',
-            [
-                {
-                    'version': middleware.call_sync('system.version'),
-                },
-                sql,
-                params,
-            ],
-            {
-                'timeout': 10,
-            },
-        )
-    except Exception as e:
-        middleware.logger.warning('Error replicating SQL on the remote node: %r', e)
-        middleware.call_sync('failover.datastore.set_failure')
+    REPLICATION_LOG.append(queries)
 
 
 async def setup(middleware):
@@ -177,3 +275,5 @@ async def setup(middleware):
         return
 
     middleware.register_hook('datastore.post_execute_write', hook_datastore_execute_write, inline=True)
+    middleware.register_hook('datastore.post_execute_write_many', hook_datastore_execute_write_many, inline=True)
+    start_daemon_thread(target=ship_replication_log, args=(middleware,))
@@ -0,0 +1,67 @@
+# Copyright (c) - iXsystems Inc.
+#
+# Licensed under the terms of the TrueNAS Enterprise License Agreement
+# See the file LICENSE.IX for complete terms and conditions
+
+import collections
+import itertools
+import threading
+import uuid
+
+# Number of unacknowledged writes kept in memory. If the standby falls further behind, the whole database is sent.
+REPLICATION_LOG_MAX_ENTRIES = 10000
+
+
+class ReplicationLog:
+    """
+    Sequenced log of database writes that were not yet acknowledged by the standby controller.
+
+    Every entry is `[seq, queries]` where `queries` is a list of `[sql, params]` executed in a single transaction.
+    `seq` numbers are consecutive within the `epoch` (a new one is chosen each time middlewared starts), so the
+    standby can tell whether it can apply an entry or it has missed some writes.
+    """
+
+    def __init__(self, max_entries=REPLICATION_LOG_MAX_ENTRIES):
+        self.epoch = str(uuid.uuid4())
+        self.max_entries = max_entries
+        self.cond = threading.Condition()
+        self.entries = collections.deque()
+        # Last appended and last acknowledged entry
+        self.seq = 0
+        self.acknowledged = 0
+
+    def append(self, queries):
+        with self.cond:
+            self.seq += 1
+            self.entries.append([self.seq, queries])
+            if len(self.entries) > self.max_entries:
+                self.entries.popleft()
+
+            self.cond.notify_all()
+
+    def position(self):
+        with self.cond:
+            return {'epoch': self.epoch, 'seq': self.seq}
+
+    def acknowledge(self, seq):
+        with self.cond:
+            self.acknowledged = max(self.acknowledged, seq)
+            while self.entries and self.entries[0][0] <= self.acknowledged:
+                self.entries.popleft()
+
+    def tail(self, seq, limit):
+        """
+        At most `limit` entries following `seq` or None if some of them are no longer in the log.
+        """
+        with self.cond:
+            if seq < self.seq and (not self.entries or self.entries[0][0] > seq + 1):
+                return None
+
+            return list(itertools.islice((entry for entry in self.entries if entry[0] > seq), limit))
+
+    def wait(self, timeout):
+        """
+        Wait for entries that were not acknowledged yet. Returns True if there are any.
+        """
+        with self.cond:
+            return self.cond.wait_for(lambda: self.seq > self.acknowledged, timeout)
@@ -1,3 +1,4 @@
+import base64
 import binascii
 import errno
 import functools
@@ -5,6 +6,7 @@ import os
 import pathlib
 import shutil
 import stat as statlib
+import struct
 import time
 
 import pyinotify
@@ -25,6 +27,11 @@ from middlewared.utils.filesystem.utils import timespec_convert_float
 from middlewared.utils.mount import getmntinfo
 from middlewared.utils.nss import pwd, grp
 from middlewared.utils.path import FSLocation, path_location, is_child_realpath
+from middlewared.validators import Range
+
+# `filesystem.listdir_page` cursor: mount id and inode of the directory and getdents offset to resume from
+LISTDIR_CURSOR = struct.Struct('=QQq')
+LISTDIR_PAGE_MAX = 10000
 
 
 class FilesystemService(Service):
@@ -214,6 +221,61 @@ class FilesystemService(Service):
             'zfs_attrs': ['ARCHIVE']
         }
 
+    @private
+    def listdir_prepare(self, path, filters, options):
+        """
+        Validate `path` for directory listing and return `(path, file_type, request_mask)`
+        for the DirectoryIterator. `filters` may be extended in-place.
+        """
+        path = pathlib.Path(path)
+        if not path.exists():
+            raise CallError(f'Directory {path} does not exist', errno.ENOENT)
+
+        if not path.is_dir():
+            raise CallError(f'Path {path} is not a directory', errno.ENOTDIR)
+
+        if options.get('count') is True:
+            # We're just getting count, drop any unnecessary info
+            request_mask = 0
+        else:
+            request_mask = self.listdir_request_mask(options.get('select', None))
+
+        # None request_mask means "everything"
+        if request_mask is None or (request_mask & DirectoryRequestMask.ZFS_ATTRS):
+            # Make sure this is actually ZFS before issuing FS ioctls
+            try:
+                self.get_zfs_attributes(str(path))
+            except Exception:
+                raise CallError(f'{path}: ZFS attributes are not supported.')
+
+        file_type = None
+        for filter_ in filters:
+            if filter_[0] not in ['type']:
+                continue
+
+            if filter_[1] != '=':
+                continue
+
+            if filter_[2] == 'DIRECTORY':
+                file_type = FileType.DIRECTORY
+            elif filter_[2] == 'FILE':
+                file_type = FileType.FILE
+            else:
+                continue
+
+        if path.absolute() == pathlib.Path('/mnt'):
+            # sometimes (on failures) the top-level directory
+            # where the zpool is mounted does not get removed
+            # after the zpool is exported. WebUI calls this
+            # specifying `/mnt` as the path. This is used when
+            # configuring shares in the "Path" drop-down. To
+            # prevent shares from being configured to point to
+            # a path that doesn't exist on a zpool, we'll
+            # filter these here.
+            filters.extend([['is_mountpoint', '=', True], ['name', '!=', IX_APPS_DIR_NAME]])
+
+        return path, file_type, request_mask
+
     @private
     def listdir_request_mask(self, select):
         """ create request mask for directory listing """
@@ -302,55 +364,67 @@ class FilesystemService(Service):
           zfs_attrs(list): list of ZFS file attributes on file
         """
 
-        path = pathlib.Path(path)
-        if not path.exists():
-            raise CallError(f'Directory {path} does not exist', errno.ENOENT)
+        path, file_type, request_mask = self.listdir_prepare(path, filters, options)
+        with DirectoryIterator(path, file_type=file_type, request_mask=request_mask) as d_iter:
+            return filter_list(d_iter, filters, options)
 
-        if not path.is_dir():
-            raise CallError(f'Path {path} is not a directory', errno.ENOTDIR)
+    @accepts(
+        Str('path', required=True),
+        Ref('query-filters'),
+        Dict(
+            'options',
+            Str('cursor', null=True, default=None),
+            Int('limit', default=1000, validators=[Range(min_=1, max_=LISTDIR_PAGE_MAX)]),
+            List('select'),
+        ),
+        roles=['FILESYSTEM_ATTRS_READ']
+    )
+    @returns(Dict(
+        'listdir_page',
+        List('entries', required=True, items=[Ref('path_entry')]),
+        Str('cursor', required=True, null=True),
+    ))
+    def listdir_page(self, path, filters, options):
+        """
+        Get one page of the contents of a directory.
 
-        if options.get('count') is True:
-            # We're just getting count, drop any unnecessary info
-            request_mask = 0
-        else:
-            request_mask = self.listdir_request_mask(options.get('select', None))
+        This is a paginated variant of `filesystem.listdir` meant for very large
+        directories: only `limit` entries are read and returned per call, and
+        `cursor` from the response is passed in `options` of the next call to
+        resume the listing where it stopped. `cursor` is null once the directory
+        has been read completely.
 
-        # None request_mask means "everything"
-        if request_mask is None or (request_mask & DirectoryRequestMask.ZFS_ATTRS):
-            # Make sure this is actually ZFS before issuing FS ioctls
+        The cursor is opaque and only valid for the directory it was returned for.
+        Entries are returned in on-disk order. Entries that are created or removed
+        while the directory is being paged through may or may not be returned.
+
+        `filters` and `select` have the same meaning as for `filesystem.listdir`
+        and should be the same for all pages.
+        """
+        path, file_type, request_mask = self.listdir_prepare(path, filters, options)
+        if options['cursor'] is None:
+            dir_id, offset = None, 0
+        else:
             try:
-                self.get_zfs_attributes(str(path))
-            except Exception:
-                raise CallError(f'{path}: ZFS attributes are not supported.')
+                mount_id, inode, offset = LISTDIR_CURSOR.unpack(base64.urlsafe_b64decode(options['cursor']))
+            except (binascii.Error, struct.error, ValueError):
+                raise CallError(f'{options["cursor"]}: invalid cursor', errno.EINVAL)
 
-        file_type = None
-        for filter_ in filters:
-            if filter_[0] not in ['type']:
-                continue
+            dir_id = (mount_id, inode)
 
-            if filter_[1] != '=':
-                continue
+        with DirectoryIterator(path, file_type=file_type, request_mask=request_mask, offset=offset) as d_iter:
+            if dir_id is not None and dir_id != (d_iter.stat.stx_mnt_id, d_iter.stat.stx_ino):
+                raise CallError(f'{path}: cursor was returned for a different directory', errno.EINVAL)
 
-            if filter_[2] == 'DIRECTORY':
-                file_type = FileType.DIRECTORY
-            elif filter_[2] == 'FILE':
-                file_type = FileType.FILE
+            entries = filter_list(d_iter, filters, {'select': options.get('select', []), 'limit': options['limit']})
+            if len(entries) < options['limit']:
+                cursor = None
             else:
-                continue
+                cursor = base64.urlsafe_b64encode(LISTDIR_CURSOR.pack(
+                    d_iter.stat.stx_mnt_id, d_iter.stat.stx_ino, d_iter.offset
+                )).decode()
 
-        if path.absolute() == pathlib.Path('/mnt'):
-            # sometimes (on failures) the top-level directory
-            # where the zpool is mounted does not get removed
-            # after the zpool is exported. WebUI calls this
-            # specifying `/mnt` as the path. This is used when
-            # configuring shares in the "Path" drop-down. To
-            # prevent shares from being configured to point to
-            # a path that doesn't exist on a zpool, we'll
-            # filter these here.
-            filters.extend([['is_mountpoint', '=', True], ['name', '!=', IX_APPS_DIR_NAME]])
-
-        with DirectoryIterator(path, file_type=file_type, request_mask=request_mask) as d_iter:
-            return filter_list(d_iter, filters, options)
+        return {'entries': entries, 'cursor': cursor}
 
     @accepts(Str('path'), roles=['FILESYSTEM_ATTRS_READ'])
     @returns(Dict(
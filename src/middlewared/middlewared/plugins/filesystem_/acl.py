@@ -1,13 +1,14 @@
+import copy
 import errno
-import json
 import os
 import subprocess
-import stat as pystat
 from pathlib import Path
 
 from middlewared.schema import Bool, Dict, Int, List, Str, Ref, UnixPerm, OROperator
 from middlewared.service import accepts, private, returns, job, CallError, ValidationErrors, Service
+from middlewared.utils.filesystem import acl as acl_utils
 from middlewared.utils.filesystem.directory import directory_is_empty
+from middlewared.utils.filesystem.permtree import permtree, PermTreeAction, PermTreeConfig
 from middlewared.utils.path import FSLocation, path_location
 from middlewared.validators import Range
 from .utils import ACLType
@@ -18,23 +19,19 @@ class FilesystemService(Service):
     class Config:
         cli_private = True
 
-    def __acltool(self, path, action, uid, gid, options):
-
-        flags = "-r"
-        flags += "x" if options.get('traverse') else ""
-        flags += "C" if options.get('do_chmod') else ""
-        flags += "P" if options.get('posixacl') else ""
-
-        acltool = subprocess.run([
-            '/usr/bin/nfs4xdr_winacl',
-            '-a', action,
-            '-O', str(uid), '-G', str(gid),
-            flags,
-            '-c', path,
-            '-p', path], check=False, capture_output=True
-        )
-        if acltool.returncode != 0:
-            raise CallError(f"acltool [{action}] on path {path} failed with error: [{acltool.stderr.decode().strip()}]")
+    def __acltool(self, job, path, action, uid, gid, options, mode=None):
+        try:
+            permtree(path, PermTreeConfig(
+                action=action,
+                acltype='POSIX1E' if options.get('posixacl') else 'NFS4',
+                uid=uid,
+                gid=gid,
+                mode=mode,
+                traverse=options.get('traverse', False),
+                job=job,
+            ))
+        except (OSError, ValueError) as e:
+            raise CallError(f"acltool [{action.name.lower()}] on path {path} failed with error: [{e}]")
 
     def _common_perm_path_validate(self, schema, data, verrors, pool_mp_ok=False):
         loc = path_location(data['path'])
@@ -172,7 +169,7 @@ class FilesystemService(Service):
 
         job.set_progress(10, f'Recursively changing owner of {data["path"]}.')
         options['posixacl'] = True
-        self.__acltool(data['path'], 'chown', uid, gid, options)
+        self.__acltool(job, data['path'], PermTreeAction.CHOWN, uid, gid, options)
         job.set_progress(100, 'Finished changing owner.')
 
     @private
@@ -286,29 +283,18 @@ class FilesystemService(Service):
             job.set_progress(100, 'Finished setting permissions.')
             return
 
-        action = 'clone' if mode else 'strip'
         job.set_progress(10, f'Recursively setting permissions on {data["path"]}.')
         options['posixacl'] = not is_nfs4acl
-        options['do_chmod'] = True
-        self.__acltool(data['path'], action, uid, gid, options)
+        self.__acltool(job, data['path'], PermTreeAction.STRIP, uid, gid, options, mode or None)
         job.set_progress(100, 'Finished setting permissions.')
 
     @private
     def getacl_nfs4(self, path, simplified, resolve_ids):
-        flags = "-jn"
-
-        if not simplified:
-            flags += "v"
-
-        getacl = subprocess.run(
-            ['nfs4xdr_getfacl', flags, path],
-            capture_output=True,
-            check=False
-        )
-        if getacl.returncode != 0:
-            raise CallError(f"Failed to get ACL for path [{path}]: {getacl.stderr.decode()}")
+        try:
+            output = acl_utils.getacl_nfs4(path, simplified)
+        except (OSError, ValueError) as e:
+            raise CallError(f"Failed to get ACL for path [{path}]: {e}")
 
-        output = json.loads(getacl.stdout.decode())
         for ace in output['acl']:
             if resolve_ids and ace['id'] != -1:
                 ace['who'] = self.middleware.call_sync(
@@ -328,92 +314,30 @@ class FilesystemService(Service):
             ace['flags'].pop('SUCCESSFUL_ACCESS', None)
             ace['flags'].pop('FAILED_ACCESS', None)
 
-        na41flags = output.pop('nfs41_flags')
-        output['nfs41_flags'] = {
-            "protected": na41flags['PROTECTED'],
-            "defaulted": na41flags['DEFAULTED'],
-            "autoinherit": na41flags['AUTOINHERIT']
-        }
         output['acltype'] = 'NFS4'
         return output
 
     @private
     def getacl_posix1e(self, path, simplified, resolve_ids):
-        st = os.stat(path)
-        ret = {
-            'uid': st.st_uid,
-            'gid': st.st_gid,
-            'acl': [],
-            'flags': {
-                'setuid': bool(st.st_mode & pystat.S_ISUID),
-                'setgid': bool(st.st_mode & pystat.S_ISGID),
-                'sticky': bool(st.st_mode & pystat.S_ISVTX),
-            },
-            'acltype': ACLType.POSIX1E.name
-        }
-
-        ret['uid'] = st.st_uid
-        ret['gid'] = st.st_gid
-
-        gfacl = subprocess.run(['getfacl', '-c', '-n', path],
-                               check=False, capture_output=True)
-        if gfacl.returncode != 0:
-            raise CallError(f"Failed to get POSIX1e ACL on path [{path}]: {gfacl.stderr.decode()}")
-
-        # linux output adds extra line to output if it's an absolute path and extra newline at end.
-        entries = gfacl.stdout.decode().splitlines()
-        entries = entries[:-1]
-
-        for entry in entries:
-            if entry.startswith("#"):
-                continue
-
-            entry = entry.split("\t")[0]
-            ace = {
-                "default": False,
-                "tag": None,
-                "id": -1,
-                "perms": {
-                    "READ": False,
-                    "WRITE": False,
-                    "EXECUTE": False,
-                }
-            }
+        try:
+            ret = acl_utils.getacl_posix1e(path)
+        except (OSError, ValueError) as e:
+            raise CallError(f"Failed to get POSIX1e ACL on path [{path}]: {e}")
 
-            tag, id_, perms = entry.rsplit(":", 2)
-            ace['perms'].update({
-                "READ": perms[0].casefold() == "r",
-                "WRITE": perms[1].casefold() == "w",
-                "EXECUTE": perms[2].casefold() == "x",
-            })
-            if tag.startswith('default'):
-                ace['default'] = True
-                tag = tag[8:]
-
-            ace['tag'] = tag.upper()
-            if id_.isdigit():
-                ace['id'] = int(id_)
-                if resolve_ids:
+        if resolve_ids:
+            for ace in ret['acl']:
+                if ace['id'] != -1:
                     ace['who'] = self.middleware.call_sync(
                         'idmap.id_to_name', ace['id'], ace['tag']
                     )
-
-            elif ace['tag'] not in ['OTHER', 'MASK']:
-                if resolve_ids:
-                    to_check = st.st_gid if ace['tag'] == "GROUP" else st.st_uid
+                elif ace['tag'] in ('USER_OBJ', 'GROUP_OBJ'):
+                    to_check = ret['gid'] if ace['tag'] == 'GROUP_OBJ' else ret['uid']
                     ace['who'] = self.middleware.call_sync(
-                        'idmap.id_to_name', to_check, ace['tag']
+                        'idmap.id_to_name', to_check, ace['tag'].removesuffix('_OBJ')
                     )
+                else:
+                    ace['who'] = None
 
-                ace['tag'] += '_OBJ'
-
-            elif resolve_ids:
-                ace['who'] = None
-
-            ret['acl'].append(ace)
-
-        ret['trivial'] = (len(ret['acl']) == 3)
-        ret['path'] = path
         return ret
 
     @private
@@ -496,31 +420,25 @@ class FilesystemService(Service):
         return ret
 
     @private
-    def setacl_nfs4_internal(self, path, acl, do_canon, verrors):
-        payload = {
-            'acl': ACLType.NFS4.canonicalize(acl) if do_canon else acl,
-        }
-        json_payload = json.dumps(payload)
-        setacl = subprocess.run(
-            ['nfs4xdr_setfacl', '-j', json_payload, path],
-            capture_output=True,
-            check=False
-        )
-        """
-        nfs4xr_setacl with JSON input will return validation
-        errors on exit with EX_DATAERR (65).
-        """
-        if setacl.returncode == 65:
-            err = setacl.stderr.decode()
-            json_verrors = json.loads(err.split(None, 1)[1])
-            for entry in json_verrors:
-                for schema, err in entry.items():
-                    verrors.add(f'filesystem_acl.{schema.replace("acl", "dacl")}', err)
+    def setacl_nfs4_internal(self, path, acl, do_canon, verrors, nfs41_flags=None):
+        aces = []
+        for idx, entry in enumerate(ACLType.NFS4.canonicalize(acl) if do_canon else acl):
+            try:
+                aces.append(acl_utils.nfs4ace_from_dict(entry))
+            except ValueError as e:
+                verrors.add(f'filesystem_acl.dacl.{idx}', str(e))
 
-            verrors.check()
+        verrors.check()
 
-        elif setacl.returncode != 0:
-            raise CallError(setacl.stderr.decode())
+        try:
+            os.setxattr(path, acl_utils.ACLXattr.ZFS_NATIVE.value, acl_utils.nfs4acl_xdr_encode(
+                acl_utils.nfs4acl_flags_from_dict(nfs41_flags or {}), aces
+            ))
+        except ValueError as e:
+            verrors.add('filesystem_acl.dacl', str(e))
+            verrors.check()
+        except OSError as e:
+            raise CallError(f'{path}: failed to set ACL: {e}', e.errno)
 
     @private
     def setacl_nfs4(self, job, data):
@@ -568,14 +486,14 @@ class FilesystemService(Service):
                     path, data['dacl'], uid_to_check, gid_to_check, True
                 )
 
-            self.setacl_nfs4_internal(path, data['dacl'], do_canon, verrors)
+            self.setacl_nfs4_internal(path, data['dacl'], do_canon, verrors, data.get('nfs41_flags'))
 
         if not recursive:
             os.chown(path, uid, gid)
             job.set_progress(100, 'Finished setting NFSv4 ACL.')
             return
 
-        self.__acltool(path, 'clone' if not do_strip else 'strip',
+        self.__acltool(job, path, PermTreeAction.STRIP if do_strip else PermTreeAction.CLONE,
                        uid, gid, options)
 
         job.set_progress(100, 'Finished setting NFSv4 ACL.')
@@ -734,7 +652,8 @@ class FilesystemService(Service):
                         e.errmsg
                     )
 
-            aclstring = self.gen_aclstring_posix1e(dacl, recursive, verrors)
+            # `gen_aclstring_posix1e` modifies the entries it validates
+            self.gen_aclstring_posix1e(copy.deepcopy(dacl), recursive, verrors)
 
         verrors.check()
 
@@ -743,11 +662,10 @@ class FilesystemService(Service):
         job.set_progress(50, 'Setting POSIX1e ACL.')
 
         if not do_strip:
-            setacl = subprocess.run(['setfacl', '-m', aclstring, path],
-                                    check=False, capture_output=True)
-            if setacl.returncode != 0:
-                raise CallError(f'Failed to set ACL [{aclstring}] on path [{path}]: '
-                                f'{setacl.stderr.decode()}')
+            try:
+                acl_utils.setacl_posix1e(path, dacl)
+            except (OSError, ValueError) as e:
+                raise CallError(f'Failed to set ACL on path [{path}]: {e}')
 
         if not recursive:
             os.chown(path, uid, gid)
@@ -755,8 +673,8 @@ class FilesystemService(Service):
             return
 
         options['posixacl'] = True
-        self.__acltool(data['path'],
-                       'clone' if not do_strip else 'strip',
+        self.__acltool(job, data['path'],
+                       PermTreeAction.STRIP if do_strip else PermTreeAction.CLONE,
                        uid, gid, options)
 
         job.set_progress(100, 'Finished setting POSIX1e ACL.')
@@ -1,6 +1,7 @@
 import psutil
 import time
 
+from middlewared.common.event_source.sampler import SampledEventSourceMixin, Sampler, SamplerRegistry
 from middlewared.event import EventSource
 from middlewared.schema import Dict, Float, Int
 from middlewared.utils.disks import get_disk_names, get_disks_with_identifiers
@@ -9,7 +10,72 @@ from middlewared.validators import Range
 from .realtime_reporting import get_arc_stats, get_cpu_stats, get_disk_stats, get_interface_stats, get_memory_info
 
 
-class RealtimeEventSource(EventSource):
+class RealtimeSampler(Sampler):
+    """
+    Gathers `reporting.realtime` payload for all event sources subscribed with the same interval.
+    """
+
+    # Disk and interface names are shared by all samplers and only looked up again after
+    # hotplug or interface change events (see hooks below).
+    disks = None
+    interfaces = None
+
+    def setup(self):
+        self.cores = self.middleware.call_sync('system.info')['cores']
+
+    @classmethod
+    def get_disks(cls):
+        if (disks := cls.disks) is None:
+            disks = cls.disks = (get_disk_names(), get_disks_with_identifiers())
+
+        return disks
+
+    @classmethod
+    def get_interfaces(cls, middleware):
+        if (interfaces := cls.interfaces) is None:
+            interfaces = cls.interfaces = [
+                iface['name'] for iface in middleware.call_sync(
+                    'interface.query', [], {'extra': {'retrieve_names_only': True}}
+                )
+            ]
+
+        return interfaces
+
+    def sample(self):
+        # this gathers the most recent metric recorded via netdata (for all charts)
+        retries = 2
+        while retries > 0:
+            try:
+                netdata_metrics = self.middleware.call_sync('netdata.get_all_metrics')
+            except Exception:
+                retries -= 1
+                if retries <= 0:
+                    raise
+
+                time.sleep(0.5)
+            else:
+                break
+
+        if failed_to_connect := not bool(netdata_metrics):
+            return {'failed_to_connect': failed_to_connect}
+
+        disks, disk_mapping = self.get_disks()
+        data = {
+            'zfs': get_arc_stats(netdata_metrics),  # ZFS ARC Size
+            'memory': get_memory_info(netdata_metrics),
+            'virtual_memory': psutil.virtual_memory()._asdict(),
+            'cpu': get_cpu_stats(netdata_metrics, self.cores),
+            'disks': get_disk_stats(netdata_metrics, disks, disk_mapping),
+            'interfaces': get_interface_stats(netdata_metrics, self.get_interfaces(self.middleware)),
+            'failed_to_connect': False,
+        }
+
+        # CPU temperature
+        data['cpu']['temperature_celsius'] = self.middleware.call_sync('reporting.cpu_temperatures') or None
+        return data
+
+
+class RealtimeEventSource(SampledEventSourceMixin, EventSource):
 
     """
     Retrieve real time statistics for CPU, network,
@@ -51,56 +117,20 @@ class RealtimeEventSource(EventSource):
             Float('cache_hit_ratio'),
         ),
     )
+    SAMPLERS = SamplerRegistry(RealtimeSampler)
 
-    def run_sync(self):
-        interval = self.arg['interval']
-        cores = self.middleware.call_sync('system.info')['cores']
-        disk_mapping = get_disks_with_identifiers()
-
-        while not self._cancel_sync.is_set():
-            # this gathers the most recent metric recorded via netdata (for all charts)
-            retries = 2
-            while retries > 0:
-                try:
-                    netdata_metrics = self.middleware.call_sync('netdata.get_all_metrics')
-                except Exception:
-                    retries -= 1
-                    if retries <= 0:
-                        raise
-
-                    time.sleep(0.5)
-                else:
-                    break
-
-            if failed_to_connect := not bool(netdata_metrics):
-                data = {'failed_to_connect': failed_to_connect}
-            else:
-                disks = get_disk_names()
-                if len(disks) != len(disk_mapping):
-                    disk_mapping = get_disks_with_identifiers()
-
-                data = {
-                    'zfs': get_arc_stats(netdata_metrics),  # ZFS ARC Size
-                    'memory': get_memory_info(netdata_metrics),
-                    'virtual_memory': psutil.virtual_memory()._asdict(),
-                    'cpu': get_cpu_stats(netdata_metrics, cores),
-                    'disks': get_disk_stats(netdata_metrics, disks, disk_mapping),
-                    'interfaces': get_interface_stats(
-                        netdata_metrics, [
-                            iface['name'] for iface in self.middleware.call_sync(
-                                'interface.query', [], {'extra': {'retrieve_names_only': True}}
-                            )
-                        ]
-                    ),
-                    'failed_to_connect': False,
-                }
-
-                # CPU temperature
-                data['cpu']['temperature_celsius'] = self.middleware.call_sync('reporting.cpu_temperatures') or None
-
-            self.send_event('ADDED', fields=data)
-            time.sleep(interval)
+
+async def udev_block_devices_hook(middleware, data):
+    if data.get('SUBSYSTEM') == 'block' and data.get('DEVTYPE') == 'disk' and data.get('ACTION') in ('add', 'remove'):
+        RealtimeSampler.disks = None
+
+
+async def interfaces_changed_hook(middleware, *args, **kwargs):
+    RealtimeSampler.interfaces = None
 
 
 def setup(middleware):
     middleware.register_event_source('reporting.realtime', RealtimeEventSource, roles=['REPORTING_READ'])
+    middleware.register_hook('udev.block', udev_block_devices_hook)
+    middleware.register_hook('udev.net', interfaces_changed_hook)
+    middleware.register_hook('interface.post_sync', interfaces_changed_hook)
@@ -8,6 +8,7 @@ from middlewared.service_exception import InstanceNotFound
 from middlewared.utils import filter_list, filter_getattrs
 from middlewared.validators import Match, ReplicationSnapshotNamingSchema
 
+from .snapshot_utils import order_snapshots_by_txg, SnapshotQueryPushdown
 from .utils import get_snapshot_count_cached
 from .validation_utils import validate_snapshot_name
 
@@ -103,19 +104,18 @@ class ZFSSnapshot(CRUDService):
 
         holds = extra.get('holds', False)
         properties = extra.get('properties')
+        # Avoid getting all snapshots (with all of their properties) first when filters, `select`
+        # and `order_by` allow narrowing down what we need to retrieve from libzfs
+        pushdown = SnapshotQueryPushdown.from_query(filters, options, holds, properties)
+        select = pushdown.options.pop('select', None)
         with libzfs.ZFS() as zfs:
-            # Handle `id` filter to avoid getting all snapshots first
-            kwargs = dict(holds=holds, mounted=False, props=properties, min_txg=min_txg, max_txg=max_txg)
-            if filters and len(filters) == 1 and len(filters[0]) == 3 and filters[0][0] in (
-                    'id', 'name'
-            ) and filters[0][1] == '=':
-                kwargs['datasets'] = [filters[0][2]]
-
-            snapshots = zfs.snapshots_serialized(**kwargs)
-
-        # FIXME: awful performance with hundreds/thousands of snapshots
-        select = options.pop('select', None)
-        result = filter_list(snapshots, filters, options)
+            snapshots = zfs.snapshots_serialized(**pushdown.kwargs)
+            if pushdown.txg_reverse is not None:
+                snapshots = order_snapshots_by_txg(
+                    pushdown.iter_filtered(snapshots), pushdown.txg_reverse, pushdown.top,
+                )
+
+            result = filter_list(snapshots, pushdown.filters, pushdown.options)
 
         if options['extra'].get('retention'):
             if isinstance(result, list):
@@ -0,0 +1,196 @@
+import heapq
+from dataclasses import dataclass, field
+
+from middlewared.utils import filters as filters_cls
+
+
+__all__ = ['SnapshotQueryPushdown', 'order_snapshots_by_txg']
+
+TXG_ORDER_BY = {'createtxg': False, '-createtxg': True}
+filters_obj = filters_cls()
+
+
+@dataclass(slots=True)
+class SnapshotQueryPushdown:
+    """
+    Split `zfs.snapshot.query` filters and options into the part that can be handled by
+    `libzfs.ZFS.snapshots_serialized` (which datasets to iterate, transaction group range and
+    which properties to retrieve) and the part that still has to be evaluated by `filter_list`.
+
+    Filters on `pool`, `dataset`, `id` and `name` are only used to narrow down which datasets
+    are iterated, they are still evaluated afterwards. `createtxg` range filters are fully
+    handled by libzfs (and are compared numerically rather than as strings).
+    """
+    filters: list
+    options: dict
+    kwargs: dict = field(default_factory=dict)
+    txg_reverse: bool | None = None
+    """ If not None, results should be ordered by `createtxg` through `order_snapshots_by_txg` """
+
+    @classmethod
+    def from_query(cls, filters, options, holds=False, properties=None):
+        options = dict(options)
+        min_txg = options['extra'].get('min_txg', 0)
+        max_txg = options['extra'].get('max_txg', 0)
+
+        remaining = []
+        datasets = recursive = None
+        for f in filters:
+            if len(f) != 3:
+                remaining.append(f)
+                continue
+
+            name, op, value = f
+            if name == 'createtxg' and (txg_range := createtxg_range(op, value)) is not None:
+                low, high = txg_range
+                min_txg = max(min_txg, low)
+                if high:
+                    max_txg = min(max_txg, high) if max_txg else high
+
+                continue
+
+            remaining.append(f)
+            if datasets is None and (pushed := datasets_for_filter(name, op, value)) is not None:
+                datasets, recursive = pushed
+
+        kwargs = {'holds': holds, 'mounted': False, 'props': properties, 'min_txg': min_txg, 'max_txg': max_txg}
+        if datasets is not None:
+            kwargs['datasets'] = datasets
+            if recursive is not None:
+                kwargs['recursive'] = recursive
+
+        select = options.get('select')
+        if select and properties is None and not options['extra'].get('retention') and 'properties' not in select:
+            # Retrieving properties is the most expensive part of iterating snapshots. Skip it
+            # unless the properties are selected or referenced by filters / ordering.
+            referenced = set()
+            for f in remaining:
+                referenced |= filter_names(f)
+
+            if not any(k == 'properties' or k.startswith('properties.') for k in referenced | set(
+                o.removeprefix('nulls_first:').removeprefix('nulls_last:').lstrip('-')
+                for o in options.get('order_by', [])
+            )):
+                kwargs['props'] = []
+
+        pushdown = cls(remaining, options, kwargs)
+        if options.get('order_by') and len(options['order_by']) == 1 and options['order_by'][0] in TXG_ORDER_BY:
+            pushdown.txg_reverse = TXG_ORDER_BY[options.pop('order_by')[0]]
+
+        return pushdown
+
+    @property
+    def top(self):
+        """ Number of leading results that need to be ordered, None means all of them """
+        if self.options.get('get'):
+            return 1
+
+        if self.options.get('limit'):
+            return (self.options.get('offset') or 0) + self.options['limit']
+
+        return None
+
+    def iter_filtered(self, snapshots):
+        """
+        Lazily apply remaining filters to `snapshots`. Once this has been done the remaining
+        options can be evaluated by `filter_list` without any filters.
+        """
+        if self.filters:
+            snapshots = filters_obj.iter_filtered(snapshots, filters_obj.compile_query(self.filters, [], []))
+            self.filters = []
+
+        return snapshots
+
+
+def createtxg_range(op, value):
+    """
+    Convert a `createtxg` filter into `(min_txg, max_txg)` arguments for libzfs where 0 means
+    unbounded. Returns None if filter can not be expressed this way.
+    """
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)
+    elif isinstance(value, bool) or not isinstance(value, int):
+        return None
+
+    match op:
+        case '=':
+            txg_range = (value, value)
+        case '>':
+            txg_range = (value + 1, 0)
+        case '>=':
+            txg_range = (value, 0)
+        case '<':
+            txg_range = (0, value - 1)
+        case '<=':
+            txg_range = (0, value)
+        case _:
+            return None
+
+    if op in ('=', '<', '<=') and txg_range[1] < 1:
+        # upper bound of 0 would mean no upper bound for libzfs
+        return None
+
+    return txg_range
+
+
+def filter_names(the_filter):
+    if len(the_filter) == 3:
+        return {the_filter[0]}
+
+    names = set()
+    for branch in the_filter[1]:
+        for f in (branch if isinstance(branch[0], list) else [branch]):
+            names |= filter_names(f)
+
+    return names
+
+
+def datasets_for_filter(name, op, value):
+    """
+    Returns `(datasets, recursive)` that need to be iterated to find every snapshot matching
+    filter or None if the filter can not be used to narrow down the iteration. `recursive` of
+    None means that libzfs default should be used.
+    """
+    if op not in ('=', 'in', '^'):
+        return None
+
+    if op == '^':
+        if name not in ('id', 'name') or not isinstance(value, str):
+            return None
+
+        if '@' in value:
+            return [value.split('@', 1)[0]], False
+
+        if '/' not in value:
+            return None
+
+        # `tank/foo` matches snapshots of `tank/foo`, `tank/foo/bar` and also `tank/foobar`,
+        # so we need to iterate the parent dataset recursively.
+        return [value.rsplit('/', 1)[0]], True
+
+    values = [value] if op == '=' else value
+    if not isinstance(values, (list, tuple)) or not all(isinstance(v, str) for v in values):
+        return None
+
+    match name:
+        case 'pool':
+            return [v for v in values if '/' not in v and '@' not in v], True
+        case 'dataset':
+            return list(values), False
+        case 'id' | 'name':
+            # libzfs accepts full snapshot names here and only opens these snapshots
+            return list(values), None
+
+    return None
+
+
+def order_snapshots_by_txg(snapshots, reverse, top=None):
+    """
+    Order snapshots by numeric `createtxg`. If `top` is specified, only that many leading
+    snapshots are kept in memory while iterating.
+    """
+    key = lambda snap: int(snap['createtxg'])  # noqa: E731
+    if top is None:
+        return sorted(snapshots, key=key, reverse=reverse)
+
+    return (heapq.nlargest if reverse else heapq.nsmallest)(top, snapshots, key=key)
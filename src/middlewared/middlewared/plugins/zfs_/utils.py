@@ -3,8 +3,8 @@ import enum
 import logging
 import os
 import re
+import threading
 
-from middlewared.service_exception import MatchNotFound
 from middlewared.utils.filesystem.constants import ZFSCTL
 from middlewared.plugins.audit.utils import (
     AUDIT_DEFAULT_FILL_CRITICAL, AUDIT_DEFAULT_FILL_WARNING
@@ -27,6 +27,7 @@ USERPROP_PREFIX = 'org.truenas'
 ZD_PARTITION = re.compile(r'zd[0-9]+p[0-9]+$')
 SNAP_COUNT_TDB_NAME = 'snapshot_count'
 SNAP_COUNT_TDB_OPTIONS = TDBOptions(TDBPathType.PERSISTENT, TDBDataType.JSON)
+SNAP_COUNT_KEY_PREFIX = 'SNAPCNT%'
 
 
 class TNUserProp(enum.Enum):
@@ -173,7 +174,86 @@ def unlocked_zvols_fast(options=None, data=None):
     return zvols
 
 
-def get_snapshot_count_cached(middleware, lz, datasets, update_datasets=False, remove_snapshots_changed=False):
+class SnapshotCountCache:
+    """
+    In-process mirror of the snapshot counts persisted in the snapshot count TDB file.
+
+    Each entry records the `snapshots_changed` timestamp of the dataset at the time it was
+    counted and so is only valid as long as that timestamp does not change. The mirror is
+    refreshed from the TDB file in a single traversal (rather than one lookup per dataset)
+    whenever it is missing entries, which also picks up counts written by other processes.
+    """
+
+    def __init__(self, tdb_name=SNAP_COUNT_TDB_NAME):
+        self.tdb_name = tdb_name
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, name, changed_ts):
+        """ Return cached snapshot count for dataset `name` or None if it is missing or stale """
+        if changed_ts is None:
+            return None
+
+        entry = self.entries.get(name)
+        if entry is None or entry['changed_ts'] != changed_ts:
+            return None
+
+        return entry['cnt']
+
+    def load(self):
+        """ Refresh the mirror with all snapshot count keys in one traversal of the TDB file """
+        entries = {}
+        try:
+            with get_tdb_handle(self.tdb_name, SNAP_COUNT_TDB_OPTIONS) as hdl:
+                for entry in hdl.entries(key_prefix=SNAP_COUNT_KEY_PREFIX):
+                    entries[entry['key'][len(SNAP_COUNT_KEY_PREFIX):]] = entry['value']
+        except Exception:
+            logger.warning('Failed to read cached snapshot counts', exc_info=True)
+            return
+
+        with self.lock:
+            self.entries = entries
+
+    def update(self, entries):
+        """ Persist `entries` (dataset name: {'changed_ts': ..., 'cnt': ...}) in a single transaction """
+        with self.lock:
+            self.entries.update(entries)
+
+        try:
+            with get_tdb_handle(self.tdb_name, SNAP_COUNT_TDB_OPTIONS) as hdl:
+                hdl.batch_op([
+                    TDBBatchOperation(
+                        action=TDBBatchAction.SET,
+                        key=f'{SNAP_COUNT_KEY_PREFIX}{name}',
+                        value=entry
+                    ) for name, entry in entries.items()
+                ])
+        except Exception:
+            logger.warning('Failed to update cached snapshot counts', exc_info=True)
+
+
+SNAPSHOT_COUNT_CACHE = SnapshotCountCache()
+
+
+def count_snapshots(lz, names):
+    """
+    Count snapshots of datasets `names` (non-recursively) with a single iteration
+    """
+    counts = dict.fromkeys(names, 0)
+    if not names:
+        return counts
+
+    for snap in lz.snapshots_serialized(['name'], datasets=names, recursive=False):
+        dataset = snap['name'].split('@', 1)[0]
+        if dataset in counts:
+            counts[dataset] += 1
+
+    return counts
+
+
+def get_snapshot_count_cached(
+    middleware, lz, datasets, update_datasets=False, remove_snapshots_changed=False, cache=SNAPSHOT_COUNT_CACHE,
+):
     """
     Try retrieving snapshot count for dataset from cache if the
     `snapshots_changed` timestamp hasn't changed. If it has,
@@ -191,6 +271,7 @@ def get_snapshot_count_cached(middleware, lz, datasets, update_datasets=False, r
     remove_snapshots_changed - bool - remove the snapshots_changed key from dataset properties
         after processing. This is to hide the fact that we had to retrieve this property to
         determine whether to return cached value.
+    cache - SnapshotCountCache - optional - in-process mirror of cached snapshot counts
 
     Returns:
     -------
@@ -207,10 +288,10 @@ def get_snapshot_count_cached(middleware, lz, datasets, update_datasets=False, r
 
         return None
 
-    def entry_get_cnt(zhdl):
+    def entry_get_cnt_mounted(zhdl):
         """
-        Retrieve snapshot count in most efficient way possible. If dataset is mounted, then
-        retrieve from st_nlink otherwise, iter snapshots from dataset handle
+        Retrieve snapshot count from st_nlink of the snapshot directory if dataset is
+        mounted. Returns None if count has to be retrieved by iterating snapshots.
         """
         if mp := get_mountpoint(zhdl):
             try:
@@ -221,81 +302,67 @@ def get_snapshot_count_cached(middleware, lz, datasets, update_datasets=False, r
                 if st.st_ino == ZFSCTL.INO_SNAPDIR.value:
                     return st.st_nlink - 2
 
-        return len(lz.snapshots_serialized(['name'], datasets=[zhdl['name']], recursive=False))
-
-    def get_entry_fetch(key):
-        """ retrieve cached snapshot count from persistent key-value store """
-        try:
-            with get_tdb_handle(SNAP_COUNT_TDB_NAME, SNAP_COUNT_TDB_OPTIONS) as hdl:
-                entry = hdl.get(key)
-        except MatchNotFound:
-            entry = {
-                'changed_ts': None,
-                'cnt': -1
-            }
-        return entry
-
-    def process_entry(out, zhdl, batch_ops):
-        """
-        This method processes the dataset entry and
-        sets new value in tdb file if necessary. Since
-        we may be consuming "flattened" datasets here, there
-        is potential for duplicate entries. Hence, check for
-        whether we've already handled the dataset for this run.
-        """
-        existing_entry = out.get(zhdl['name'])
-        if existing_entry:
-            if update_datasets:
-                zhdl['snapshot_count'] = existing_entry
-
-            if remove_snapshots_changed:
-                zhdl['properties'].pop('snapshots_changed', None)
-
-            return
-
-        changed_ts = zhdl['properties']['snapshots_changed']['parsed']
-        cache_key = f'SNAPCNT%{zhdl["name"]}'
+        return None
 
-        entry = get_entry_fetch(cache_key)
+    def iter_datasets(datasets_in):
+        for ds in datasets_in:
+            yield ds
+            yield from iter_datasets(ds.get('children', []))
 
-        if entry['changed_ts'] != changed_ts:
-            entry['cnt'] = entry_get_cnt(zhdl)
-            entry['changed_ts'] = changed_ts
+    # Since we may be consuming "flattened" datasets here, there
+    # is potential for duplicate entries. Hence, process each dataset once.
+    handles = {}
+    for zhdl in iter_datasets(datasets):
+        handles.setdefault(zhdl['name'], []).append(zhdl)
 
-            # There are circumstances in which legacy datasets
-            # may not have this property populated. We don't
-            # want cache insertion with NULL key to avoid
-            # collisions
-            if changed_ts:
-                batch_ops.append(TDBBatchOperation(
-                    action=TDBBatchAction.SET,
-                    key=cache_key,
-                    value=entry
-                ))
+    def changed_ts(name):
+        return handles[name][0]['properties']['snapshots_changed']['parsed']
 
-        out[zhdl['name']] = entry['cnt']
-        if update_datasets:
-            zhdl['snapshot_count'] = entry['cnt']
+    out = {}
+    missing = []
+    for name in handles:
+        if (cnt := cache.get(name, changed_ts(name))) is None:
+            missing.append(name)
+        else:
+            out[name] = cnt
+
+    if missing:
+        if any(changed_ts(name) for name in missing):
+            # Entries may have been updated by another process, so refresh the
+            # whole mirror in one go before counting snapshots ourselves.
+            cache.load()
+
+        stale = []
+        for name in missing:
+            if (cnt := cache.get(name, changed_ts(name))) is None:
+                stale.append(name)
+            else:
+                out[name] = cnt
 
-        if remove_snapshots_changed:
-            zhdl['properties'].pop('snapshots_changed', None)
+        unmounted = []
+        for name in stale:
+            if (cnt := entry_get_cnt_mounted(handles[name][0])) is None:
+                unmounted.append(name)
+            else:
+                out[name] = cnt
 
-    def iter_datasets(out, datasets_in, batch_ops):
-        for ds in datasets_in:
-            process_entry(out, ds, batch_ops)
-            iter_datasets(out, ds.get('children', []), batch_ops)
+        out.update(count_snapshots(lz, unmounted))
 
-    out = {}
-    batch_ops = []
+        # There are circumstances in which legacy datasets
+        # may not have this property populated. We don't
+        # want cache insertion with NULL key to avoid
+        # collisions
+        if updated := {
+            name: {'changed_ts': changed_ts(name), 'cnt': out[name]} for name in stale if changed_ts(name)
+        }:
+            cache.update(updated)
 
-    iter_datasets(out, datasets, batch_ops)
+    for name, zhdls in handles.items():
+        for zhdl in zhdls:
+            if update_datasets:
+                zhdl['snapshot_count'] = out[name]
 
-    if batch_ops:
-        # Commit changes to snapshot counts under a transaction lock
-        try:
-            with get_tdb_handle(SNAP_COUNT_TDB_NAME, SNAP_COUNT_TDB_OPTIONS) as hdl:
-                hdl.batch_op(batch_ops)
-        except Exception:
-            logger.warning('Failed to update cached snapshot counts', exc_info=True)
+            if remove_snapshots_changed:
+                zhdl['properties'].pop('snapshots_changed', None)
 
     return out
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Compare collecting app stats serially over docker API, concurrently over docker API and from cgroup v2 files.
+
+Usage: python3 bench_app_stats.py [--rounds 10]
+
+Must be run on a system with docker running and some apps deployed. Each round is a single
+`list_resources_stats_by_project()` call over all containers as done by every `app.stats` sample.
+"""
+import argparse
+import time
+from unittest.mock import patch
+
+from middlewared.plugins.apps.ix_apps.docker import stats
+from middlewared.plugins.apps.ix_apps.docker.utils import get_docker_client, PROJECT_KEY
+
+
+def serial_api():
+    # How stats were collected before cgroup files were used
+    with get_docker_client() as client:
+        for container in client.containers.list(all=True, filters={'label': PROJECT_KEY}, sparse=False):
+            container.stats(stream=False, decode=None, one_shot=True)
+
+
+def concurrent_api():
+    with patch.object(stats, 'container_cgroup_path', lambda container_id: None):
+        stats.list_resources_stats_by_project()
+
+
+def cgroup():
+    stats.list_resources_stats_by_project()
+
+
+def timed(fn, rounds):
+    start = time.perf_counter()
+    for i in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=10)
+    args = parser.parse_args()
+
+    with get_docker_client() as client:
+        containers = client.containers.list(filters={'label': PROJECT_KEY}, sparse=True)
+        with_cgroup = sum(stats.container_cgroup_path(c.id) is not None for c in containers)
+    print(f'{len(containers)} running containers, {with_cgroup} with cgroup v2 stats')
+
+    print(f'{"collector":<16}{"per sample":>12}')
+    for name, fn in (
+        ('serial api', serial_api),
+        ('concurrent api', concurrent_api),
+        ('cgroup', cgroup),
+    ):
+        print(f'{name:<16}{timed(fn, args.rounds):>11.3f}s')
+
+
+if __name__ == '__main__':
+    main()
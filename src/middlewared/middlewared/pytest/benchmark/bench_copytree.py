@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Compare single-threaded and multi-threaded `copytree` on trees of small and of large files.
+
+Usage: python3 bench_copytree.py [--path /mnt/tank/scratch] [--threads 8] [--op DEFAULT]
+
+`--path` should be on the filesystem whose copy performance is of interest (e.g. a ZFS dataset
+with or without block cloning). Scratch directories are created in it and removed afterwards.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from middlewared.utils.filesystem.copy import copytree, CopyTreeConfig, CopyTreeOp, DEF_CP_THREADS
+
+
+def make_tree(root, dirs, files_per_dir, file_size):
+    data = os.urandom(file_size)
+    os.mkdir(root)
+    for i in range(dirs):
+        dir_path = os.path.join(root, f'dir{i}')
+        os.mkdir(dir_path)
+        for j in range(files_per_dir):
+            with open(os.path.join(dir_path, f'file{j}'), 'wb') as f:
+                f.write(data)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    rv = fn()
+    return time.perf_counter() - start, rv
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--path', default=tempfile.gettempdir())
+    parser.add_argument('--threads', type=int, default=DEF_CP_THREADS)
+    parser.add_argument('--op', choices=[op.name for op in CopyTreeOp], default='DEFAULT')
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench_copytree_', dir=args.path)
+    try:
+        print(f'{"tree":<40}{"serial":>10}{"threads":>10}{"speedup":>10}')
+        for name, dirs, files, size in (
+            ('small files (200 x 100 x 4 KiB)', 200, 100, 4096),
+            ('large files (8 x 4 x 64 MiB)', 8, 4, 64 * 1024 * 1024),
+        ):
+            src = os.path.join(scratch, 'src')
+            make_tree(src, dirs, files, size)
+
+            results = []
+            for threads in (1, args.threads):
+                dst = os.path.join(scratch, 'dst')
+                config = CopyTreeConfig(op=CopyTreeOp[args.op], threads=threads)
+                elapsed, stats = timed(lambda: copytree(src, dst, config))
+                if stats.files != dirs * files:
+                    raise AssertionError(f'{stats.files}: unexpected number of files copied')
+
+                results.append(elapsed)
+                shutil.rmtree(dst)
+
+            shutil.rmtree(src)
+            print(f'{name:<40}{results[0]:>9.3f}s{results[1]:>9.3f}s{results[0] / results[1]:>9.2f}x')
+    finally:
+        shutil.rmtree(scratch)
+
+
+if __name__ == '__main__':
+    main()
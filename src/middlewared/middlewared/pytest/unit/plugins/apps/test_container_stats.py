@@ -0,0 +1,94 @@
+from unittest.mock import Mock, patch
+
+import pytest
+
+from middlewared.plugins.apps.ix_apps.docker import stats
+
+
+CONTAINER_ID = 'a' * 64
+NET_DEV = '''Inter-|   Receive                                                |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed
+    lo:     100       1    0    0    0     0          0         0      100       1    0    0    0     0       0          0
+  eth0:    2048      10    0    0    0     0          0         0     1024       8    0    0    0     0       0          0
+'''
+
+
+@pytest.fixture
+def cgroup(tmp_path):
+    path = tmp_path / f'system.slice/docker-{CONTAINER_ID}.scope'
+    path.mkdir(parents=True)
+    (path / 'cgroup.procs').write_text('1234\n1240\n')
+    (path / 'cpu.stat').write_text('usage_usec 1500\nuser_usec 1000\nsystem_usec 500\n')
+    (path / 'memory.current').write_text('4096\n')
+    (path / 'io.stat').write_text(
+        '259:0 rbytes=100 wbytes=200 rios=1 wios=2 dbytes=0 dios=0\n8:0 rbytes=10 wbytes=20 rios=1 wios=1\n'
+    )
+    (tmp_path / 'proc').mkdir()
+    (tmp_path / 'proc/net_dev').write_text(NET_DEV)
+    with patch.object(stats, 'CGROUP_ROOT', str(tmp_path)):
+        yield path
+
+
+def mock_netns(tmp_path, host):
+    real_open, real_stat = open, stats.os.stat
+
+    def open_(path, *args, **kwargs):
+        if path == '/proc/1234/net/dev':
+            path = tmp_path / 'proc/net_dev'
+        return real_open(path, *args, **kwargs)
+
+    def stat(path):
+        if path.startswith('/proc/'):
+            return Mock(st_ino=1 if host or path == '/proc/self/ns/net' else 2)
+        return real_stat(path)
+
+    return patch('builtins.open', open_), patch.object(stats.os, 'stat', stat)
+
+
+def test__container_cgroup_path(cgroup):
+    assert stats.container_cgroup_path(CONTAINER_ID) == str(cgroup)
+    assert stats.container_cgroup_path('b' * 64) is None
+
+
+@pytest.mark.parametrize('host,networks', [
+    (False, {'eth0': {'rx_bytes': 2048, 'tx_bytes': 1024}}),
+    (True, {}),
+])
+def test__read_cgroup_stats(tmp_path, cgroup, host, networks):
+    open_patch, stat_patch = mock_netns(tmp_path, host)
+    with open_patch, stat_patch:
+        assert stats.read_cgroup_stats(str(cgroup)) == {
+            'cpu_usage': 1500000,
+            'memory': 4096,
+            'networks': networks,
+            'blkio': {'read': 110, 'write': 220},
+        }
+
+
+def test__list_stats_cgroup_and_api(tmp_path, cgroup):
+    def container(id_, project, state):
+        return Mock(id=id_, status=state, attrs={'Labels': {stats.PROJECT_KEY: project}})
+
+    api_container = container('b' * 64, 'ix-plex', 'running')
+    api_container.stats.return_value = {
+        'cpu_stats': {'cpu_usage': {'total_usage': 5}},
+        'memory_stats': {'usage': 10},
+        'blkio_stats': {'io_service_bytes_recursive': [{'op': 'read', 'value': 1}, {'op': 'write', 'value': 2}]},
+        'networks': {'eth0': {'rx_bytes': 3, 'tx_bytes': 4}},
+    }
+    stopped = container('c' * 64, 'ix-minio', 'exited')
+    client = Mock()
+    client.containers.list.return_value = [container(CONTAINER_ID, 'ix-plex', 'running'), api_container, stopped]
+    client.__enter__ = Mock(return_value=client)
+    client.__exit__ = Mock(return_value=False)
+
+    open_patch, stat_patch = mock_netns(tmp_path, False)
+    with open_patch, stat_patch, patch.object(stats, 'get_docker_client', Mock(return_value=client)):
+        projects = stats.list_resources_stats_by_project()
+
+    assert projects['ix-plex']['cpu_usage'] == 1500005
+    assert projects['ix-plex']['memory'] == 4106
+    assert projects['ix-plex']['blkio'] == {'read': 111, 'write': 222}
+    assert projects['ix-plex']['networks'] == {'eth0': {'rx_bytes': 2051, 'tx_bytes': 1028}}
+    assert projects['ix-minio']['cpu_usage'] == 0
+    stopped.stats.assert_not_called()
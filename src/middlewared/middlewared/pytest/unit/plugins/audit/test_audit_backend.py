@@ -0,0 +1,137 @@
+import json
+import sqlite3
+from datetime import datetime
+from unittest.mock import Mock, patch
+
+import pytest
+from sqlalchemy import and_, select
+
+from middlewared.plugins.audit import backend as backend_mod
+from middlewared.plugins.audit.backend import AuditBackendService, SQLConn
+from middlewared.plugins.audit.utils import AUDIT_TABLES, AUDITED_SERVICES, parse_query_filters
+from middlewared.utils import filter_list
+
+SMB_VERS = dict(AUDITED_SERVICES)['SMB']
+ENTRIES = [
+    ('CREATE', 'bob', {'file': {'path': 'share/a.txt'}, 'result': {'type': 'UNIX', 'value_raw': 0}}),
+    ('CREATE', 'alice', {'file': {'path': 'share/b.txt'}, 'result': {'type': 'UNIX', 'value_raw': 2}}),
+    ('RENAME', 'bob', {'src_file': {'path': 'share/a.txt'}, 'dst_file': {'path': 'share/c.txt'}}),
+    ('CONNECT', 'bob', None),
+]
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = SQLConn('SMB', SMB_VERS)
+    conn.path = str(tmp_path / 'SMB.db')
+    conn.setup()
+    assert not conn.indexed
+
+    AUDIT_TABLES['SMB'].create(conn.engine)
+    for i, (event, username, event_data) in enumerate(ENTRIES):
+        conn.connection.execute(AUDIT_TABLES['SMB'].insert().values(
+            audit_id=str(i), message_timestamp=i, timestamp=datetime(2024, 1, 1), address='127.0.0.1',
+            username=username, session='', service='SMB', service_data=None, event=event,
+            event_data=event_data, success=True,
+        ))
+
+    yield conn
+    conn.engine.dispose()
+
+
+@pytest.fixture
+def backend(conn):
+    backend = AuditBackendService(Mock())
+    backend.connections = {'SMB': conn}
+    return backend
+
+
+def query(backend, filters, options=None):
+    options = {'count': False, 'offset': 0, 'limit': 0, 'get': False} | (options or {})
+    return AuditBackendService.query.wraps(backend, 'SMB', filters, options)
+
+
+def indexes(conn):
+    return {row[0] for row in conn.connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def test__indexes_created(backend, conn):
+    # Indexes are only built by the periodic task
+    query(backend, [])
+    assert not conn.indexed
+
+    backend.ensure_indexes()
+
+    assert conn.indexed
+    assert set(conn.indexes) <= indexes(conn)
+
+
+def test__indexes_database_locked(backend, conn):
+    # syslog-ng is writing to the database
+    writer = sqlite3.connect(conn.path)
+    writer.execute('BEGIN IMMEDIATE')
+    try:
+        with patch.object(backend_mod, 'AUDIT_INDEX_BUSY_TIMEOUT', 10):
+            backend.ensure_indexes()
+
+        assert not conn.indexed
+        # Queries are not affected
+        assert len(query(backend, [])) == len(ENTRIES)
+    finally:
+        writer.rollback()
+        writer.close()
+
+    backend.ensure_indexes()
+
+    assert conn.indexed
+    assert set(conn.indexes) <= indexes(conn)
+
+
+@pytest.mark.parametrize('filters', [
+    [['event_data.file.path', '=', 'share/a.txt']],
+    [['event_data.file.path', 'in', ['share/a.txt', 'share/b.txt']]],
+    [['event_data.result.value_raw', '=', 2]],
+    [['event_data.dst_file.path', '=', 'share/c.txt'], ['username', '=', 'bob']],
+    [['event_data.file.path', '=', 'nonexistent']],
+])
+def test__json_filters_match_filter_list(backend, filters):
+    services, sql_filters = parse_query_filters(['SMB'], filters, False)
+    # All filters are evaluated in SQL
+    assert sql_filters == filters
+
+    everything = query(backend, [])
+    for entry in everything:
+        entry['event_data'] = json.loads(json.dumps(entry['event_data']))
+
+    assert [e['audit_id'] for e in query(backend, filters)] == [
+        e['audit_id'] for e in filter_list(everything, filters)
+    ]
+
+
+def test__json_filter_uses_index(backend, conn):
+    backend.ensure_indexes()
+    # Indexes are built over a separate connection, the schema change is picked up by a regular query
+    query(backend, [])
+    qs = select([conn.table]).where(
+        and_(*backend._filters_to_queryset([['event_data.file.path', '=', 'share/a.txt']], conn.table, None, {}))
+    )
+    compiled = qs.compile(conn.engine)
+    plan = conn.connection.exec_driver_sql(
+        f'EXPLAIN QUERY PLAN {compiled}', tuple(compiled.params[name] for name in compiled.positiontup),
+    ).fetchall()
+    assert 'event_data_file_path' in str(plan)
+
+
+@pytest.mark.parametrize('f', [
+    ['event_data.file.path', '!=', 'share/a.txt'],
+    ['event_data.file.path', '=', None],
+    ['event_data.file.path', '^', 'share'],
+    ['event_data.file.path', 'in', ['share/a.txt', None]],
+    ['event_data.file', '=', {'path': 'share/a.txt'}],
+    ['event_data.clients.0.path', '=', 'x'],
+    ['event_data.clients.*.path', '=', 'x'],
+    ['event_data.file\\.path', '=', 'x'],
+    ['audit_id.path', '=', 'x'],
+])
+def test__json_filters_not_pushed_down(f):
+    assert parse_query_filters(['SMB'], [f], False)[1] == []
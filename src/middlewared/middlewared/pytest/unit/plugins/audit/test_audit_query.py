@@ -0,0 +1,235 @@
+import csv
+import json
+import sqlite3
+from datetime import datetime
+from unittest.mock import Mock, patch
+
+import pytest
+import yaml
+
+from middlewared.plugins.audit import audit
+from middlewared.plugins.audit.audit import AuditService
+from middlewared.plugins.audit.backend import AuditBackendService, SQLConn
+from middlewared.plugins.audit.utils import AUDIT_TABLES, AUDITED_SERVICES, merge_query_results
+from middlewared.service_exception import CallError, MatchNotFound
+from middlewared.utils import get
+
+SERVICES = [svc[0] for svc in AUDITED_SERVICES]
+ENTRIES_PER_SERVICE = 7
+QUERY_OPTIONS = {
+    'relationships': True, 'extend': None, 'extend_context': None, 'prefix': None, 'extra': {}, 'order_by': [],
+    'select': [], 'count': False, 'get': False, 'offset': 0, 'limit': 0, 'force_sql_filters': False,
+}
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = AuditBackendService(Mock())
+    backend.connections = {}
+    for j, (svc, vers) in enumerate(AUDITED_SERVICES):
+        conn = backend.connections[svc] = SQLConn(svc, vers)
+        conn.path = str(tmp_path / f'{svc}.db')
+        conn.setup()
+
+        AUDIT_TABLES[svc].create(conn.engine)
+        for i in range(ENTRIES_PER_SERVICE):
+            # Timestamps of different services are interleaved
+            ts = i * len(SERVICES) + j
+            conn.connection.execute(AUDIT_TABLES[svc].insert().values(
+                audit_id=f'{svc}-{i}', message_timestamp=ts, timestamp=datetime.fromtimestamp(ts), address='',
+                username='' if i % 3 == 0 else f'user{i % 2}', session='', service=svc, service_data=None,
+                event='AUTHENTICATION', event_data={'n': i}, success=True,
+            ))
+
+    yield backend
+
+    for conn in backend.connections.values():
+        conn.engine.dispose()
+
+
+@pytest.fixture
+def service(backend):
+    calls = []
+
+    def backend_call(method, svc, filters, options, *args):
+        calls.append((method, svc, options))
+        options = QUERY_OPTIONS | options
+        match method:
+            case 'auditbackend.query':
+                return AuditBackendService.query.wraps(backend, svc, filters, options)
+            case 'auditbackend.iter_query':
+                return AuditBackendService.iter_query.wraps(backend, svc, filters, options, 2)
+
+    async def call(method, *args):
+        if method == 'failover.licensed':
+            return False
+
+        return backend_call(method, *args)
+
+    service = AuditService(Mock(call=call, call_sync=backend_call))
+    service.calls = calls
+    return service
+
+
+def all_entries(backend):
+    entries = []
+    for svc in SERVICES:
+        entries.extend(AuditBackendService.query.wraps(backend, svc, [], QUERY_OPTIONS))
+
+    return entries
+
+
+def query(service, options=None, filters=None, services=None):
+    return AuditService.query.wraps(service, {
+        'services': services or SERVICES,
+        'query-filters': filters or [],
+        'query-options': QUERY_OPTIONS | (options or {}),
+        'remote_controller': False,
+    })
+
+
+@pytest.mark.parametrize('order_by', [
+    ['-message_timestamp'],
+    ['nulls_last:username', '-timestamp'],
+    ['username', 'message_timestamp'],
+    ['-username', 'service', 'message_timestamp'],
+])
+@pytest.mark.parametrize('offset,limit', [(0, 5), (4, 5), (18, 5), (0, 0)])
+@pytest.mark.asyncio
+async def test__multiple_services_paginated_in_sql(backend, service, order_by, offset, limit):
+    entries = all_entries(backend)
+    everything = await query(service, {'order_by': order_by})
+    assert len(everything) == len(entries)
+
+    service.calls.clear()
+    result = await query(service, {'order_by': order_by, 'offset': offset, 'limit': limit})
+
+    assert result == everything[offset:offset + limit if limit else None]
+    # Databases are only asked for entries that can be on the requested page
+    for method, svc, options in service.calls:
+        assert options['limit'] == (offset + limit if limit else 0)
+
+
+def test__merge_matches_sql_order():
+    entries = [
+        {'audit_id': '1', 'username': None, 'message_timestamp': 2},
+        {'audit_id': '2', 'username': 'b', 'message_timestamp': 1},
+        {'audit_id': '3', 'username': 'a', 'message_timestamp': 3},
+        {'audit_id': '4', 'username': 'b', 'message_timestamp': 4},
+    ]
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE t (audit_id TEXT, username TEXT, message_timestamp INTEGER)')
+    db.executemany('INSERT INTO t VALUES (:audit_id, :username, :message_timestamp)', entries)
+
+    for order_by, sql in [
+        (['username'], 'username'),
+        (['-username'], 'username DESC'),
+        (['nulls_last:username'], 'username NULLS LAST'),
+        (['nulls_first:-username', 'message_timestamp'], 'username DESC NULLS FIRST, message_timestamp'),
+        (['-username', '-message_timestamp'], 'username DESC, message_timestamp DESC'),
+    ]:
+        def fetch(where):
+            return [
+                dict(zip(('audit_id', 'username', 'message_timestamp'), row))
+                for row in db.execute(f'SELECT * FROM t WHERE {where} ORDER BY {sql}')
+            ]
+
+        merged = list(merge_query_results([fetch('audit_id IN (1, 3)'), fetch('audit_id IN (2, 4)')], order_by))
+        assert merged == fetch('1'), order_by
+
+
+@pytest.mark.asyncio
+async def test__multiple_services_get(service):
+    result = await query(service, {'order_by': ['-message_timestamp'], 'get': True, 'offset': 1})
+    assert result['message_timestamp'] == ENTRIES_PER_SERVICE * len(SERVICES) - 2
+
+    with pytest.raises(MatchNotFound):
+        await query(service, {'get': True, 'offset': 100, 'order_by': ['message_timestamp']})
+
+
+@pytest.mark.asyncio
+async def test__multiple_services_select(service):
+    result = await query(service, {'order_by': ['message_timestamp'], 'select': ['audit_id'], 'limit': 2})
+    assert result == [{'audit_id': 'MIDDLEWARE-0'}, {'audit_id': 'SMB-0'}]
+
+
+@pytest.mark.asyncio
+async def test__multiple_services_count(service):
+    assert await query(service, {'count': True}) == ENTRIES_PER_SERVICE * len(SERVICES)
+
+
+@pytest.mark.asyncio
+async def test__python_filtering(service):
+    result = await query(service, {'order_by': ['-service'], 'limit': 2}, [['event_data.n', '>', 5]])
+    assert [entry['audit_id'] for entry in result] == ['SUDO-6', 'SMB-6']
+
+
+@pytest.mark.parametrize('order_by', [
+    ['username', '-event_data.n'],
+    ['-event_data.n', 'username'],
+    ['event_data.missing', 'nulls_last:-username', 'message_timestamp'],
+])
+@pytest.mark.asyncio
+async def test__python_ordering_matches_sql(service, order_by):
+    # Single service query is ordered in SQL, filter on a JSON key that can not be evaluated in SQL makes
+    # the same query ordered in python
+    sql = await query(service, {'order_by': order_by}, services=['SMB'])
+    python = await query(service, {'order_by': order_by}, [['event_data.n', '!=', -1]], services=['SMB'])
+
+    assert [e['audit_id'] for e in python] == [e['audit_id'] for e in sql]
+
+
+@pytest.mark.asyncio
+async def test__multiple_services_order_by_precedence(service):
+    # Ordering by a JSON key is done in python, the first `order_by` entry is still the primary key
+    for order_by in (['-username', 'event_data.n'], ['-username', 'message_timestamp']):
+        result = await query(service, {'order_by': order_by})
+        keys = [(get(e, 'username'), get(e, order_by[1])) for e in result]
+        assert keys == sorted(keys, key=lambda k: (k[0], -k[1]), reverse=True), order_by
+
+
+@pytest.fixture
+def export(service, tmp_path):
+    def export(export_format, options=None, filters=None):
+        job = Mock(credentials=None)
+        path = AuditService.export.wraps(service, job, {
+            'services': SERVICES,
+            'query-filters': filters or [],
+            'query-options': QUERY_OPTIONS | (options or {}),
+            'remote_controller': False,
+            'export_format': export_format,
+        })
+        assert job.set_progress.call_args.args[0] == 100
+        with open(path) as f:
+            match export_format:
+                case 'JSON':
+                    return json.load(f)
+                case 'CSV':
+                    return list(csv.DictReader(f))
+                case 'YAML':
+                    return yaml.safe_load(f)
+
+    with patch.object(audit, 'AUDIT_REPORTS_DIR', str(tmp_path / 'reports')):
+        yield export
+
+
+@pytest.mark.parametrize('export_format', ['JSON', 'CSV', 'YAML'])
+@pytest.mark.parametrize('options,filters', [
+    ({'order_by': ['-message_timestamp']}, []),
+    ({'order_by': ['nulls_last:username', 'message_timestamp'], 'offset': 3, 'limit': 5}, []),
+    ({'offset': 1, 'limit': 4}, [['event_data.n', 'in', [1, 2]]]),
+    ({'order_by': ['-event_data.n']}, [['event_data.n', '>', 4]]),
+    ({'limit': 3}, [['event_data.n', '>', 4]]),
+])
+@pytest.mark.asyncio
+async def test__export_matches_query(service, export, export_format, options, filters):
+    expected = await query(service, options, filters)
+
+    assert [entry['audit_id'] for entry in export(export_format, options, filters)] == [
+        entry['audit_id'] for entry in expected
+    ]
+
+
+def test__export_empty(export):
+    with pytest.raises(CallError, match='No entries'):
+        export('JSON', {}, [['audit_id', '=', 'nonexistent']])
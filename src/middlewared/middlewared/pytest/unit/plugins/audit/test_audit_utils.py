@@ -95,8 +95,11 @@ def test_requires_python_filtering_select_subkey():
 
 
 @pytest.mark.parametrize('services,options,expected', [
-    ([s[0] for s in AUDITED_SERVICES], {'offset': 1}, True),
-    ([s[0] for s in AUDITED_SERVICES], {'limit': 1}, True),
+    ([s[0] for s in AUDITED_SERVICES], {'offset': 1}, False),
+    ([s[0] for s in AUDITED_SERVICES], {'limit': 1}, False),
+    ([s[0] for s in AUDITED_SERVICES], {'limit': 1, 'order_by': ['-timestamp', 'nulls_last:username']}, False),
+    ([s[0] for s in AUDITED_SERVICES], {'limit': 1, 'order_by': ['event_data.file.path']}, True),
+    (['SMB'], {'order_by': ['event_data.file.path']}, False),
     (['SMB'], {'offset': 1}, False),
     (['SMB'], {'limit': 1}, False),
 ])
@@ -0,0 +1,132 @@
+import asyncio
+import threading
+from unittest.mock import Mock, patch
+
+import pytest
+
+from middlewared.common.event_source.sampler import SamplerRegistry
+from middlewared.plugins.reporting import events
+from middlewared.plugins.reporting.events import RealtimeSampler
+
+
+class Subscriber:
+    def __init__(self):
+        self.samples = []
+        self.error = None
+        self.received = threading.Semaphore(0)
+
+    def on_sample(self, data):
+        self.samples.append(data)
+        self.received.release()
+
+    def on_error(self, error):
+        self.error = error
+        self.received.release()
+
+    def wait(self, count=1):
+        for i in range(count):
+            assert self.received.acquire(timeout=5)
+
+
+@pytest.fixture
+def middleware():
+    calls = []
+
+    def call_sync(method, *args):
+        calls.append(method)
+        match method:
+            case 'system.info':
+                return {'cores': 2}
+            case 'netdata.get_all_metrics':
+                return {'system.cpu': {}}
+            case 'interface.query':
+                return [{'name': 'eth0'}]
+            case 'reporting.cpu_temperatures':
+                return {}
+
+    middleware = Mock(call_sync=Mock(side_effect=call_sync))
+    middleware.calls = calls
+    with (
+        patch.object(events, 'get_disk_names', Mock(return_value=['sda'])) as get_disk_names,
+        patch.object(events, 'get_disks_with_identifiers', Mock(return_value={'sda': '{serial}1'})),
+        patch.object(events, 'get_arc_stats', Mock(return_value={})),
+        patch.object(events, 'get_memory_info', Mock(return_value={})),
+        patch.object(events, 'get_cpu_stats', Mock(side_effect=lambda metrics, cores: {})),
+        patch.object(events, 'get_disk_stats', Mock(return_value={})),
+        patch.object(events, 'get_interface_stats', Mock(side_effect=lambda metrics, ifaces: dict.fromkeys(ifaces))),
+    ):
+        middleware.get_disk_names = get_disk_names
+        RealtimeSampler.disks = RealtimeSampler.interfaces = None
+        yield middleware
+
+
+def test__sampler_shared_by_subscribers(middleware):
+    samplers = SamplerRegistry(RealtimeSampler)
+    first, second = Subscriber(), Subscriber()
+
+    sampler = samplers.subscribe(0.01, first, middleware, 0.01)
+    first.wait(3)
+    assert samplers.subscribe(0.01, second, middleware, 0.01) is sampler
+    # Last sample is sent right away
+    second.wait(2)
+
+    samplers.unsubscribe(sampler, first)
+    samplers.unsubscribe(sampler, second)
+    sampler.thread.join(5)
+
+    assert not sampler.thread.is_alive()
+    assert samplers.samplers == {}
+    assert first.samples[0]['interfaces'] == {'eth0': None}
+    assert middleware.calls.count('system.info') == 1
+    assert middleware.calls.count('netdata.get_all_metrics') >= 3
+    # Names are looked up once until they are invalidated
+    assert middleware.calls.count('interface.query') == 1
+    assert middleware.get_disk_names.call_count == 1
+
+
+def test__sampler_per_interval(middleware):
+    samplers = SamplerRegistry(RealtimeSampler)
+    first, second = Subscriber(), Subscriber()
+
+    a = samplers.subscribe(0.01, first, middleware, 0.01)
+    b = samplers.subscribe(0.02, second, middleware, 0.02)
+    try:
+        assert a is not b
+        assert set(samplers.samplers) == {0.01, 0.02}
+    finally:
+        samplers.unsubscribe(a, first)
+        samplers.unsubscribe(b, second)
+
+
+def test__sampler_names_invalidated(middleware):
+    RealtimeSampler.get_disks()
+    RealtimeSampler.get_interfaces(middleware)
+    RealtimeSampler.get_disks()
+
+    # unrelated udev event
+    asyncio.run(events.udev_block_devices_hook(middleware, {'SUBSYSTEM': 'block', 'DEVTYPE': 'partition'}))
+    RealtimeSampler.get_disks()
+    assert middleware.get_disk_names.call_count == 1
+
+    asyncio.run(events.udev_block_devices_hook(middleware, {'SUBSYSTEM': 'block', 'DEVTYPE': 'disk', 'ACTION': 'add'}))
+    asyncio.run(events.interfaces_changed_hook(middleware))
+    RealtimeSampler.get_disks()
+    RealtimeSampler.get_interfaces(middleware)
+
+    assert middleware.calls.count('interface.query') == 2
+    assert middleware.get_disk_names.call_count == 2
+
+
+def test__sampler_error(middleware):
+    samplers = SamplerRegistry(RealtimeSampler)
+    subscriber = Subscriber()
+    middleware.call_sync.side_effect = ValueError('netdata')
+
+    with patch.object(events.time, 'sleep'):
+        sampler = samplers.subscribe(0.01, subscriber, middleware, 0.01)
+        subscriber.wait()
+
+    assert isinstance(subscriber.error, ValueError)
+    assert samplers.samplers == {}
+    sampler.thread.join(5)
+    samplers.unsubscribe(sampler, subscriber)
@@ -0,0 +1,53 @@
+import pytest
+
+from middlewared.plugins.account_.utils import (
+    GROUP_SQL_FIELDS, USER_SQL_FIELDS, selects_key, split_sql_filters, sql_order_by, sql_paginate_options,
+)
+
+
+@pytest.mark.parametrize('filters,sql_filters,exact', [
+    ([], [], True),
+    ([['username', '=', 'bob']], [['username', '=', 'bob']], True),
+    ([['local', '=', True], ['uid', 'in', [1000, 1001]]], [['uid', 'in', [1000, 1001]]], True),
+    ([['uid', '=', '1000']], [], False),
+    ([['email', '=', None]], [], False),
+    ([['username', '^', 'b']], [], False),
+    ([['uid', '!=', 1000], ['builtin', '=', False]], [['builtin', '=', False]], False),
+    ([['OR', [['uid', '=', 0], ['uid', '=', 1000]]]], [], False),
+    ([['local', '=', False]], [], False),
+    ([['sid', '=', 'S-1-5-21-1-2-3-20000']], [], False),
+])
+def test__split_user_sql_filters(filters, sql_filters, exact):
+    assert split_sql_filters(filters, USER_SQL_FIELDS) == (sql_filters, exact)
+
+
+def test__split_group_sql_filters_name():
+    assert split_sql_filters([['name', '=', 'wheel']], GROUP_SQL_FIELDS) == ([['group', '=', 'wheel']], True)
+
+
+@pytest.mark.parametrize('order_by,expected', [
+    ([], ['id']),
+    (['-uid', 'username'], ['-uid', 'username', 'id']),
+    (['nulls_first:email'], None),
+    (['sshpubkey'], None),
+])
+def test__sql_order_by(order_by, expected):
+    assert sql_order_by(order_by, USER_SQL_FIELDS) == expected
+
+
+def test__sql_paginate_options():
+    options = {'get': True, 'offset': 2}
+    assert sql_paginate_options(options, ['id']) == {'get': True, 'offset': 2, 'limit': 1, 'order_by': ['id']}
+    assert options == {'get': True, 'offset': 2}
+
+
+@pytest.mark.parametrize('filters,options,expected', [
+    ([], {}, True),
+    ([], {'select': ['username']}, False),
+    ([], {'select': ['username', 'sshpubkey']}, True),
+    ([], {'select': [['sshpubkey', 'keys']]}, True),
+    ([['sshpubkey', '!=', None]], {'select': ['username']}, True),
+    ([], {'select': ['username'], 'order_by': ['-sshpubkey']}, True),
+])
+def test__selects_key(filters, options, expected):
+    assert selects_key('sshpubkey', filters, options) is expected
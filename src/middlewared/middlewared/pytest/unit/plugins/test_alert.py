@@ -0,0 +1,146 @@
+import asyncio
+import gc
+from datetime import timedelta
+import time
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+
+from middlewared.alert.base import Alert, AlertClass, AlertCategory, AlertLevel, AlertSource
+from middlewared.alert.schedule import IntervalSchedule
+from middlewared.plugins import alert as alert_plugin
+from middlewared.plugins.alert import AlertService, AlertSourceRunFailedAlertClass
+
+
+class UnitTestAlertClass(AlertClass):
+    category = AlertCategory.SYSTEM
+    level = AlertLevel.WARNING
+    title = "Unit test"
+    text = "%(name)s"
+
+
+class SleepingAlertSource(AlertSource):
+    products = ("SCALE",)
+    schedule = IntervalSchedule(timedelta())
+
+    def __init__(self, middleware, name, delay, alerts):
+        super().__init__(middleware)
+        self._name = name
+        self.delay = delay
+        self.alerts = alerts
+        self.calls = 0
+
+    @property
+    def name(self):
+        return self._name
+
+    async def check(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return [Alert(UnitTestAlertClass, {"name": name}) for name in self.alerts]
+
+
+@pytest.fixture
+def alert_service():
+    async def call(method, *args):
+        match method:
+            case "alert.product_type":
+                return "SCALE"
+            case "failover.licensed":
+                return False
+
+    service = AlertService(Mock(call=AsyncMock(side_effect=call)))
+    service.node = "A"
+    service.alerts = {}
+    service.alert_source_last_run = alert_plugin.defaultdict(lambda: alert_plugin.datetime.min)
+    return service
+
+
+def run_alerts(service, sources):
+    with patch.object(alert_plugin, "ALERT_SOURCES", {source.name: source for source in sources}):
+        asyncio.run(service._AlertService__run_alerts())
+
+
+def test__run_alerts_concurrently(alert_service):
+    sources = [SleepingAlertSource(None, f"Source{i}", 0.2, [f"alert{i}"]) for i in range(4)]
+    start = time.monotonic()
+    run_alerts(alert_service, sources)
+
+    assert time.monotonic() - start < 0.6
+    assert sorted(alert.args["name"] for alert in alert_service.alerts.values()) == [
+        "alert0", "alert1", "alert2", "alert3",
+    ]
+    stats = asyncio.run(alert_service.sources_stats())
+    assert all(stats[source.name]["max_lag"] < 0.1 for source in sources)
+
+
+def test__run_alerts_keeps_uuid(alert_service):
+    source = SleepingAlertSource(None, "Source", 0, ["a", "b"])
+    run_alerts(alert_service, [source])
+    uuids = {key: alert.uuid for key, alert in alert_service.alerts.items()}
+
+    source.alerts = ["b", "c"]
+    run_alerts(alert_service, [source])
+
+    assert [alert.args["name"] for alert in alert_service.alerts.values()] == ["b", "c"]
+    b_key = next(key for key, alert in alert_service.alerts.items() if alert.args["name"] == "b")
+    assert alert_service.alerts[b_key].uuid == uuids[b_key]
+
+
+def test__run_alerts_timeout(alert_service):
+    async def run():
+        slow = SleepingAlertSource(None, "Slow", 0.3, ["slow"])
+        slow.run_timeout = 0.1
+        fast = SleepingAlertSource(None, "Fast", 0, ["fast"])
+        with patch.object(alert_plugin, "ALERT_SOURCES", {"Slow": slow, "Fast": fast}):
+            await alert_service._AlertService__run_alerts()
+            failed = [alert.klass for alert in alert_service.alerts.values() if alert.source == "Slow"]
+            assert failed == [AlertSourceRunFailedAlertClass]
+            assert "Slow" in alert_service.sources_checks
+
+            # Check that is still in progress is awaited instead of being started again
+            slow.delay = 0
+            await alert_service._AlertService__run_alerts()
+            await asyncio.sleep(0.2)
+            await alert_service._AlertService__run_alerts()
+
+        assert slow.calls == 2
+        assert sorted(alert.args["name"] for alert in alert_service.alerts.values()) == ["fast", "slow"]
+
+    asyncio.run(run())
+
+
+class FailingAlertSource(SleepingAlertSource):
+    async def check(self):
+        await super().check()
+        raise ValueError("late failure")
+
+
+def test__run_alerts_timed_out_check_exception_retrieved(alert_service):
+    errors = []
+
+    async def run():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        failing = FailingAlertSource(None, "Failing", 0.1, [])
+        failing.run_timeout = 0.01
+        with patch.object(alert_plugin, "ALERT_SOURCES", {"Failing": failing}):
+            await alert_service._AlertService__run_alerts()
+            await asyncio.sleep(0.2)
+
+        assert "Failing" not in alert_service.sources_checks
+
+    asyncio.run(run())
+    gc.collect()
+
+    assert errors == []
+
+
+def test__run_other_node_alert_source_timeout(alert_service):
+    source = SleepingAlertSource(None, "Source", 0, [])
+    source.run_timeout = 30
+    alert_service.middleware.call = AsyncMock(return_value=[])
+    with patch.object(alert_plugin, "ALERT_SOURCES", {"Source": source}):
+        asyncio.run(alert_service._AlertService__run_other_node_alert_source("Source"))
+
+    # The other controller times out its own check first and reports it as a regular alert source failure
+    assert alert_service.middleware.call.call_args.args[-1]["timeout"] > source.run_timeout
@@ -1,6 +1,7 @@
+from collections import defaultdict
 from contextlib import asynccontextmanager
 import datetime
-from unittest.mock import ANY, patch
+from unittest.mock import ANY, call, Mock, patch
 
 import pytest
 import sqlalchemy as sa
@@ -41,12 +42,15 @@ async def datastore_test():
 
                 m["datastore.execute"] = ds.execute
                 m["datastore.execute_write"] = ds.execute_write
+                m["datastore.execute_write_many"] = ds.execute_write_many
                 m["datastore.fetchall"] = ds.fetchall
 
                 m["datastore.query"] = ds.query
                 m["datastore.send_insert_events"] = ds.send_insert_events
                 m["datastore.send_update_events"] = ds.send_update_events
                 m["datastore.send_delete_events"] = ds.send_delete_events
+                m["datastore.send_insert_many_events"] = ds.send_insert_many_events
+                m["datastore.send_update_many_events"] = ds.send_update_many_events
 
                 m["datastore.insert"] = ds.insert
                 m["datastore.update"] = ds.update
@@ -648,6 +652,28 @@ async def test__mtm_insert():
         ]
 
 
+@pytest.mark.asyncio
+async def test__mtm_insert_many():
+    async with datastore_test() as ds:
+        ds.execute("INSERT INTO storage_disk VALUES (10)")
+        ds.execute("INSERT INTO storage_disk VALUES (20)")
+        ds.execute("INSERT INTO storage_disk VALUES (30)")
+
+        assert await ds.insert_many(
+            "tasks.smarttest", [{"disks": [10, 30]}, {"disks": []}, {"disks": [20]}], {"prefix": "smarttest_"},
+        ) == [1, 2, 3]
+
+        assert await ds.query("tasks.smarttest", [], {"prefix": "smarttest_"}) == [
+            {"id": 1, "disks": [{"id": 10}, {"id": 30}]},
+            {"id": 2, "disks": []},
+            {"id": 3, "disks": [{"id": 20}]},
+        ]
+        ds.middleware.call_hook_inline.assert_called_once_with("datastore.post_execute_write_many", ANY, ANY)
+        assert [sql for sql, binds in ds.middleware.call_hook_inline.call_args.args[1]].count(
+            "INSERT INTO tasks_smarttest_smarttest_disks (smarttest_id, disk_id) VALUES (?, ?)"
+        ) == 3
+
+
 @pytest.mark.asyncio
 async def test__mtm_update():
     async with datastore_test() as ds:
@@ -792,3 +818,202 @@ async def test__null_order_by(order_by, result):
         await ds.insert("test.null", {"value": 1})
 
         assert [row["id"] for row in await ds.query("test.null", [], {"order_by": order_by})] == result
+
+
+@pytest.mark.asyncio
+async def test__query_cache_hit():
+    async with datastore_test() as ds:
+        ds.execute("INSERT INTO `account_bsdgroups` VALUES (20, 2020)")
+        ds.execute("INSERT INTO `account_bsdusers` VALUES (5, 55, 20)")
+
+        expected = [{"id": 5, "uid": 55, "group": {"id": 20, "bsdgrp_gid": 2020}}]
+        assert await ds.query("account.bsdusers", [], {"prefix": "bsdusr_"}) == expected
+
+        with patch.dict(ds.middleware, {"datastore.fetchall": Mock(side_effect=ds.fetchall)}):
+            result = await ds.query("account.bsdusers", [], {"prefix": "bsdusr_"})
+            assert result == expected
+            ds.middleware["datastore.fetchall"].assert_not_called()
+
+            # Callers are free to modify returned rows
+            result[0]["group"]["bsdgrp_gid"] = 0
+            assert await ds.query("account.bsdusers", [], {"prefix": "bsdusr_"}) == expected
+            assert await ds.query("account.bsdusers", [], {"prefix": "bsdusr_", "select": ["uid"]}) == [{"uid": 55}]
+            ds.middleware["datastore.fetchall"].assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test__query_cache_invalidated_by_write():
+    async with datastore_test() as ds:
+        ds.execute("INSERT INTO `account_bsdgroups` VALUES (20, 2020)")
+        ds.execute("INSERT INTO `account_bsdusers` VALUES (5, 55, 20)")
+
+        assert [u["bsdusr_group"]["bsdgrp_gid"] for u in await ds.query("account.bsdusers")] == [2020]
+        assert await ds.query("account.bsdusers", [], {"count": True}) == 1
+
+        # Joined table is updated
+        await ds.update("account.bsdgroups", 20, {"bsdgrp_gid": 3030})
+        assert [u["bsdusr_group"]["bsdgrp_gid"] for u in await ds.query("account.bsdusers")] == [3030]
+
+        await ds.insert("account.bsdusers", {"bsdusr_uid": 66, "bsdusr_group": 20})
+        assert await ds.query("account.bsdusers", [], {"count": True}) == 2
+
+
+@pytest.mark.asyncio
+async def test__query_cache_invalidated_by_cascade():
+    async with datastore_test() as ds:
+        ds.execute("INSERT INTO `account_bsdgroups` VALUES (10, 1010)")
+        ds.execute("INSERT INTO `account_bsdgroups` VALUES (20, 2020)")
+        ds.execute("INSERT INTO `account_bsdusers_cascade` VALUES (5, 55, 20)")
+
+        assert len(await ds.query("account.bsdusers_cascade", [], {"relationships": False})) == 1
+
+        await ds.delete("account.bsdgroups", 20)
+        assert await ds.query("account.bsdusers_cascade", [], {"relationships": False}) == []
+
+
+@pytest.mark.asyncio
+async def test__table_versions():
+    async with datastore_test() as ds:
+        ds.execute("INSERT INTO `account_bsdgroups` VALUES (20, 2020)")
+        groups = await ds.table_versions(["account.bsdgroups"])
+        users = await ds.table_versions(["account.bsdusers_cascade"])
+
+        await ds.insert("account.bsdusers", {"bsdusr_uid": 66, "bsdusr_group": 20})
+        assert await ds.table_versions(["account.bsdgroups"]) == groups
+        assert await ds.table_versions(["account.bsdusers_cascade"]) == users
+
+        # Deleting a group can delete rows of `account.bsdusers_cascade`
+        await ds.insert("account.bsdgroups", {"bsdgrp_gid": 1010})
+        assert await ds.table_versions(["account.bsdgroups"]) != groups
+        assert await ds.table_versions(["account.bsdusers_cascade"]) != users
+
+        users = await ds.table_versions(["account.bsdusers_cascade"])
+        ds.execute("DELETE FROM `account_bsdusers`")
+        assert await ds.table_versions(["account.bsdusers_cascade"]) != users
+
+
+@pytest.mark.asyncio
+async def test__execute_write_expanding_in():
+    async with datastore_test() as ds:
+        ds.execute("INSERT INTO `account_bsdgroups` VALUES (10, 1010)")
+        ds.execute("INSERT INTO `account_bsdgroups` VALUES (20, 2020)")
+        ds.execute("INSERT INTO `account_bsdgroups` VALUES (30, 3030)")
+
+        await ds.delete("account.bsdgroups", [("bsdgrp_gid", "in", [1010, 3030])])
+        await ds.delete("account.bsdgroups", [("bsdgrp_gid", "in", [2020])])
+
+        assert ds.middleware.call_hook_inline.call_args_list == [
+            call(
+                "datastore.post_execute_write",
+                "DELETE FROM account_bsdgroups WHERE account_bsdgroups.bsdgrp_gid IN (?, ?)",
+                [1010, 3030],
+                ANY,
+            ),
+            call(
+                "datastore.post_execute_write",
+                "DELETE FROM account_bsdgroups WHERE account_bsdgroups.bsdgrp_gid IN (?)",
+                [2020],
+                ANY,
+            ),
+        ]
+        assert await ds.query("account.bsdgroups") == []
+
+
+@pytest.mark.asyncio
+async def test__query_plan_reused():
+    async with datastore_test() as ds:
+        ds.execute("INSERT INTO `account_bsdgroups` VALUES (20, 2020)")
+        ds.execute("INSERT INTO `account_bsdusers` VALUES (5, 55, 20)")
+
+        with patch("middlewared.plugins.datastore.read.query_plans", {}) as query_plans:
+            assert len(await ds.query("account.bsdusers", [("uid", "=", 55)], {"prefix": "bsdusr_"})) == 1
+            plan = list(query_plans.values())
+
+            assert await ds.query("account.bsdusers", [("uid", "=", 56)], {"prefix": "bsdusr_"}) == []
+            assert list(query_plans.values()) == plan
+
+
+@pytest.mark.asyncio
+async def test__insert_many_rolled_back():
+    async with datastore_test() as ds:
+        ds.execute("INSERT INTO `account_bsdgroups` VALUES (10, 1010)")
+
+        with pytest.raises(IntegrityError):
+            await ds.insert_many("account.bsdusers", [
+                {"bsdusr_uid": 55, "bsdusr_group": 10},
+                {"bsdusr_uid": 66, "bsdusr_group": 20},
+            ])
+
+        assert await ds.query("account.bsdusers") == []
+        ds.middleware.call_hook_inline.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test__update_many():
+    async with datastore_test() as ds:
+        ds.execute("INSERT INTO `account_bsdgroups` VALUES (10, 1010)")
+        ds.execute("INSERT INTO `account_bsdgroups` VALUES (20, 2020)")
+        ds.execute("INSERT INTO `account_bsdusers` VALUES (4, 44, 10)")
+        ds.execute("INSERT INTO `account_bsdusers` VALUES (5, 55, 20)")
+
+        assert await ds.update_many(
+            "account.bsdusers", [[4, {"bsdusr_uid": 40}], [5, {"bsdusr_group": 10}]]
+        ) == [4, 5]
+
+        assert [
+            (u["bsdusr_uid"], u["bsdusr_group"]["id"]) for u in await ds.query("account.bsdusers")
+        ] == [(40, 10), (55, 10)]
+        ds.middleware.call_hook_inline.assert_called_once_with(
+            "datastore.post_execute_write_many",
+            [
+                ("UPDATE account_bsdusers SET bsdusr_uid=? WHERE account_bsdusers.id = ?", [40, 4]),
+                ("UPDATE account_bsdusers SET bsdusr_group_id=? WHERE account_bsdusers.id = ?", [10, 5]),
+            ],
+            ANY,
+        )
+
+        with pytest.raises(RuntimeError):
+            await ds.update_many("account.bsdusers", [[6, {"bsdusr_uid": 60}]])
+
+
+@pytest.mark.asyncio
+async def test__update_many_missing_id_rolled_back():
+    async with datastore_test() as ds:
+        ds.execute("INSERT INTO `account_bsdgroups` VALUES (10, 1010)")
+        ds.execute("INSERT INTO `account_bsdusers` VALUES (4, 44, 10)")
+        ds.execute("INSERT INTO `account_bsdusers` VALUES (5, 55, 10)")
+
+        with pytest.raises(RuntimeError):
+            await ds.update_many("account.bsdusers", [
+                [4, {"bsdusr_uid": 40}],
+                [6, {"bsdusr_uid": 60}],
+                [5, {"bsdusr_uid": 50}],
+            ])
+
+        assert [u["bsdusr_uid"] for u in await ds.query("account.bsdusers")] == [44, 55]
+        ds.middleware.call_hook_inline.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test__bulk_write_events():
+    async with datastore_test() as ds:
+        ds.middleware["group.query"] = Mock(side_effect=lambda filters, options: [
+            {"id": row["id"], "gid": row["bsdgrp_gid"]}
+            for row in ds.fetchall("SELECT * FROM account_bsdgroups")
+            if row["id"] in filters[0][2]
+        ])
+        with patch("middlewared.plugins.datastore.event.DatastoreService.events", defaultdict(list)):
+            await ds.register_event({"description": "Groups", "datastore": "account.bsdgroups", "plugin": "group"})
+
+            assert await ds.insert_many("account.bsdgroups", [{"gid": 1010}, {"gid": 2020}], {"prefix": "bsdgrp_"}) == [1, 2]
+            await ds.update_many("account.bsdgroups", [[2, {"gid": 3030}], [3, {}]], {"prefix": "bsdgrp_"})
+
+        assert ds.middleware["group.query"].call_args_list == [
+            call([["id", "in", [1, 2]]], {}),
+            call([["id", "in", [2, 3]]], {}),
+        ]
+        assert ds.middleware.send_event.call_args_list == [
+            call("group.query", "ADDED", id=1, fields={"id": 1, "gid": 1010}),
+            call("group.query", "ADDED", id=2, fields={"id": 2, "gid": 2020}),
+            call("group.query", "CHANGED", id=2, fields={"id": 2, "gid": 3030}),
+        ]
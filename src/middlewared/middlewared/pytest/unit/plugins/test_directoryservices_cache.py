@@ -0,0 +1,91 @@
+import pytest
+
+from middlewared.plugins.directoryservices_.util_cache_index import DSCacheIndex
+from middlewared.service_exception import MatchNotFound
+
+BASE_ID = 100000000
+
+
+def user(uid, sid=None):
+    return {
+        'id': BASE_ID + uid,
+        'uid': uid,
+        'username': f'user{uid}',
+        'groups': [],
+        'sid': sid,
+        'local': False,
+    }
+
+
+@pytest.fixture
+def index():
+    return DSCacheIndex('uid', 'username', [
+        user(uid, f'S-1-5-21-1-2-3-{uid}' if uid % 2 else None) for uid in (1003, 1001, 1002, 1000)
+    ])
+
+
+def test__index_ordered_by_id(index):
+    assert [entry['uid'] for entry in index.query([], {})] == [1000, 1001, 1002, 1003]
+    assert [entry['uid'] for entry in index.query([['uid', '>', 1001]], {})] == [1002, 1003]
+
+
+@pytest.mark.parametrize('filters,expected', [
+    ([['uid', '=', 1001]], [1001]),
+    ([['username', '=', 'user1002']], [1002]),
+    ([['sid', '=', 'S-1-5-21-1-2-3-1003']], [1003]),
+    ([['uid', 'in', [1003, 1000, 9999]]], [1000, 1003]),
+    ([['uid', '=', 9999]], []),
+])
+def test__index_lookup(index, filters, expected):
+    assert [entry['uid'] for entry in index.lookup(filters)] == expected
+    assert [entry['uid'] for entry in index.query(filters, {})] == expected
+
+
+@pytest.mark.parametrize('filters', [
+    [['sid', '=', None]],
+    [['uid', '!=', 1001]],
+    [['local', '=', False]],
+    [['uid', '=', 1001], ['local', '=', False]],
+    [['username', 'in', 'user1001']],
+])
+def test__index_lookup_fallback(index, filters):
+    assert index.lookup(filters) is None
+
+
+def test__index_null_sid(index):
+    assert [entry['uid'] for entry in index.query([['sid', '=', None]], {})] == [1000, 1002]
+
+
+def test__index_query_options(index):
+    assert index.query([], {'count': True}) == 4
+    assert index.query([['uid', '=', 1002]], {'get': True})['username'] == 'user1002'
+    assert index.query([], {'select': ['username'], 'limit': 2}) == [{'username': 'user1000'}, {'username': 'user1001'}]
+
+
+def test__index_returns_copies(index):
+    entry = index.query([['uid', '=', 1000]], {})[0]
+    entry['groups'].append(1)
+    entry['username'] = 'changed'
+
+    assert index.get('uid', 1000)['groups'] == []
+    assert index.get('username', 'user1000')['uid'] == 1000
+    with pytest.raises(MatchNotFound):
+        index.get('username', 'changed')
+
+
+def test__index_insert(index):
+    snapshot = index.entries
+    index.insert(user(999))
+    index.insert(user(1001) | {'username': 'renamed'})
+
+    assert [entry['uid'] for entry in index.query([], {})] == [999, 1000, 1001, 1002, 1003]
+    assert index.get('username', 'renamed')['uid'] == 1001
+    with pytest.raises(MatchNotFound):
+        index.get('username', 'user1001')
+
+    # SID of the replaced entry is no longer indexed
+    with pytest.raises(MatchNotFound):
+        index.get('sid', 'S-1-5-21-1-2-3-1001')
+
+    # queries that were in progress are not affected
+    assert len(snapshot) == 4
@@ -0,0 +1,163 @@
+import asyncio
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+
+from middlewared.plugins.etc import EtcService
+from middlewared.pytest.unit.middleware import Middleware
+
+GROUPS = {
+    'users': {
+        'ctx': [
+            {'method': 'user.query', 'args': [[['local', '=', True]]]},
+        ],
+        'entries': [
+            {'type': 'py', 'path': 'passwd'},
+            {'type': 'py', 'path': 'shadow'},
+        ],
+    },
+    'shadow': {
+        'ctx': [
+            {'method': 'user.query', 'args': [[['local', '=', True]]]},
+        ],
+        'entries': [
+            {'type': 'mako', 'path': 'shadow'},
+        ],
+    },
+    'certificates': [
+        {'type': 'py', 'path': 'certificates'},
+    ],
+    'syslog': [
+        {'type': 'mako', 'path': 'local/syslog.conf'},
+    ],
+    'sysctl': [
+        {'type': 'mako', 'path': 'sysctl.conf'},
+        {'type': 'py', 'path': 'grub', 'checkpoint': 'post_init'},
+    ],
+}
+DEPENDENCIES = {
+    'syslog': ['certificates'],
+}
+
+
+@pytest.fixture
+def etc():
+    with patch.object(EtcService, 'GROUPS', GROUPS), patch.object(EtcService, 'DEPENDENCIES', DEPENDENCIES):
+        yield EtcService(Middleware())
+
+
+def test__group_dependencies(etc):
+    assert etc.group_dependencies('initial') == {
+        'users': set(),
+        'shadow': {'users'},
+        # Groups with `py` entries are generated after all preceding groups
+        'certificates': {'shadow'},
+        'syslog': {'certificates'},
+        'sysctl': {'certificates'},
+    }
+    assert etc.group_dependencies('post_init') == {'sysctl': set()}
+
+
+@pytest.mark.asyncio
+async def test__gather_ctx_shared_calls(etc):
+    etc.middleware['user.query'] = AsyncMock(return_value=[{'username': 'root'}])
+
+    calls = {}
+    first, second = await asyncio.gather(
+        etc.gather_ctx(GROUPS['users']['ctx'], calls),
+        etc.gather_ctx(GROUPS['shadow']['ctx'], calls),
+    )
+
+    etc.middleware['user.query'].assert_called_once_with([['local', '=', True]])
+    assert first == second == {'user.query': [{'username': 'root'}]}
+    # Every group gets its own copy of the result
+    assert first['user.query'] is not second['user.query']
+
+
+@pytest.mark.asyncio
+async def test__generate_checkpoint(etc):
+    etc.middleware['user.query'] = AsyncMock(return_value=[])
+    rendered = []
+    running = set()
+    concurrent = []
+
+    async def render(path, ctx):
+        path = path.removeprefix(f'{etc.files_dir}/')
+        rendered.append(path)
+        running.add(path)
+        concurrent.append(set(running))
+        await asyncio.sleep(0.01)
+        running.discard(path)
+
+    with patch.object(etc._renderers['py'], 'render', render), patch.object(etc._renderers['mako'], 'render', render):
+        await etc.generate_checkpoint('initial')
+
+    assert sorted(rendered) == [
+        'certificates', 'local/syslog.conf', 'passwd', 'shadow', 'shadow', 'sysctl.conf',
+    ]
+    # Dependent groups are generated after their dependencies finished, other groups are generated concurrently
+    assert rendered[:4] == ['passwd', 'shadow', 'shadow', 'certificates']
+    assert {'local/syslog.conf', 'sysctl.conf'} in concurrent
+    assert all(len(paths) == 1 for paths in concurrent[:4])
+    etc.middleware['user.query'].assert_called_once()
+
+    report = await etc.checkpoint_report('initial')
+    assert set(report['groups']) == {'users', 'shadow', 'certificates', 'syslog', 'sysctl'}
+    assert set(report['groups']['users']['files']) == {'/etc/passwd', '/etc/shadow'}
+    assert set(report['groups']['syslog']['files']) == {'/etc/syslog.conf'}
+
+
+@pytest.mark.asyncio
+async def test__py_renderer_module_cached(etc, tmp_path):
+    (tmp_path / 'test.conf.py').write_text('RENDERS = []\n\ndef render(service, middleware):\n    RENDERS.append(1)\n')
+    renderer = etc._renderers['py']
+
+    await renderer.render(str(tmp_path / 'test.conf'), None)
+    await renderer.render(str(tmp_path / 'test.conf'), None)
+
+    assert renderer.get_module(str(tmp_path / 'test.conf')).RENDERS == [1, 1]
+
+
+@pytest.mark.asyncio
+async def test__generate_incremental(etc):
+    group = {
+        'ctx': [
+            {'method': 'nfs.config'},
+        ],
+        'entries': [
+            {'type': 'py', 'path': 'exports', 'datastore': ['sharing.nfs_share']},
+            {'type': 'py', 'path': 'nfs.conf', 'datastore': []},
+            {'type': 'py', 'path': 'idmapd.conf'},
+        ],
+    }
+    versions = {'sharing.nfs_share': 1}
+    stat = {'/etc/exports': 1, '/etc/nfs.conf': 1, '/etc/idmapd.conf': 1}
+    etc.middleware['nfs.config'] = AsyncMock(return_value={'servers': 4})
+    etc.middleware['datastore.table_versions'] = Mock(side_effect=lambda tables: [versions[t] for t in tables])
+    render = AsyncMock(return_value='')
+
+    async def generate():
+        render.reset_mock()
+        await etc.generate('nfs')
+        return sorted(call.args[0].removeprefix(f'{etc.files_dir}/') for call in render.call_args_list)
+
+    with (
+        patch.dict(EtcService.GROUPS, {'nfs': group}),
+        patch.object(etc._renderers['py'], 'render', render),
+        patch.object(etc, 'make_changes', Mock(return_value=0)),
+        patch.object(etc, 'outfile_stat', AsyncMock(side_effect=lambda outfile: stat[outfile])),
+    ):
+        assert await generate() == ['exports', 'idmapd.conf', 'nfs.conf']
+        # Entries without `datastore` are always rendered
+        assert await generate() == ['idmapd.conf']
+
+        versions['sharing.nfs_share'] += 1
+        assert await generate() == ['exports', 'idmapd.conf']
+
+        etc.middleware['nfs.config'].return_value = {'servers': 8}
+        assert await generate() == ['exports', 'idmapd.conf', 'nfs.conf']
+
+        # Generated file was modified
+        stat['/etc/nfs.conf'] += 1
+        assert await generate() == ['idmapd.conf', 'nfs.conf']
+        assert await generate() == ['idmapd.conf']
@@ -0,0 +1,78 @@
+import asyncio
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+
+from middlewared.plugins.failover_.datastore import FailoverDatastoreService
+from middlewared.plugins.failover_.replication_log import ReplicationLog
+
+
+def test__replication_log_tail():
+    log = ReplicationLog(max_entries=3)
+    for i in range(1, 5):
+        log.append([[f'UPDATE t SET v = {i}', []]])
+
+    # Entry 1 was dropped
+    assert log.tail(0, 10) is None
+    assert [entry[0] for entry in log.tail(1, 10)] == [2, 3, 4]
+    assert [entry[0] for entry in log.tail(2, 1)] == [3]
+    assert log.tail(4, 10) == []
+
+
+def test__replication_log_acknowledge():
+    log = ReplicationLog()
+    log.append([['INSERT', []]])
+    log.append([['UPDATE', []]])
+    assert log.wait(0)
+
+    log.acknowledge(1)
+    assert log.tail(1, 10) == [[2, [['UPDATE', []]]]]
+    assert log.wait(0)
+
+    log.acknowledge(2)
+    assert log.tail(2, 10) == []
+    assert not log.wait(0)
+    assert log.position() == {'epoch': log.epoch, 'seq': 2}
+
+
+@pytest.fixture
+def standby():
+    executed = []
+
+    async def call(method, *args):
+        match method:
+            case 'system.version':
+                return '25.04'
+            case 'failover.status':
+                return 'BACKUP'
+            case 'datastore.execute_many':
+                executed.extend(args[0])
+
+    service = FailoverDatastoreService(Mock(call=AsyncMock(side_effect=call)))
+    service.received = {'epoch': 'epoch', 'seq': 2}
+    service.apply_lock = asyncio.Lock()
+    service.executed = executed
+    return service
+
+
+def test__apply_in_order(standby):
+    data = {'version': '25.04', 'epoch': 'epoch'}
+    entries = [[2, [['Q2', []]]], [3, [['Q3a', []], ['Q3b', [1]]]], [4, [['Q4', []]]]]
+
+    assert asyncio.run(standby.apply(data, entries)) == {'epoch': 'epoch', 'seq': 4}
+    # Entry 2 had already been applied
+    assert standby.executed == [['Q3a', []], ['Q3b', [1]], ['Q4', []]]
+
+
+@pytest.mark.parametrize('data,entries', [
+    ({'version': '25.04', 'epoch': 'epoch'}, [[4, [['Q4', []]]]]),
+    ({'version': '25.04', 'epoch': 'other'}, [[3, [['Q3', []]]]]),
+])
+def test__apply_not_following(standby, data, entries):
+    assert asyncio.run(standby.apply(data, entries)) == {'epoch': 'epoch', 'seq': 2}
+    assert standby.executed == []
+
+
+def test__apply_version_mismatch(standby):
+    assert asyncio.run(standby.apply({'version': '24.10', 'epoch': 'epoch'}, [[3, [['Q3', []]]]])) is None
+    assert standby.executed == []
@@ -0,0 +1,60 @@
+import pytest
+
+from middlewared.plugins.zfs_.snapshot_utils import order_snapshots_by_txg, SnapshotQueryPushdown
+
+
+def pushdown(filters, **options):
+    return SnapshotQueryPushdown.from_query(filters, {'extra': {}, **options})
+
+
+@pytest.mark.parametrize('filters,datasets,recursive', [
+    ([['pool', '=', 'tank']], ['tank'], True),
+    ([['dataset', 'in', ['tank/a', 'dozer/b']]], ['tank/a', 'dozer/b'], False),
+    ([['id', '=', 'tank/a@snap']], ['tank/a@snap'], None),
+    ([['name', '^', 'tank/a@auto-']], ['tank/a'], False),
+    ([['name', '^', 'tank/share']], ['tank'], True),
+    ([['name', '^', 'tank']], None, None),
+    ([['name', '~', 'tank/a@.*']], None, None),
+])
+def test__snapshot_query_datasets_pushdown(filters, datasets, recursive):
+    result = pushdown(filters)
+    assert result.kwargs.get('datasets') == datasets
+    assert result.kwargs.get('recursive') == recursive
+    # narrowing down datasets does not replace filtering
+    assert result.filters == filters
+
+
+@pytest.mark.parametrize('filters,min_txg,max_txg', [
+    ([['createtxg', '>', 100]], 101, 0),
+    ([['createtxg', '>=', '100'], ['createtxg', '<', 200]], 100, 199),
+    ([['createtxg', '=', 5]], 5, 5),
+])
+def test__snapshot_query_txg_pushdown(filters, min_txg, max_txg):
+    result = pushdown(filters)
+    assert (result.kwargs['min_txg'], result.kwargs['max_txg']) == (min_txg, max_txg)
+    assert result.filters == []
+
+
+def test__snapshot_query_txg_pushdown_not_possible():
+    assert pushdown([['createtxg', '<', 1]]).filters == [['createtxg', '<', 1]]
+
+
+@pytest.mark.parametrize('filters,options,props', [
+    ([], {'select': ['name', 'createtxg']}, []),
+    ([], {'select': ['name', 'properties']}, None),
+    ([['properties.used.parsed', '>', 0]], {'select': ['name']}, None),
+    ([], {'select': ['name'], 'order_by': ['-properties.used.parsed']}, None),
+    ([], {}, None),
+])
+def test__snapshot_query_properties_pushdown(filters, options, props):
+    assert pushdown(filters, **options).kwargs['props'] == props
+
+
+def test__snapshot_query_order_by_txg():
+    snapshots = [{'name': f'tank@{i}', 'createtxg': str(i)} for i in (9, 10, 100, 2)]
+    result = pushdown([['name', '!=', 'tank@100']], order_by=['-createtxg'], limit=2)
+    assert result.txg_reverse is True
+    assert 'order_by' not in result.options
+    ordered = order_snapshots_by_txg(result.iter_filtered(iter(snapshots)), result.txg_reverse, result.top)
+    assert [s['createtxg'] for s in ordered] == ['10', '9']
+    assert result.filters == []
@@ -0,0 +1,122 @@
+import asyncio
+from collections import Counter, defaultdict
+import functools
+import itertools
+import json
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+
+from middlewared.api.base.server.ws_handler.rpc import RpcWebSocketApp
+from middlewared.common.event_source.manager import EventSourceManager
+from middlewared.main import Application, Middleware
+
+session_ids = itertools.count()
+
+
+def make_middleware():
+    middleware = object.__new__(Middleware)
+    middleware.loop = asyncio.get_running_loop()
+    middleware.logger = Mock()
+    middleware.events = {'test.collection': {}, 'test.other': {}}
+    middleware.event_source_manager = EventSourceManager(middleware)
+    middleware._Middleware__wsclients = {}
+    middleware._Middleware__wsclient_subscriptions = defaultdict(Counter)
+    middleware._Middleware__event_subs = defaultdict(list)
+    return middleware
+
+
+def make_client(middleware, klass=RpcWebSocketApp):
+    client = Mock(
+        spec=klass, session_id=str(next(session_ids)), subscriptions={}, ws=Mock(send_str=AsyncMock()),
+        middleware=middleware,
+    )
+    client.add_subscription = functools.partial(klass.add_subscription, client)
+    client.remove_subscription = functools.partial(klass.remove_subscription, client)
+    client.encode_event = klass.encode_event
+
+    middleware.register_wsclient(client)
+    return client
+
+
+async def send_event(middleware, *args, **kwargs):
+    middleware.send_event(*args, **kwargs)
+    await asyncio.sleep(0.1)
+
+
+@pytest.mark.asyncio
+async def test__send_event_only_to_subscribed_clients():
+    middleware = make_middleware()
+    subscribed = make_client(middleware)
+    subscribed.add_subscription('1', 'test.collection')
+    wildcard = make_client(middleware)
+    wildcard.add_subscription('1', '*')
+    other = make_client(middleware)
+    other.add_subscription('1', 'test.other')
+
+    await send_event(middleware, 'test.collection', 'ADDED', id=1, fields={'name': 'test'})
+
+    message = {
+        'jsonrpc': '2.0',
+        'method': 'collection_update',
+        'params': {'msg': 'added', 'collection': 'test.collection', 'id': 1, 'fields': {'name': 'test'}},
+    }
+    assert json.loads(subscribed.ws.send_str.call_args.args[0]) == message
+    assert json.loads(wildcard.ws.send_str.call_args.args[0]) == message
+    other.ws.send_str.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test__send_event_encoded_once_per_client_class():
+    middleware = make_middleware()
+    clients = [
+        make_client(middleware, klass) for klass in (RpcWebSocketApp, RpcWebSocketApp, Application, Application)
+    ]
+    for client in clients:
+        client.add_subscription('1', 'test.collection')
+
+    with patch('middlewared.api.base.server.ws_handler.rpc.json.dumps', Mock(wraps=json.dumps)) as dumps:
+        await send_event(middleware, 'test.collection', 'CHANGED', id=1, fields={'name': 'test'})
+
+    assert dumps.call_count == 2
+    assert clients[0].ws.send_str.call_args == clients[1].ws.send_str.call_args
+    assert json.loads(clients[2].ws.send_str.call_args.args[0]) == {
+        'msg': 'changed', 'collection': 'test.collection', 'id': 1, 'fields': {'name': 'test'},
+    }
+    assert clients[2].ws.send_str.call_args == clients[3].ws.send_str.call_args
+
+
+@pytest.mark.asyncio
+async def test__send_event_should_send_event():
+    middleware = make_middleware()
+    allowed = make_client(middleware)
+    allowed.add_subscription('1', 'test.collection')
+    denied = make_client(middleware)
+    denied.add_subscription('1', 'test.collection')
+
+    await send_event(middleware, 'test.collection', 'REMOVED', id=1,
+                     should_send_event=lambda wsclient: wsclient is allowed)
+
+    allowed.ws.send_str.assert_called_once()
+    denied.ws.send_str.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test__send_event_unsubscribed():
+    middleware = make_middleware()
+    client = make_client(middleware)
+    client.add_subscription('1', 'test.collection')
+    client.add_subscription('2', 'test.collection')
+    gone = make_client(middleware)
+    gone.add_subscription('1', 'test.collection')
+
+    client.remove_subscription('1')
+    middleware.unregister_wsclient(gone)
+    await send_event(middleware, 'test.collection', 'REMOVED', id=1)
+    client.ws.send_str.assert_called_once()
+    gone.ws.send_str.assert_not_called()
+
+    client.remove_subscription('2')
+    await send_event(middleware, 'test.collection', 'REMOVED', id=1)
+    client.ws.send_str.assert_called_once()
+    assert middleware._Middleware__wsclient_subscriptions == {}
@@ -0,0 +1,77 @@
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+
+from middlewared.worker import FakeJob, WorkerClient
+
+
+def progress_updates(client):
+    return [c.args[2]['progress']['percent'] for c in client.call.call_args_list]
+
+
+def test__fake_job_progress_coalesced():
+    client = Mock()
+    job = FakeJob(1, client)
+    with patch('middlewared.worker.JOB_PROGRESS_INTERVAL', 60):
+        for percent in range(0, 100, 10):
+            job.set_progress(percent)
+
+        assert progress_updates(client) == [0]
+
+        job.set_progress(100)
+        assert progress_updates(client) == [0, 100]
+
+        job.set_progress(100, 'Done')
+        job.flush_progress()
+        job.flush_progress()
+        assert progress_updates(client) == [0, 100, 100]
+
+
+def test__fake_job_progress_sent_after_interval():
+    client = Mock()
+    job = FakeJob(1, client)
+    with patch('middlewared.worker.JOB_PROGRESS_INTERVAL', 0.1):
+        job.set_progress(10)
+        job.set_progress(20)
+        job.set_progress(30, 'Working')
+
+        time.sleep(0.5)
+        assert progress_updates(client) == [10, 30]
+        assert client.call.call_args.args[2]['progress']['description'] == 'Working'
+
+
+@pytest.mark.parametrize('error,reconnected', [
+    (None, False),
+    (ConnectionResetError(), True),
+    (ValueError(), False),
+])
+def test__worker_client_reconnects(error, reconnected):
+    clients = []
+
+    def connect(*args, **kwargs):
+        clients.append(Mock())
+        return clients[-1]
+
+    on_connect = Mock()
+    with patch('middlewared.worker.Client', Mock(side_effect=connect)):
+        client = WorkerClient('ws+unix:///tmp/test.sock')
+        client.register_on_connect(on_connect)
+        client.call('core.ping')
+        clients[0].call.side_effect = error
+        if error is None:
+            client.call('core.ping')
+        else:
+            with pytest.raises(type(error)):
+                client.call('core.ping')
+
+        # Request might have been received before the connection was closed, so it is not sent again
+        assert len(clients) == 1
+        clients[0].call.side_effect = None
+        client.call('core.ping')
+
+    assert len(clients) == (2 if reconnected else 1)
+    assert [c.args[0] for c in on_connect.call_args_list] == clients
+    assert [c.call.call_count for c in clients] == ([2, 1] if reconnected else [3])
+    if reconnected:
+        clients[0].close.assert_called_once()
@@ -48,3 +48,119 @@ def test__list_to_attr_mask_conversion_single(attr):
 def test__list_to_attr_mask_conversion_multi():
     payload = [attr.name for attr in attrs.SUPPORTED_ATTRS]
     assert attrs.zfs_attributes_to_mask(payload) == attrs.SUPPORTED_ATTRS
+
+
+@pytest.mark.parametrize('basic,mask', [
+    ('FULL_CONTROL', 0x1f01ff),
+    ('MODIFY', 0x1301ff),
+    ('READ', 0x1200a9),
+    ('TRAVERSE', 0x1200a8),
+])
+def test__nfs4_basic_perms(basic, mask):
+    assert acl.NFS4_BASIC_PERMS[basic] == mask
+
+
+NFS4_ACL = [
+    {'tag': 'owner@', 'id': -1, 'type': 'ALLOW', 'perms': {'BASIC': 'FULL_CONTROL'}, 'flags': {'BASIC': 'INHERIT'}},
+    {'tag': 'GROUP', 'id': 1000, 'type': 'ALLOW', 'perms': {'BASIC': 'READ'}, 'flags': {'BASIC': 'NOINHERIT'}},
+    {'tag': 'USER', 'id': 1001, 'type': 'DENY', 'perms': {
+        perm.name: perm in (acl.NFS4ACEMask.WRITE_DATA, acl.NFS4ACEMask.APPEND_DATA) for perm in acl.NFS4ACEMask
+    }, 'flags': {
+        flag.name: flag is acl.NFS4ACEFlag.FILE_INHERIT for flag in acl.NFS4_ACE_FLAGS
+    }},
+    {'tag': 'everyone@', 'id': -1, 'type': 'ALLOW', 'perms': {'BASIC': 'TRAVERSE'}, 'flags': {'BASIC': 'NOINHERIT'}},
+]
+
+
+def test__nfs4_xdr_round_trip():
+    aces = [acl.nfs4ace_from_dict(entry) for entry in NFS4_ACL]
+    assert aces[1] == (0, acl.NFS4ACEFlag.IDENTIFIER_GROUP, 0, 0x1200a9, 1000)
+    assert aces[3] == (0, 0, acl.NFS4_ACEI_SPECIAL_WHO, 0x1200a8, acl.NFS4Who.EVERYONE)
+
+    buf = acl.nfs4acl_xdr_encode(acl.NFS4ACLFlag.PROTECTED, aces)
+    assert len(buf) == 8 + 20 * len(aces)
+
+    aclflags, decoded = acl.nfs4acl_xdr_decode(buf)
+    assert acl.nfs4acl_to_dict(aclflags, decoded) == {
+        'acl': NFS4_ACL,
+        'nfs41_flags': {'autoinherit': False, 'protected': True, 'defaulted': False},
+        'trivial': False,
+    }
+
+
+def test__nfs4_not_simplified():
+    ace = acl.nfs4ace_to_dict(acl.nfs4ace_from_dict(NFS4_ACL[0]), simplified=False)
+    assert all(ace['perms'].values())
+    assert ace['flags'] == {flag.name: flag in acl.NFS4_BASIC_FLAGS['INHERIT'] for flag in acl.NFS4_ACE_FLAGS}
+
+
+@pytest.mark.parametrize('entry', [
+    {'tag': 'USER', 'id': -1, 'perms': {'BASIC': 'READ'}, 'flags': {'BASIC': 'INHERIT'}},
+    {'tag': 'owner@', 'id': -1, 'perms': {'BASIC': 'WRITE'}, 'flags': {'BASIC': 'INHERIT'}},
+    {'tag': 'owner@', 'id': -1, 'perms': {'READ': True}, 'flags': {'BASIC': 'INHERIT'}},
+    {'tag': 'owner@', 'id': -1, 'perms': {'BASIC': 'READ'}, 'flags': {'BASIC': 'INHERIT'}, 'type': 'AUDIT2'},
+    {'tag': 'mask@', 'id': -1, 'perms': {'BASIC': 'READ'}, 'flags': {'BASIC': 'INHERIT'}},
+])
+def test__nfs4_invalid_entry(entry):
+    with pytest.raises(ValueError):
+        acl.nfs4ace_from_dict(entry)
+
+
+@pytest.mark.parametrize('buf', [b'', b'\x00' * 12, b'\x00\x00\x00\x00\x00\x00\x00\x02' + b'\x00' * 20])
+def test__nfs4_xdr_invalid(buf):
+    with pytest.raises(ValueError):
+        acl.nfs4acl_xdr_decode(buf)
+
+
+def test__posix_xattr_round_trip():
+    entries = [
+        acl.posixace_from_dict({'tag': tag, 'id': id_, 'perms': {'READ': True, 'WRITE': False, 'EXECUTE': True}})
+        for tag, id_ in (('OTHER', -1), ('GROUP', 20), ('USER', 1001), ('USER', 1000), ('USER_OBJ', -1))
+    ]
+    buf = acl.posixacl_xattr_encode(entries)
+    assert buf[:4] == b'\x02\x00\x00\x00'
+    assert [(tag, id_) for tag, perm, id_ in acl.posixacl_xattr_decode(buf)] == [
+        (acl.POSIXACLTag.USER_OBJ, acl.POSIX_ACL_UNDEFINED_ID),
+        (acl.POSIXACLTag.USER, 1000),
+        (acl.POSIXACLTag.USER, 1001),
+        (acl.POSIXACLTag.GROUP, 20),
+        (acl.POSIXACLTag.OTHER, acl.POSIX_ACL_UNDEFINED_ID),
+    ]
+    assert acl.posixace_to_dict(acl.posixacl_xattr_decode(buf)[0], True) == {
+        'default': True, 'tag': 'USER_OBJ', 'id': -1, 'perms': {'READ': True, 'WRITE': False, 'EXECUTE': True},
+    }
+
+
+def test__posix_complete_mask():
+    entries = acl._posixacl_complete([
+        (acl.POSIXACLTag.USER, 4, 1000),
+        (acl.POSIXACLTag.GROUP_OBJ, 1, acl.POSIX_ACL_UNDEFINED_ID),
+    ], acl.posixacl_from_mode(0o750))
+    assert sorted(entries) == [
+        (acl.POSIXACLTag.USER_OBJ, 7, acl.POSIX_ACL_UNDEFINED_ID),
+        (acl.POSIXACLTag.USER, 4, 1000),
+        (acl.POSIXACLTag.GROUP_OBJ, 1, acl.POSIX_ACL_UNDEFINED_ID),
+        (acl.POSIXACLTag.MASK, 5, acl.POSIX_ACL_UNDEFINED_ID),
+        (acl.POSIXACLTag.OTHER, 0, acl.POSIX_ACL_UNDEFINED_ID),
+    ]
+
+
+def test__getacl_posix1e_from_mode(tmp_path):
+    path = tmp_path / 'file'
+    path.touch(mode=0o640)
+    path.chmod(0o640)
+
+    result = acl.getacl_posix1e(str(path))
+    assert result['trivial'] is True
+    assert [(ace['tag'], ace['perms']) for ace in result['acl']] == [
+        ('USER_OBJ', {'READ': True, 'WRITE': True, 'EXECUTE': False}),
+        ('GROUP_OBJ', {'READ': True, 'WRITE': False, 'EXECUTE': False}),
+        ('OTHER', {'READ': False, 'WRITE': False, 'EXECUTE': False}),
+    ]
+
+
+def test__getacl_many(tmp_path):
+    (tmp_path / 'file').touch()
+    results = dict(acl.getacl_many([str(tmp_path / 'file'), str(tmp_path / 'missing')], acl.getacl_posix1e))
+    assert results[str(tmp_path / 'file')]['acltype'] == 'POSIX1E'
+    assert isinstance(results[str(tmp_path / 'missing')], FileNotFoundError)
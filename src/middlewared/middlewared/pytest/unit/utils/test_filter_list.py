@@ -1,6 +1,6 @@
 import pytest
 import datetime
-from middlewared.utils import filter_list
+from middlewared.utils import filter_list, filters
 
 
 DATA = [
@@ -591,3 +591,72 @@ def test__filter_list_undefined():
 
 def test__filter_list_invalid_key():
     assert len(filter_list(DATA_WITH_NULL, [['canary', 'in', 'canary2']])) == 0
+
+
+def test__filter_list_compiled_query_cached():
+    flt = filters()
+    first = flt.compile_query([['foo', '=', 'foo1']], [], ['number'])
+    second = flt.compile_query([['foo', '=', 'foo1']], [], ['number'])
+    assert first is second
+    assert flt.compile_query([['foo', '=', ['foo1']]], [], ['number']) is not first
+
+
+def test__filter_list_cached_query_value_mutated():
+    data = [{'id': i} for i in range(1, 5)]
+    ids = [1, 2]
+    assert [i['id'] for i in filter_list(data, [['id', 'in', ids]])] == [1, 2]
+
+    ids.append(3)
+    assert [i['id'] for i in filter_list(data, [['id', 'in', [1, 2]]])] == [1, 2]
+    assert [i['id'] for i in filter_list(data, [['id', 'in', ids]])] == [1, 2, 3]
+
+
+@pytest.mark.parametrize('data,select,expected', [
+    ({'a': 2, 'c': 5}, ['a', 'c.d'], {'a': 2, 'c': 5}),
+    ({'a': 2, 'c': None}, ['a', 'c.d'], {'a': 2, 'c': None}),
+    ({'a': 2}, ['a', 'c.d'], {'a': 2}),
+    ({'a': 2, 'c': {}}, ['a', 'c.d'], {'a': 2}),
+    ({'a': {'b': 'x'}}, ['a.b.c'], {'a': {'b': 'x'}}),
+    ({'a': {'b': 'x'}}, [['a.b.c', 'renamed']], {'renamed': 'x'}),
+])
+def test__filter_list_select_non_dict_intermediate(data, select, expected):
+    assert filter_list([data], [], {'select': select}) == [expected]
+    assert filters().do_select([data], select) == [expected]
+
+
+def test__filter_list_compiled_query_unhashable():
+    flt = filters()
+    query = flt.compile_query([['foo', '=', {'a': [1]}]], [], [])
+    assert query.key_predicate({'foo': {'a': [1]}})
+
+
+def test__filter_list_generator_limit_is_lazy():
+    consumed = []
+
+    def gen():
+        for entry in DATA:
+            consumed.append(entry)
+            yield entry
+
+    assert filter_list(gen(), [['number', '>', 0]], {'limit': 1}) == [DATA[0]]
+    assert consumed == [DATA[0]]
+
+
+@pytest.mark.parametrize('order_by,options', [
+    (['-number'], {'limit': 2}),
+    (['list.0', '-number'], {'limit': 2, 'offset': 1}),
+    (['nulls_first:-foo'], {'limit': 3}),
+    (['nulls_last:foo', '-number'], {'offset': 2}),
+    (['-number', 'nulls_last:foo'], {'get': True}),
+])
+def test__filter_list_order_by_top_k(order_by, options):
+    # bounded heap selection must agree with the full sort
+    expected = filter_list(DATA_WITH_NULL, [], {'order_by': order_by})
+    if options.get('get'):
+        assert filter_list(DATA_WITH_NULL, [], {'order_by': order_by, **options}) == expected[0]
+        return
+
+    offset = options.get('offset', 0)
+    limit = options.get('limit')
+    expected = expected[offset:offset + limit if limit else None]
+    assert filter_list(iter(DATA_WITH_NULL), [], {'order_by': order_by, **options}) == expected
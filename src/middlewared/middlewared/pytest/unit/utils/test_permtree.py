@@ -0,0 +1,165 @@
+import os
+import resource
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+
+from middlewared.utils.filesystem import acl
+from middlewared.utils.filesystem import permtree as permtree_mod
+from middlewared.utils.filesystem.permtree import permtree, PermTreeAction, PermTreeConfig
+
+POSIX_DEFAULT_ACL = [
+    {'default': True, 'tag': 'USER_OBJ', 'id': -1, 'perms': {'READ': True, 'WRITE': True, 'EXECUTE': True}},
+    {'default': True, 'tag': 'GROUP_OBJ', 'id': -1, 'perms': {'READ': True, 'WRITE': False, 'EXECUTE': True}},
+    {'default': True, 'tag': 'GROUP', 'id': 1000, 'perms': {'READ': True, 'WRITE': False, 'EXECUTE': True}},
+    {'default': True, 'tag': 'OTHER', 'id': -1, 'perms': {'READ': False, 'WRITE': False, 'EXECUTE': False}},
+]
+
+
+@pytest.fixture
+def tree(tmp_path):
+    paths = []
+    for i in range(3):
+        for j in range(3):
+            os.makedirs(tmp_path / f'dir{i}' / f'dir{j}')
+            for k in range(3):
+                (tmp_path / f'dir{i}' / f'dir{j}' / f'file{k}').touch()
+                paths.append(str(tmp_path / f'dir{i}' / f'dir{j}' / f'file{k}'))
+
+            paths.append(str(tmp_path / f'dir{i}' / f'dir{j}'))
+
+        paths.append(str(tmp_path / f'dir{i}'))
+
+    os.symlink('/etc/passwd', tmp_path / 'link')
+    return tmp_path, paths
+
+
+@pytest.fixture
+def nofile_limit():
+    # Few descriptors to spare, like middlewared with the default soft limit of 1024
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (len(os.listdir('/proc/self/fd')) + 256, hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+
+def xattrs_supported(path):
+    try:
+        acl.setacl_posix1e(str(path), POSIX_DEFAULT_ACL)
+    except OSError:
+        return False
+
+    return True
+
+
+@pytest.mark.skipif(os.geteuid() != 0, reason='requires root')
+@pytest.mark.parametrize('threads', [1, 4])
+def test__permtree_chown(tree, threads):
+    root, paths = tree
+    job = Mock()
+
+    stats = permtree(str(root), PermTreeConfig(PermTreeAction.CHOWN, uid=1000, gid=1001, threads=threads, job=job))
+
+    assert (stats.dirs, stats.files) == (12, 27)
+    for path in paths + [str(root)]:
+        st = os.stat(path)
+        assert (st.st_uid, st.st_gid) == (1000, 1001)
+
+    # symlink target is left alone
+    assert os.stat('/etc/passwd').st_uid == 0
+    assert 'Processed 39 files and directories' in job.set_progress.call_args.kwargs['description']
+
+
+def test__permtree_posix_clone_and_strip(tree):
+    root, paths = tree
+    if not xattrs_supported(root):
+        pytest.skip('POSIX ACLs are not supported')
+
+    permtree(str(root), PermTreeConfig(PermTreeAction.CLONE, acltype='POSIX1E'))
+    for path in paths:
+        result = acl.getacl_posix1e(path)
+        entries = {(ace['tag'], ace['id'], ace['default']) for ace in result['acl']}
+        assert ('GROUP', 1000, False) in entries
+        assert (('GROUP', 1000, True) in entries) is os.path.isdir(path)
+
+    permtree(str(root), PermTreeConfig(PermTreeAction.STRIP, acltype='POSIX1E', mode=0o750))
+    for path in paths:
+        assert acl.getacl_posix1e(path)['trivial'] is True
+        assert os.stat(path).st_mode & 0o7777 == 0o750
+
+
+def test__permtree_clone_requires_default_acl(tmp_path):
+    with pytest.raises(ValueError, match='Default ACL entries are required'):
+        permtree(str(tmp_path), PermTreeConfig(PermTreeAction.CLONE, acltype='POSIX1E'))
+
+
+def test__permtree_error_stops_walk(tree):
+    root, paths = tree
+    config = PermTreeConfig(PermTreeAction.STRIP, acltype='POSIX1E', threads=2)
+    with patch.object(permtree_mod._PermTreeWalker, 'apply', Mock(side_effect=PermissionError(1, 'denied'))):
+        with pytest.raises(PermissionError):
+            permtree(str(root), config)
+
+
+def test__permtree_max_queued(tree):
+    root, paths = tree
+    with patch.object(permtree_mod, 'PERMTREE_MAX_QUEUED', 1):
+        stats = permtree(str(root), PermTreeConfig(PermTreeAction.STRIP, acltype='POSIX1E', threads=2))
+
+    assert (stats.dirs, stats.files) == (12, 27)
+
+
+def test__permtree_wide_tree_nofile_limit(tmp_path, nofile_limit):
+    for i in range(3000):
+        for j in range(3):
+            os.makedirs(tmp_path / f'dir{i}' / f'dir{j}')
+
+    stats = permtree(str(tmp_path), PermTreeConfig(PermTreeAction.STRIP, acltype='POSIX1E', threads=8))
+
+    assert (stats.dirs, stats.files) == (12000, 0)
+
+
+def test__permtree_max_ops(tree):
+    root, paths = tree
+    started = time.monotonic()
+    permtree(str(root), PermTreeConfig(PermTreeAction.STRIP, acltype='POSIX1E', max_ops=100))
+    assert time.monotonic() - started >= 0.35
+
+
+def test__nfs4acl_inherit():
+    aces = [acl.nfs4ace_from_dict(entry) for entry in [
+        {'tag': 'owner@', 'perms': {'BASIC': 'FULL_CONTROL'}, 'flags': {'BASIC': 'INHERIT'}},
+        {'tag': 'USER', 'id': 1000, 'perms': {'BASIC': 'READ'}, 'flags': {'FILE_INHERIT': True}},
+        {'tag': 'GROUP', 'id': 1000, 'perms': {'BASIC': 'READ'}, 'flags': {
+            'DIRECTORY_INHERIT': True, 'NO_PROPAGATE_INHERIT': True,
+        }},
+        {'tag': 'everyone@', 'perms': {'BASIC': 'READ'}, 'flags': {'BASIC': 'NOINHERIT'}},
+    ]]
+    inherited = acl.NFS4ACEFlag.INHERITED
+    group = acl.NFS4ACEFlag.IDENTIFIER_GROUP
+    fi, di, io = acl.NFS4ACEFlag.FILE_INHERIT, acl.NFS4ACEFlag.DIRECTORY_INHERIT, acl.NFS4ACEFlag.INHERIT_ONLY
+
+    assert [(ace[1], ace[4]) for ace in acl.nfs4acl_inherit(aces, False)] == [
+        (inherited, acl.NFS4Who.OWNER), (inherited, 1000),
+    ]
+    dir_aces = acl.nfs4acl_inherit(aces, True)
+    assert [(ace[1], ace[4]) for ace in dir_aces] == [
+        (fi | di | inherited, acl.NFS4Who.OWNER), (fi | io | inherited, 1000), (group | inherited, 1000),
+    ]
+    assert acl.nfs4acl_inherit(dir_aces, True) == dir_aces[:2]
+    assert acl.nfs4acl_inherit(dir_aces, False) == acl.nfs4acl_inherit(aces, False)
+
+
+@pytest.mark.parametrize('mode,is_dir,expected', [
+    (0o755, True, [None, 'READ', 'READ']),
+    (0o644, False, [None, None, None]),
+])
+def test__nfs4acl_trivial(mode, is_dir, expected):
+    result = [acl.nfs4ace_to_dict(ace) for ace in acl.nfs4acl_trivial(mode, is_dir)]
+    assert [ace['tag'] for ace in result] == ['owner@', 'group@', 'everyone@']
+    assert [ace['perms'].get('BASIC') for ace in result] == expected
+    if not is_dir:
+        assert result[0]['perms']['WRITE_DATA'] and not result[1]['perms']['WRITE_DATA']
@@ -0,0 +1,75 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from middlewared.utils.process_pool import ProcessPool
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def fail():
+    raise ValueError('fail')
+
+
+@pytest.fixture
+def pool():
+    pool = ProcessPool(None, max_workers=4, warm_workers=2)
+    pool.start()
+    try:
+        yield pool
+    finally:
+        pool.executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test__process_pool_concurrency_limit(pool):
+    start = time.monotonic()
+    await asyncio.gather(*[pool.run('test.limited', 1, sleep, 0.2) for i in range(3)])
+    assert time.monotonic() - start >= 0.6
+
+    stats = pool.stats()['services']['test.limited']
+    assert stats['calls'] == 3
+    assert stats['in_flight'] == 0
+    assert stats['concurrency'] == 1
+    assert stats['exec_time_total'] >= 0.6
+    # Every call but the first one had to wait for the previous ones
+    assert stats['queue_wait_max'] >= 0.4
+
+
+@pytest.mark.asyncio
+async def test__process_pool_unlimited(pool):
+    pids = await asyncio.gather(*[pool.run('test.unlimited', None, sleep, 0.5) for i in range(4)])
+    assert len(set(pids)) == 4
+    assert pool.stats()['workers'] == 4
+
+
+@pytest.mark.asyncio
+async def test__process_pool_errors(pool):
+    with pytest.raises(ValueError):
+        await pool.run('test.fail', None, fail)
+
+    assert pool.stats()['services']['test.fail']['errors'] == 1
+
+
+def test__process_pool_warm(pool):
+    # Warm workers are started without running any calls
+    assert pool.stats()['workers'] == 2
+    assert pool.stats()['pending'] == 0
+
+
+@pytest.mark.asyncio
+async def test__process_pool_warm_workers_keep_task_budget():
+    pool = ProcessPool(None, max_workers=1, warm_workers=1, max_tasks_per_child=2)
+    pool.start()
+    try:
+        pids = [await pool.run('test.recycle', None, sleep, 0) for i in range(3)]
+    finally:
+        pool.executor.shutdown()
+
+    # Warm worker serves `max_tasks_per_child` calls before it is recycled
+    assert pids[0] == pids[1] != pids[2]
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import socket
+import threading
+from unittest.mock import Mock
+
+import pytest
+
+from middlewared.utils import syslog
+from middlewared.utils.syslog import SyslogSender
+
+
+class SyslogServer:
+    def __init__(self, path):
+        self.path = path
+        self.messages = []
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(path)
+        self.socket.settimeout(0.05)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.receive, daemon=True)
+        self.thread.start()
+
+    def receive(self):
+        while not self.stopped.is_set():
+            try:
+                self.messages.append(self.socket.recv(65536))
+            except socket.timeout:
+                pass
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.socket.close()
+        os.unlink(self.path)
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = SyslogServer(str(tmp_path / 'log'))
+    yield server
+    if not server.stopped.is_set():
+        server.stop()
+
+
+def test__send_batches_over_single_connection(server):
+    async def run():
+        sender = SyslogSender(server.path, Mock())
+        for i in range(250):
+            await sender.send(f'message {i}'.encode())
+
+        await sender.flush()
+        return sender
+
+    sender = asyncio.run(run())
+    server.stop()
+
+    assert server.messages == [f'message {i}'.encode() for i in range(250)]
+    stats = sender.stats()
+    assert stats['sent'] == 250
+    assert stats['queued'] == 0
+    assert stats['dropped'] == 0
+    assert stats['healthy']
+
+
+def test__send_reconnects(server):
+    async def run():
+        sender = SyslogSender(server.path, Mock())
+        await sender.send(b'first')
+        await sender.flush()
+
+        # syslog daemon restart
+        server.stop()
+        await sender.send(b'lost')
+        await sender.flush()
+        assert not sender.stats()['healthy']
+
+        new_server = SyslogServer(server.path)
+        await sender.send(b'second')
+        await sender.flush()
+        new_server.stop()
+        return sender, new_server
+
+    sender, new_server = asyncio.run(run())
+
+    assert server.messages == [b'first']
+    assert new_server.messages == [b'second']
+    stats = sender.stats()
+    assert (stats['sent'], stats['dropped'], stats['errors']) == (2, 1, 1)
+    assert stats['healthy']
+
+
+def test__send_drops_when_full(server, monkeypatch):
+    monkeypatch.setattr(syslog, 'SYSLOG_QUEUE_TIMEOUT', 0.01)
+
+    async def run():
+        sender = SyslogSender(server.path, Mock(), queue_size=2)
+        # Sender task does not get to run until we yield
+        sender.task = asyncio.get_running_loop().create_future()
+        for i in range(3):
+            await sender.send(b'message')
+
+        return sender
+
+    stats = asyncio.run(run()).stats()
+    assert stats['queued'] == 2
+    assert stats['dropped'] == 1
+
+
+def test__send_survives_unexpected_error(server, monkeypatch):
+    connect = syslog.create_connected_unix_datagram_socket
+    failures = [RuntimeError('unexpected')]
+
+    async def flaky_connect(path):
+        if failures:
+            raise failures.pop()
+
+        return await connect(path)
+
+    monkeypatch.setattr(syslog, 'create_connected_unix_datagram_socket', flaky_connect)
+
+    async def run():
+        sender = SyslogSender(server.path, Mock())
+        await sender.send(b'lost')
+        await asyncio.wait_for(sender.flush(), 5)
+        await sender.send(b'sent')
+        await asyncio.wait_for(sender.flush(), 5)
+        return sender
+
+    sender = asyncio.run(run())
+    server.stop()
+
+    assert server.messages == [b'sent']
+    stats = sender.stats()
+    assert (stats['sent'], stats['dropped'], stats['errors']) == (1, 1, 1)
+    assert stats['healthy']
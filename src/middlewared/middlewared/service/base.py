@@ -22,6 +22,7 @@ def service_config(klass, config):
         'private': False,
         'thread_pool': None,
         'process_pool': None,
+        'process_pool_concurrency': None,
         'cli_namespace': None,
         'cli_private': False,
         'cli_description': None,
@@ -64,6 +65,7 @@ class ServiceBase(type):
       - verbose_name: human-friendly singular name for the service
       - thread_pool: thread pool to use for threaded methods
       - process_pool: process pool to run service methods
+      - process_pool_concurrency: maximum number of methods of the service running in the process pool at once
       - cli_namespace: replace namespace identifier for CLI
       - cli_private: if the service is not private, this flags whether or not the service is visible in the CLI
     """
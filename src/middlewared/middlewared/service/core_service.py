@@ -735,6 +735,13 @@ class CoreService(Service):
     def threads_stacks(self):
         return get_threads_stacks()
 
+    @private
+    def process_pool_stats(self):
+        """
+        Process pool size and per-service call counts, queue wait and execution times (in seconds).
+        """
+        return self.middleware.process_pool_stats()
+
     @private
     def get_pid(self):
         return os.getpid()
@@ -1,6 +1,8 @@
 import asyncio
+import copy
 import errno
 import functools
+import heapq
 import logging
 import operator
 import re
@@ -10,6 +12,7 @@ import json
 from collections import namedtuple
 from dataclasses import dataclass
 from datetime import datetime
+from itertools import chain, islice
 
 from middlewared.service_exception import MatchNotFound
 from .lang import undefined
@@ -53,6 +56,9 @@ class UnexpectedFailure(Exception):
 
 
 FilterGetResult = namedtuple('FilterGetResult', 'result,key,done', defaults=(None, True))
+CompiledQuery = namedtuple('CompiledQuery', 'key_predicate,attr_predicate,select,order_by')
+OrderPlan = namedtuple('OrderPlan', 'key,reverse')
+COMPILED_QUERY_CACHE_SIZE = 512
 
 
 def bisect(condition, iterable):
@@ -139,6 +145,20 @@ def get_impl(obj, path):
     return FilterGetResult(cur)
 
 
+def split_path(path):
+    """
+    Split a dot-notation path (as understood by `get_impl`) into a tuple of its
+    components so that it does not need to be re-parsed for every object.
+    """
+    parts = []
+    right = path
+    while right:
+        left, right = partition(right)
+        parts.append(left)
+
+    return tuple(parts)
+
+
 def get_attr(obj, path):
     """
     Simple wrapper around getattr to ensure that internal filtering methods return consistent
@@ -192,6 +212,67 @@ def casefold(obj):
     raise ValueError(f'{type(obj)}: support for casefolding object type not implemented.')
 
 
+def freeze(obj):
+    """
+    Convert a (validated) query specification into a hashable object suitable
+    for use as a cache key. Types are preserved so that e.g. `1` and `True` or
+    a list and a tuple do not share a cache entry.
+    """
+    if isinstance(obj, (list, tuple)):
+        return obj.__class__, tuple(freeze(i) for i in obj)
+
+    if isinstance(obj, dict):
+        return dict, tuple((k, freeze(v)) for k, v in obj.items())
+
+    if isinstance(obj, (set, frozenset)):
+        return obj.__class__, frozenset(freeze(i) for i in obj)
+
+    hash(obj)
+    return obj.__class__, obj
+
+
+class FrozenQuerySpec:
+    """
+    Wrapper that allows the original (mutable) query specification to be passed
+    through `functools.lru_cache` while hashing and comparing on its frozen form.
+    """
+    __slots__ = ('spec', 'key')
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.key = freeze(spec)
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self, other):
+        return isinstance(other, FrozenQuerySpec) and self.key == other.key
+
+
+class OrderKey:
+    """
+    Composite sort key for `order_by` specifications that mix ascending and
+    descending components.
+    """
+    __slots__ = ('values', 'reverse')
+
+    def __init__(self, values, reverse):
+        self.values = values
+        self.reverse = reverse
+
+    def __eq__(self, other):
+        return self.values == other.values
+
+    def __lt__(self, other):
+        for a, b, reverse in zip(self.values, other.values, self.reverse):
+            if a == b:
+                continue
+
+            return b < a if reverse else a < b
+
+        return False
+
+
 class filters(object):
     def op_in(x, y):
         return operator.contains(y, x)
@@ -376,202 +457,350 @@ class filters(object):
 
         return (options, select, order_by)
 
-    def filterop(self, i, f, source_getter):
-        name, op, value = f
-        data = source_getter(i, name)
-        if data.result is undefined:
-            # Key / attribute doesn't exist in value
-            return False
+    def do_select(self, _list, select):
+        rv = []
+        for i in _list:
+            entry = {}
+            for s in select:
+                if isinstance(s, list):
+                    target, new_name = s
+                else:
+                    target = s
+                    new_name = None
 
-        if not data.done:
-            new_filter = [data.key, op, value]
-            for entry in data.result:
-                if self.filterop(entry, new_filter, source_getter):
-                    return True
+                keys, value = select_path(i, target)
+                if value is MatchNotFound:
+                    continue
 
-            return False
+                if new_name is not None:
+                    entry[new_name] = value
+                    continue
+
+                last = keys.pop(-1)
+                obj = entry
+                for k in keys:
+                    obj = obj.setdefault(k, {})
+
+                obj[last] = value
+
+            rv.append(entry)
+
+        return rv
+
+    def compile_condition(self, the_filter, value_maps, use_attrs):
+        """
+        Compile a single `[<name>, <opcode>, <value>]` condition into a predicate.
+
+        The operator lookup, casefolding of the value and the parsing of the
+        dot-notation path happen once here rather than once per list item.
+        """
+        name, op, value = the_filter
+        if value_maps and isinstance(value, str):
+            value = value_maps.get(value, value)
 
-        source = data.result
         if op[0] == 'C':
             fn = self.opmap[op[1:]]
-            source = casefold(source)
             value = casefold(value)
+            fold = casefold
         else:
             fn = self.opmap[op]
+            fold = None
 
-        if fn(source, value):
-            return True
+        def evaluate(source):
+            if source is undefined:
+                # Key / attribute doesn't exist in value
+                return False
 
-        return False
+            if fold is not None:
+                source = fold(source)
 
-    def getter_fn(self, entry):
-        """
-        Evaluate the type of objects returned by iterable and return an
-        appropriate function to retrieve attributes so that we can apply filters
+            return bool(fn(source, value))
 
-        This allows us to filter objects that are not dictionaries.
-        """
-        if not entry:
-            return None
+        if use_attrs:
+            def by_attr(item):
+                return evaluate(getattr(item, name))
 
-        if isinstance(entry, dict):
-            return get_impl
+            return by_attr
 
-        return get_attr
+        def by_key(item, parts=split_path(name)):
+            cur = item
+            for idx, left in enumerate(parts):
+                if isinstance(cur, dict):
+                    cur = cur.get(left, undefined)
+                elif isinstance(cur, (list, tuple)):
+                    if not left.isdigit():
+                        # check all members against the remaining portion of path
+                        if left == '*':
+                            remaining = parts[idx + 1:]
+                            return any(by_key(entry, remaining) for entry in cur)
 
-    def eval_filter(self, list_item, the_filter, getter, value_maps):
-        """
-        `the_filter` in this case will be a single condition of either the form
-        [<a>, <opcode>, <b>] or ["OR", [<condition>, <condition>, ...]
+                        raise ValueError(f'{left}: must be array index or wildcard character')
 
-        This allows us to do a simple check of list length to determine whether
-        we have a conjunction or disjunction.
+                    left = int(left)
+                    cur = cur[left] if left < len(cur) else None
 
-        value_maps is dict supplied in which to store operands that need to
-        be converted into a different type.
+            return evaluate(cur)
 
-        Recursion depth is checked when validate_filters is called above.
-        """
-        if len(the_filter) == 2:
-            # OR check
-            op, value = the_filter
-            for branch in value:
-                if isinstance(branch[0], list):
-                    # This branch of OR is a conjunction of
-                    # multiple conditions. All of them must be
-                    # True in order for branch to be True.
-                    hit = True
-                    for i in branch:
-                        if not self.eval_filter(list_item, i, getter, value_maps):
-                            hit = False
-                            break
-                else:
-                    hit = self.eval_filter(list_item, branch, getter, value_maps)
+        if len(parts := split_path(name)) != 1:
+            return by_key
 
-                if hit is True:
-                    return True
+        key = parts[0]
 
-            # None of conditions in disjunction are True.
-            return False
+        def by_top_level_key(item):
+            if isinstance(item, dict):
+                return evaluate(item.get(key, undefined))
 
-        # Normal condition check
-        if not value_maps:
-            return self.filterop(list_item, the_filter, getter)
+            return by_key(item)
 
-        if (operand_1 := value_maps.get(the_filter[0])):
-            operand_2.rstrip(TIMESTAMP_DESIGNATOR)
-        else:
-            operand_1 = the_filter[0]
+        return by_top_level_key
 
-        if (operand_2 := value_maps.get(the_filter[2])):
-            operand_1.rstrip(TIMESTAMP_DESIGNATOR)
-        else:
-            operand_2 = the_filter[2]
+    def compile_conjunction(self, filters, value_maps, use_attrs):
+        predicates = tuple(self.compile_filter(f, value_maps, use_attrs) for f in filters)
+        if len(predicates) == 1:
+            return predicates[0]
 
-        return self.filterop(list_item, (operand_1, the_filter[1], operand_2), getter)
+        def conjunction(item):
+            for predicate in predicates:
+                if not predicate(item):
+                    return False
 
-    def do_filters(self, _list, filters, select, shortcircuit, value_maps):
-        rv = []
+            return True
 
-        # we may be filtering output from a generator and so delay
-        # evaluation of what "getter" to use until we begin iteration
-        getter = None
+        return conjunction
 
-        for i in _list:
-            if getter is None:
-                getter = self.getter_fn(i)
-            valid = True
-            for f in filters:
-                if not self.eval_filter(i, f, getter, value_maps):
-                    valid = False
-                    break
+    def compile_filter(self, the_filter, value_maps, use_attrs):
+        """
+        Returns a callable that takes a single list item and returns whether it
+        matches `the_filter` (either a single condition or an `OR` disjunction).
+        """
+        if len(the_filter) == 2:
+            branches = tuple(
+                self.compile_conjunction(branch, value_maps, use_attrs)
+                if isinstance(branch[0], list) else
+                self.compile_filter(branch, value_maps, use_attrs)
+                for branch in the_filter[1]
+            )
 
-            if not valid:
-                continue
+            def disjunction(item):
+                for branch in branches:
+                    if branch(item):
+                        return True
 
-            if select:
-                entry = self.do_select([i], select)[0]
-            else:
-                entry = i
+                # None of conditions in disjunction are True.
+                return False
 
-            rv.append(entry)
-            if shortcircuit:
-                break
+            return disjunction
 
-        return rv
+        return self.compile_condition(the_filter, value_maps, use_attrs)
 
-    def do_select(self, _list, select):
-        rv = []
-        for i in _list:
-            entry = {}
-            for s in select:
-                if isinstance(s, list):
-                    target, new_name = s
-                else:
-                    target = s
-                    new_name = None
+    def compile_select(self, select):
+        """
+        Compiled counterpart of `do_select`. Returns a callable that takes a single
+        list item and returns the selected entry.
+        """
+        plan = []
+        for s in select:
+            if isinstance(s, list):
+                target, new_name = s
+            else:
+                target = s
+                new_name = None
 
-                keys, value = select_path(i, target)
-                if value is MatchNotFound:
+            plan.append((split_path(target), new_name))
+
+        def select_entry(item):
+            entry = {}
+            for parts, new_name in plan:
+                # Same traversal as `select_path`: the value is placed under the last key that was actually looked
+                # up in a dictionary, so a non-dictionary intermediate value is selected as a whole.
+                keys = []
+                cur = item
+                for left in parts:
+                    if isinstance(cur, dict):
+                        cur = cur.get(left, MatchNotFound)
+                        keys.append(left)
+                    elif isinstance(cur, (list, tuple)):
+                        raise ValueError('Selecting by list index is not supported')
+
+                if cur is MatchNotFound:
                     continue
 
                 if new_name is not None:
-                    entry[new_name] = value
+                    entry[new_name] = cur
                     continue
 
-                last = keys.pop(-1)
                 obj = entry
-                for k in keys:
+                for k in keys[:-1]:
                     obj = obj.setdefault(k, {})
 
-                obj[last] = value
+                obj[keys[-1]] = cur
 
-            rv.append(entry)
+            return entry
 
-        return rv
+        return select_entry
 
-    def do_count(self, rv):
-        return len(rv)
+    def compile_order_key(self, order):
+        """
+        Compiled counterpart of `get(x, order)` as used for sorting.
+        """
+        parts = split_path(order)
+
+        def key(item):
+            cur = item
+            for left in parts:
+                if isinstance(cur, dict):
+                    cur = cur.get(left, undefined)
+                elif isinstance(cur, (list, tuple)):
+                    if not left.isdigit():
+                        if left == '*':
+                            break
 
-    def order_nulls(self, _list, order):
-        if order.startswith(REVERSE_CHAR):
-            order = order[1:]
-            reverse = True
-        else:
-            reverse = False
+                        raise ValueError(f'{left}: must be array index or wildcard character')
+
+                    left = int(left)
+                    cur = cur[left] if left < len(cur) else None
+
+            return cur if cur is not undefined else None
+
+        return key
+
+    def compile_order_component(self, nulls, field, reverse):
+        key = self.compile_order_key(field)
+        if nulls is None:
+            return key
+
+        # Entries where `field` is null are kept together (in their original
+        # relative order) ahead of or behind the sorted non-null entries. The
+        # rank is flipped for descending components so that reversing the
+        # sort does not move the nulls.
+        null_rank = 0 if (nulls == NULLS_FIRST) != reverse else 1
+        null_value = (null_rank, None)
+        non_null_rank = 1 - null_rank
+
+        def null_aware_key(entry):
+            if entry.get(field) is None:
+                return null_value
+
+            return (non_null_rank, key(entry))
+
+        return null_aware_key
+
+    def compile_order_by(self, order_by):
+        """
+        Compile `order_by` into a single composite sort key.
 
-        nulls = []
-        non_nulls = []
-        for entry in _list:
-            if entry.get(order) is None:
-                nulls.append(entry)
+        `order_by` semantics are those of one stable sort per entry, which means
+        that the last entry is the primary sort key. A single stable sort on a key
+        whose components are in reverse `order_by` order yields the same result, so
+        that is what we build here. Returns an `OrderPlan` or None if `order_by` is empty.
+        """
+        if not order_by:
+            return None
+
+        keys = []
+        directions = []
+        for o in reversed(order_by):
+            nulls = None
+            for prefix in (NULLS_FIRST, NULLS_LAST):
+                if o.startswith(prefix):
+                    nulls = prefix
+                    o = o[len(prefix):]
+                    break
+
+            if o.startswith(REVERSE_CHAR):
+                o = o[1:]
+                reverse = True
             else:
-                non_nulls.append(entry)
+                reverse = False
+
+            keys.append(self.compile_order_component(nulls, o, reverse))
+            directions.append(reverse)
+
+        keys = tuple(keys)
+        directions = tuple(directions)
+        if len(set(directions)) > 1:
+            def mixed_key(entry):
+                return OrderKey(tuple(key(entry) for key in keys), directions)
+
+            return OrderPlan(mixed_key, False)
+
+        if len(keys) == 1:
+            return OrderPlan(keys[0], directions[0])
+
+        def composite_key(entry):
+            return tuple(key(entry) for key in keys)
+
+        return OrderPlan(composite_key, directions[0])
+
+    def compile_query_impl(self, filters, select, order_by):
+        key_predicate = attr_predicate = None
+        if filters:
+            maps = {}
+            self.validate_filters(filters, value_maps=maps)
+            key_predicate = self.compile_conjunction(filters, maps, False)
+            attr_predicate = self.compile_conjunction(filters, maps, True)
+
+        return CompiledQuery(
+            key_predicate=key_predicate,
+            attr_predicate=attr_predicate,
+            select=self.compile_select(select) if select else None,
+            order_by=self.compile_order_by(order_by),
+        )
+
+    def compile_query(self, filters, select, order_by):
+        """
+        Validate and compile `filters`, `select` and `order_by` into a
+        `CompiledQuery`. Compiled queries are cached on the frozen form of the
+        specification so that repeated identical queries skip both validation
+        and compilation.
+        """
+        try:
+            frozen = (FrozenQuerySpec(filters or []), FrozenQuerySpec(select), FrozenQuerySpec(order_by))
+        except TypeError:
+            # unhashable filter value, compile without caching
+            return self.compile_query_impl(filters, select, order_by)
+
+        return compile_query_cached(*frozen)
+
+    def iter_filtered(self, _list, query):
+        """
+        Lazily apply compiled filters and select to `_list`, which may be a generator.
+        """
+        select = query.select
+        if query.key_predicate is None:
+            return map(select, _list) if select else iter(_list)
 
-        non_nulls = sorted(non_nulls, key=lambda x: get(x, order), reverse=reverse)
-        return (nulls, non_nulls)
+        return self._iter_filtered(_list, query.key_predicate, query.attr_predicate, select)
 
-    def order_no_null(self, _list, order):
-        if order.startswith(REVERSE_CHAR):
-            order = order[1:]
-            reverse = True
+    def _iter_filtered(self, _list, key_predicate, attr_predicate, select):
+        # we may be filtering output from a generator and so delay
+        # evaluation of what predicate to use until we begin iteration
+        _list = iter(_list)
+        for i in _list:
+            predicate = key_predicate if isinstance(i, dict) else attr_predicate
+            break
         else:
-            reverse = False
-
-        return sorted(_list, key=lambda x: get(x, order), reverse=reverse)
-
-    def do_order(self, rv, order_by):
-        for o in order_by:
-            if o.startswith(NULLS_FIRST):
-                nulls, non_nulls = self.order_nulls(rv, o[len(NULLS_FIRST):])
-                rv = nulls + non_nulls
-            elif o.startswith(NULLS_LAST):
-                nulls, non_nulls = self.order_nulls(rv, o[len(NULLS_LAST):])
-                rv = non_nulls + nulls
-            else:
-                rv = self.order_no_null(rv, o)
+            return
 
-        return rv
+        for i in chain((i,), _list):
+            if predicate(i):
+                yield select(i) if select else i
+
+    def do_order_compiled(self, rv, order_plan, top=None):
+        """
+        Order `rv` according to compiled `order_plan`. If `top` is specified then
+        only that many leading entries are returned, which is done with a bounded
+        heap rather than a full sort so that time is O(n log top) and memory is
+        O(top).
+        """
+        if top is not None:
+            select = heapq.nlargest if order_plan.reverse else heapq.nsmallest
+            return select(top, rv, key=order_plan.key)
+
+        return sorted(rv, key=order_plan.key, reverse=order_plan.reverse)
+
+    def do_count(self, rv):
+        return len(rv)
 
     def do_get(self, rv):
         try:
@@ -581,41 +810,45 @@ class filters(object):
 
     def filter_list(self, _list, filters=None, options=None):
         options, select, order_by = self.validate_options(options)
+        query = self.compile_query(filters, select, order_by)
 
-        do_shortcircuit = options.get('get') and not order_by
+        # `_list` is consumed lazily (it may be a generator) so that only the
+        # entries needed to satisfy `get` / `offset` / `limit` are held in memory.
+        rv = self.iter_filtered(_list, query)
 
-        if filters:
-            maps = {}
-            self.validate_filters(filters, value_maps=maps)
-            rv = self.do_filters(_list, filters, select, do_shortcircuit, value_maps=maps)
-            if do_shortcircuit:
-                return self.do_get(rv)
+        if options.get('count') is True:
+            return sum(1 for i in rv)
 
-        elif select:
-            rv = self.do_select(_list, select)
-        else:
-            # Normalize the output to a list. Caller may have passed
-            # a generator into this method.
-            rv = list(_list)
+        if options.get('get') is True:
+            if query.order_by:
+                rv = self.do_order_compiled(rv, query.order_by, 1)
 
-        if options.get('count') is True:
-            return self.do_count(rv)
+            return self.do_get(list(islice(rv, 1)))
 
-        rv = self.do_order(rv, order_by)
+        offset = options.get('offset') or 0
+        limit = options.get('limit') or None
+        if query.order_by:
+            rv = self.do_order_compiled(rv, query.order_by, offset + limit if limit else None)
 
-        if options.get('get') is True:
-            return self.do_get(rv)
+        if offset or limit:
+            return list(islice(rv, offset, offset + limit if limit else None))
 
-        if options.get('offset'):
-            rv = rv[options['offset']:]
+        # Normalize the output to a list. Caller may have passed
+        # a generator into this method.
+        return rv if isinstance(rv, list) else list(rv)
 
-        if options.get('limit'):
-            return rv[:options['limit']]
 
-        return rv
+filters_obj = filters()
+filter_list = filters_obj.filter_list
 
 
-filter_list = filters().filter_list
+@functools.lru_cache(maxsize=COMPILED_QUERY_CACHE_SIZE)
+def compile_query_cached(frozen_filters, frozen_select, frozen_order_by):
+    # Compiled predicates keep references to filter values. Compile from a private copy so that the cached
+    # query is not affected when the caller later mutates its specification.
+    return filters_obj.compile_query_impl(*copy.deepcopy(
+        (frozen_filters.spec, frozen_select.spec, frozen_order_by.spec)
+    ))
 
 
 def filter_getattrs(filters):
@@ -1,4 +1,18 @@
+# Read and write NFSv4 and POSIX1E ACLs through their extended attributes
+#
+# ZFS exposes NFSv4 ACLs as the `system.nfs4_acl_xdr` xattr and the kernel exposes
+# POSIX1E ACLs as `system.posix_acl_access` / `system.posix_acl_default` xattrs.
+# Encoding and decoding them in-process avoids forking nfs4xdr_getfacl / getfacl
+# (and their setfacl counterparts) for every path.
+#
+# NOTE: tests for parsers are in src/middlewared/middlewared/pytest/unit/utils/test_filesystem_misc.py
+# Additional testing for ZFS is covered in tests/api2
+
 import enum
+import errno
+import os
+import stat as pystat
+import struct
 
 
 class ACLXattr(enum.Enum):
@@ -21,3 +35,519 @@ def acl_is_present(xat_list: list) -> bool:
     authoritative.
     """
     return bool(set(xat_list) & ACL_XATTRS)
+
+
+class NFS4ACLFlag(enum.IntFlag):
+    """
+    ACL-wide flags (`na41_flag`). IS_TRIVIAL and IS_DIR are set by ZFS
+    when reading the ACL and ignored when writing it.
+    """
+    AUTO_INHERIT = 0x00000001
+    PROTECTED = 0x00000002
+    DEFAULTED = 0x00000004
+    IS_TRIVIAL = 0x00010000
+    IS_DIR = 0x00020000
+
+
+class NFS4ACEType(enum.IntEnum):
+    ALLOW = 0
+    DENY = 1
+    AUDIT = 2
+    ALARM = 3
+
+
+class NFS4ACEFlag(enum.IntFlag):
+    FILE_INHERIT = 0x00000001
+    DIRECTORY_INHERIT = 0x00000002
+    NO_PROPAGATE_INHERIT = 0x00000004
+    INHERIT_ONLY = 0x00000008
+    SUCCESSFUL_ACCESS = 0x00000010
+    FAILED_ACCESS = 0x00000020
+    IDENTIFIER_GROUP = 0x00000040
+    INHERITED = 0x00000080
+
+
+class NFS4ACEMask(enum.IntFlag):
+    READ_DATA = 0x00000001
+    WRITE_DATA = 0x00000002
+    APPEND_DATA = 0x00000004
+    READ_NAMED_ATTRS = 0x00000008
+    WRITE_NAMED_ATTRS = 0x00000010
+    EXECUTE = 0x00000020
+    DELETE_CHILD = 0x00000040
+    READ_ATTRIBUTES = 0x00000080
+    WRITE_ATTRIBUTES = 0x00000100
+    DELETE = 0x00010000
+    READ_ACL = 0x00020000
+    WRITE_ACL = 0x00040000
+    WRITE_OWNER = 0x00080000
+    SYNCHRONIZE = 0x00100000
+
+
+class NFS4Who(enum.IntEnum):
+    """ `who` of ACEs that have NFS4_ACEI_SPECIAL_WHO set in `iflag` """
+    OWNER = 1
+    GROUP = 2
+    EVERYONE = 3
+
+
+NFS4_ACEI_SPECIAL_WHO = 0x00000001
+NFS4_SPECIAL_TAGS = {NFS4Who.OWNER: 'owner@', NFS4Who.GROUP: 'group@', NFS4Who.EVERYONE: 'everyone@'}
+NFS4_SPECIAL_WHO = {tag: who for who, tag in NFS4_SPECIAL_TAGS.items()}
+
+# Flags that are displayed by `nfs4xdr_getfacl`, IDENTIFIER_GROUP is expressed through the tag
+NFS4_ACE_FLAGS = [flag for flag in NFS4ACEFlag if flag != NFS4ACEFlag.IDENTIFIER_GROUP]
+
+NFS4_BASIC_PERMS = {
+    'FULL_CONTROL': NFS4ACEMask(sum(NFS4ACEMask)),
+    'MODIFY': NFS4ACEMask(sum(NFS4ACEMask)) & ~(NFS4ACEMask.WRITE_ACL | NFS4ACEMask.WRITE_OWNER),
+    'READ': (
+        NFS4ACEMask.READ_DATA | NFS4ACEMask.READ_NAMED_ATTRS | NFS4ACEMask.EXECUTE |
+        NFS4ACEMask.READ_ATTRIBUTES | NFS4ACEMask.READ_ACL | NFS4ACEMask.SYNCHRONIZE
+    ),
+    'TRAVERSE': (
+        NFS4ACEMask.READ_NAMED_ATTRS | NFS4ACEMask.EXECUTE | NFS4ACEMask.READ_ATTRIBUTES |
+        NFS4ACEMask.READ_ACL | NFS4ACEMask.SYNCHRONIZE
+    ),
+}
+NFS4_BASIC_FLAGS = {
+    'INHERIT': NFS4ACEFlag.FILE_INHERIT | NFS4ACEFlag.DIRECTORY_INHERIT,
+    'NOINHERIT': NFS4ACEFlag(0),
+}
+
+# XDR encoding of `nfsacl41i`: acl flags, number of ACEs followed by ACEs of
+# five unsigned integers each (type, flag, iflag, access_mask, who)
+NFS4_XDR_HEADER = struct.Struct('>II')
+NFS4_XDR_ACE = struct.Struct('>IIIII')
+NFS4_MAX_ACES = 2048
+
+
+def nfs4acl_xdr_decode(buf: bytes) -> tuple:
+    """
+    Returns `(aclflags, aces)` where `aces` is a list of
+    `(type, flag, iflag, access_mask, who)` tuples
+    """
+    if len(buf) < NFS4_XDR_HEADER.size or (len(buf) - NFS4_XDR_HEADER.size) % NFS4_XDR_ACE.size:
+        raise ValueError(f'{len(buf)}: invalid NFSv4 ACL XDR size')
+
+    aclflags, count = NFS4_XDR_HEADER.unpack_from(buf)
+    if count != (len(buf) - NFS4_XDR_HEADER.size) // NFS4_XDR_ACE.size:
+        raise ValueError(f'{count}: ACE count does not match NFSv4 ACL XDR size')
+
+    return aclflags, list(NFS4_XDR_ACE.iter_unpack(memoryview(buf)[NFS4_XDR_HEADER.size:]))
+
+
+def nfs4acl_xdr_encode(aclflags: int, aces: list) -> bytes:
+    if len(aces) > NFS4_MAX_ACES:
+        raise ValueError(f'{len(aces)}: ACL exceeds maximum of {NFS4_MAX_ACES} entries')
+
+    buf = bytearray(NFS4_XDR_HEADER.size + len(aces) * NFS4_XDR_ACE.size)
+    NFS4_XDR_HEADER.pack_into(buf, 0, aclflags, len(aces))
+    for idx, ace in enumerate(aces):
+        NFS4_XDR_ACE.pack_into(buf, NFS4_XDR_HEADER.size + idx * NFS4_XDR_ACE.size, *ace)
+
+    return bytes(buf)
+
+
+def nfs4ace_to_dict(ace: tuple, simplified: bool = True) -> dict:
+    """
+    Convert decoded ACE into the format used by `nfs4xdr_getfacl -j` and `filesystem.getacl`
+    """
+    ace_type, flag, iflag, access_mask, who = ace
+    if iflag & NFS4_ACEI_SPECIAL_WHO:
+        tag = NFS4_SPECIAL_TAGS[NFS4Who(who)]
+        id_ = -1
+    else:
+        tag = 'GROUP' if flag & NFS4ACEFlag.IDENTIFIER_GROUP else 'USER'
+        id_ = who
+
+    perms = None
+    flags = None
+    if simplified:
+        perms = next(({'BASIC': k} for k, v in NFS4_BASIC_PERMS.items() if v == access_mask), None)
+        flags = next((
+            {'BASIC': k} for k, v in NFS4_BASIC_FLAGS.items() if v == flag & ~NFS4ACEFlag.IDENTIFIER_GROUP
+        ), None)
+
+    return {
+        'tag': tag,
+        'id': id_,
+        'type': NFS4ACEType(ace_type).name,
+        'perms': perms or {perm.name: bool(access_mask & perm) for perm in NFS4ACEMask},
+        'flags': flags or {f.name: bool(flag & f) for f in NFS4_ACE_FLAGS},
+    }
+
+
+def nfs4ace_from_dict(entry: dict) -> tuple:
+    """
+    Convert ACL entry in `filesystem.setacl` format (with optional BASIC perms and flags) into
+    `(type, flag, iflag, access_mask, who)` tuple. Raises ValueError if entry is invalid.
+    """
+    if (basic := entry['perms'].get('BASIC')) is not None:
+        if (access_mask := NFS4_BASIC_PERMS.get(basic)) is None:
+            raise ValueError(f'{basic}: invalid basic permission')
+    else:
+        access_mask = NFS4ACEMask(0)
+        for key, value in entry['perms'].items():
+            if value:
+                try:
+                    access_mask |= NFS4ACEMask[key]
+                except KeyError:
+                    raise ValueError(f'{key}: invalid permission') from None
+
+    if (basic := entry['flags'].get('BASIC')) is not None:
+        if (flag := NFS4_BASIC_FLAGS.get(basic)) is None:
+            raise ValueError(f'{basic}: invalid basic flag')
+    else:
+        flag = NFS4ACEFlag(0)
+        for key, value in entry['flags'].items():
+            if value:
+                try:
+                    flag |= NFS4ACEFlag[key]
+                except KeyError:
+                    raise ValueError(f'{key}: invalid flag') from None
+
+    flag &= ~NFS4ACEFlag.IDENTIFIER_GROUP
+    if (special := NFS4_SPECIAL_WHO.get(entry['tag'])) is not None:
+        iflag, who = NFS4_ACEI_SPECIAL_WHO, special
+    elif entry['tag'] in ('USER', 'GROUP'):
+        if entry.get('id') is None or entry['id'] < 0:
+            raise ValueError(f'{entry["tag"]}: ACL entry has invalid id for tag type')
+
+        iflag, who = 0, entry['id']
+        if entry['tag'] == 'GROUP':
+            flag |= NFS4ACEFlag.IDENTIFIER_GROUP
+    else:
+        raise ValueError(f'{entry["tag"]}: invalid tag')
+
+    try:
+        ace_type = NFS4ACEType[entry.get('type', 'ALLOW')]
+    except KeyError:
+        raise ValueError(f'{entry["type"]}: invalid ACE type') from None
+
+    return int(ace_type), int(flag), iflag, int(access_mask), who
+
+
+def nfs4acl_to_dict(aclflags: int, aces: list, simplified: bool = True) -> dict:
+    return {
+        'acl': [nfs4ace_to_dict(ace, simplified) for ace in aces],
+        'nfs41_flags': {
+            'autoinherit': bool(aclflags & NFS4ACLFlag.AUTO_INHERIT),
+            'protected': bool(aclflags & NFS4ACLFlag.PROTECTED),
+            'defaulted': bool(aclflags & NFS4ACLFlag.DEFAULTED),
+        },
+        'trivial': bool(aclflags & NFS4ACLFlag.IS_TRIVIAL),
+    }
+
+
+def nfs4acl_flags_from_dict(nfs41_flags: dict) -> int:
+    return (
+        (NFS4ACLFlag.AUTO_INHERIT if nfs41_flags.get('autoinherit') else 0) |
+        (NFS4ACLFlag.PROTECTED if nfs41_flags.get('protected') else 0) |
+        (NFS4ACLFlag.DEFAULTED if nfs41_flags.get('defaulted') else 0)
+    )
+
+
+def _stat_dict(st) -> dict:
+    return {
+        'uid': st.st_uid,
+        'gid': st.st_gid,
+        'flags': {
+            'setuid': bool(st.st_mode & pystat.S_ISUID),
+            'setgid': bool(st.st_mode & pystat.S_ISGID),
+            'sticky': bool(st.st_mode & pystat.S_ISVTX),
+        },
+    }
+
+
+def getacl_nfs4(path: str, simplified: bool = True) -> dict:
+    """
+    Read NFSv4 ACL of `path`. Output matches `nfs4xdr_getfacl -j` (plus `path`).
+    """
+    aclflags, aces = nfs4acl_xdr_decode(os.getxattr(path, ACLXattr.ZFS_NATIVE.value))
+    return _stat_dict(os.stat(path)) | nfs4acl_to_dict(aclflags, aces, simplified) | {'path': path}
+
+
+def setacl_nfs4(path: str, acl: list, nfs41_flags: dict | None = None) -> None:
+    """
+    Replace NFSv4 ACL of `path` with `acl` (list of entries in `filesystem.setacl` format).
+    Raises ValueError if ACL is invalid.
+    """
+    aces = []
+    for idx, entry in enumerate(acl):
+        try:
+            aces.append(nfs4ace_from_dict(entry))
+        except ValueError as e:
+            raise ValueError(f'{idx}: {e}') from None
+
+    os.setxattr(path, ACLXattr.ZFS_NATIVE.value, nfs4acl_xdr_encode(nfs4acl_flags_from_dict(nfs41_flags or {}), aces))
+
+
+NFS4_INHERIT_FLAGS = (
+    NFS4ACEFlag.FILE_INHERIT | NFS4ACEFlag.DIRECTORY_INHERIT |
+    NFS4ACEFlag.NO_PROPAGATE_INHERIT | NFS4ACEFlag.INHERIT_ONLY
+)
+# Permissions that are granted to owner@, group@ and everyone@ regardless of the mode in trivial ACL
+NFS4_TRIVIAL_EVERYONE_MASK = (
+    NFS4ACEMask.READ_ACL | NFS4ACEMask.READ_ATTRIBUTES | NFS4ACEMask.READ_NAMED_ATTRS | NFS4ACEMask.SYNCHRONIZE
+)
+NFS4_TRIVIAL_OWNER_MASK = (
+    NFS4ACEMask.WRITE_ACL | NFS4ACEMask.WRITE_OWNER | NFS4ACEMask.WRITE_ATTRIBUTES | NFS4ACEMask.WRITE_NAMED_ATTRS
+)
+
+
+def nfs4acl_inherit(aces: list, is_dir: bool) -> list:
+    """
+    ACEs that a new file (or directory if `is_dir` is set) inherits from a directory with `aces`
+    """
+    out = []
+    for ace_type, flag, iflag, access_mask, who in aces:
+        if is_dir and flag & NFS4ACEFlag.DIRECTORY_INHERIT:
+            if flag & NFS4ACEFlag.NO_PROPAGATE_INHERIT:
+                flag &= ~NFS4_INHERIT_FLAGS
+            else:
+                flag &= ~NFS4ACEFlag.INHERIT_ONLY
+        elif is_dir and flag & NFS4ACEFlag.FILE_INHERIT and not flag & NFS4ACEFlag.NO_PROPAGATE_INHERIT:
+            # Does not apply to the directory itself but must be passed on to files created in it
+            flag |= NFS4ACEFlag.INHERIT_ONLY
+        elif not is_dir and flag & NFS4ACEFlag.FILE_INHERIT:
+            flag &= ~NFS4_INHERIT_FLAGS
+        else:
+            continue
+
+        out.append((ace_type, int(flag | NFS4ACEFlag.INHERITED), iflag, access_mask, who))
+
+    return out
+
+
+def nfs4acl_trivial(mode: int, is_dir: bool) -> list:
+    """
+    ACEs of the trivial ACL (an ACL that can be expressed as file mode) equivalent to `mode`
+    """
+    def mode_to_mask(bits):
+        access_mask = NFS4_TRIVIAL_EVERYONE_MASK
+        if bits & 0o4:
+            access_mask |= NFS4ACEMask.READ_DATA
+        if bits & 0o2:
+            access_mask |= NFS4ACEMask.WRITE_DATA | NFS4ACEMask.APPEND_DATA
+            if is_dir:
+                access_mask |= NFS4ACEMask.DELETE_CHILD
+        if bits & 0o1:
+            access_mask |= NFS4ACEMask.EXECUTE
+
+        return access_mask
+
+    return [
+        (NFS4ACEType.ALLOW, 0, NFS4_ACEI_SPECIAL_WHO, int(mode_to_mask(mode >> 6) | NFS4_TRIVIAL_OWNER_MASK),
+         NFS4Who.OWNER),
+        (NFS4ACEType.ALLOW, 0, NFS4_ACEI_SPECIAL_WHO, int(mode_to_mask(mode >> 3)), NFS4Who.GROUP),
+        (NFS4ACEType.ALLOW, 0, NFS4_ACEI_SPECIAL_WHO, int(mode_to_mask(mode)), NFS4Who.EVERYONE),
+    ]
+
+
+class POSIXACLTag(enum.IntEnum):
+    USER_OBJ = 0x01
+    USER = 0x02
+    GROUP_OBJ = 0x04
+    GROUP = 0x08
+    MASK = 0x10
+    OTHER = 0x20
+
+
+class POSIXACLPerm(enum.IntFlag):
+    EXECUTE = 0x01
+    WRITE = 0x02
+    READ = 0x04
+
+
+# Linux `posix_acl_xattr_header` and `posix_acl_xattr_entry`
+POSIX_ACL_XATTR_VERSION = 0x0002
+POSIX_XATTR_HEADER = struct.Struct('<I')
+POSIX_XATTR_ENTRY = struct.Struct('<HHI')
+POSIX_ACL_UNDEFINED_ID = 0xFFFFFFFF
+# Entries that every access ACL must contain
+POSIX_REQUIRED_TAGS = (POSIXACLTag.USER_OBJ, POSIXACLTag.GROUP_OBJ, POSIXACLTag.OTHER)
+
+
+def posixacl_xattr_decode(buf: bytes) -> list:
+    """
+    Returns list of `(tag, perm, id)` tuples
+    """
+    if len(buf) < POSIX_XATTR_HEADER.size or (len(buf) - POSIX_XATTR_HEADER.size) % POSIX_XATTR_ENTRY.size:
+        raise ValueError(f'{len(buf)}: invalid POSIX1E ACL xattr size')
+
+    if (version := POSIX_XATTR_HEADER.unpack_from(buf)[0]) != POSIX_ACL_XATTR_VERSION:
+        raise ValueError(f'{version}: unsupported POSIX1E ACL xattr version')
+
+    return list(POSIX_XATTR_ENTRY.iter_unpack(memoryview(buf)[POSIX_XATTR_HEADER.size:]))
+
+
+def posixacl_xattr_encode(entries: list) -> bytes:
+    """
+    Encode `(tag, perm, id)` tuples. Entries are sorted in the order required by the kernel.
+    """
+    entries = sorted(entries, key=lambda entry: (entry[0], entry[2]))
+    buf = bytearray(POSIX_XATTR_HEADER.size + len(entries) * POSIX_XATTR_ENTRY.size)
+    POSIX_XATTR_HEADER.pack_into(buf, 0, POSIX_ACL_XATTR_VERSION)
+    for idx, entry in enumerate(entries):
+        POSIX_XATTR_ENTRY.pack_into(buf, POSIX_XATTR_HEADER.size + idx * POSIX_XATTR_ENTRY.size, *entry)
+
+    return bytes(buf)
+
+
+def posixacl_from_mode(mode: int) -> list:
+    """
+    Minimal ACL equivalent to permission bits of `mode`
+    """
+    return [
+        (POSIXACLTag.USER_OBJ, (mode >> 6) & 0o7, POSIX_ACL_UNDEFINED_ID),
+        (POSIXACLTag.GROUP_OBJ, (mode >> 3) & 0o7, POSIX_ACL_UNDEFINED_ID),
+        (POSIXACLTag.OTHER, mode & 0o7, POSIX_ACL_UNDEFINED_ID),
+    ]
+
+
+def posixace_to_dict(entry: tuple, default: bool) -> dict:
+    tag, perm, id_ = entry
+    return {
+        'default': default,
+        'tag': POSIXACLTag(tag).name,
+        'id': -1 if id_ == POSIX_ACL_UNDEFINED_ID else id_,
+        'perms': {p.name: bool(perm & p) for p in (POSIXACLPerm.READ, POSIXACLPerm.WRITE, POSIXACLPerm.EXECUTE)},
+    }
+
+
+def posixace_from_dict(entry: dict) -> tuple:
+    try:
+        tag = POSIXACLTag[entry['tag']]
+    except KeyError:
+        raise ValueError(f'{entry["tag"]}: invalid tag') from None
+
+    if tag in (POSIXACLTag.USER, POSIXACLTag.GROUP):
+        if entry.get('id') is None or entry['id'] < 0:
+            raise ValueError(f'{entry["tag"]}: ACL entry has invalid id for tag type')
+
+        id_ = entry['id']
+    else:
+        id_ = POSIX_ACL_UNDEFINED_ID
+
+    perm = POSIXACLPerm(0)
+    for key, value in entry['perms'].items():
+        if value:
+            try:
+                perm |= POSIXACLPerm[key]
+            except KeyError:
+                raise ValueError(f'{key}: invalid permission') from None
+
+    return int(tag), int(perm), id_
+
+
+def _posixacl_complete(entries: list, base: list) -> list:
+    """
+    Fill in required entries missing in `entries` from `base` ACL and calculate
+    MASK if named entries are present, similar to `setfacl -m`.
+    """
+    tags = {entry[0] for entry in entries}
+    entries = entries + [entry for entry in base if entry[0] not in tags and entry[0] in POSIX_REQUIRED_TAGS]
+    if POSIXACLTag.MASK not in tags and any(entry[0] in (POSIXACLTag.USER, POSIXACLTag.GROUP) for entry in entries):
+        mask = 0
+        for entry in entries:
+            if entry[0] in (POSIXACLTag.USER, POSIXACLTag.GROUP, POSIXACLTag.GROUP_OBJ):
+                mask |= entry[1]
+
+        entries.append((int(POSIXACLTag.MASK), mask, POSIX_ACL_UNDEFINED_ID))
+
+    return entries
+
+
+def _getxattr_or_none(path, name):
+    try:
+        return os.getxattr(path, name)
+    except OSError as e:
+        if e.errno != errno.ENODATA:
+            raise
+
+        return None
+
+
+def getacl_posix1e(path: str) -> dict:
+    """
+    Read POSIX1E ACL of `path`. Output matches `filesystem.getacl` for POSIX1E ACLs.
+    """
+    st = os.stat(path)
+    if (buf := _getxattr_or_none(path, ACLXattr.POSIX_ACCESS.value)) is not None:
+        access = posixacl_xattr_decode(buf)
+    else:
+        access = posixacl_from_mode(st.st_mode)
+
+    default = []
+    if pystat.S_ISDIR(st.st_mode) and (buf := _getxattr_or_none(path, ACLXattr.POSIX_DEFAULT.value)) is not None:
+        default = posixacl_xattr_decode(buf)
+
+    acl = [posixace_to_dict(entry, False) for entry in access] + [posixace_to_dict(entry, True) for entry in default]
+    return _stat_dict(st) | {
+        'acl': acl,
+        'acltype': 'POSIX1E',
+        'trivial': len(acl) == 3,
+        'path': path,
+    }
+
+
+def setacl_posix1e(path: str, acl: list) -> None:
+    """
+    Replace POSIX1E ACL of `path` with `acl` (list of entries in `filesystem.setacl` format).
+    Required entries that are missing are taken from the file mode (access ACL) or the access ACL
+    (default ACL). Raises ValueError if ACL is invalid.
+    """
+    access = []
+    default = []
+    for idx, entry in enumerate(acl):
+        try:
+            (default if entry.get('default') else access).append(posixace_from_dict(entry))
+        except ValueError as e:
+            raise ValueError(f'{idx}: {e}') from None
+
+    st = os.stat(path)
+    access = _posixacl_complete(access, posixacl_from_mode(st.st_mode))
+    if default:
+        if not pystat.S_ISDIR(st.st_mode):
+            raise ValueError('Default ACL entries may only be set on directories')
+
+        default = _posixacl_complete(default, access)
+
+    os.setxattr(path, ACLXattr.POSIX_ACCESS.value, posixacl_xattr_encode(access))
+    if default:
+        os.setxattr(path, ACLXattr.POSIX_DEFAULT.value, posixacl_xattr_encode(default))
+    elif pystat.S_ISDIR(st.st_mode):
+        try:
+            os.removexattr(path, ACLXattr.POSIX_DEFAULT.value)
+        except OSError as e:
+            if e.errno != errno.ENODATA:
+                raise
+
+
+def getacl_many(paths, getacl=getacl_nfs4, **kwargs):
+    """
+    Read ACLs of multiple paths using `getacl` (`getacl_nfs4` or `getacl_posix1e`).
+    Yields `(path, acl)` tuples, `acl` is the OSError / ValueError raised for the path
+    if reading its ACL failed.
+    """
+    for path in paths:
+        try:
+            yield path, getacl(path, **kwargs)
+        except (OSError, ValueError) as e:
+            yield path, e
+
+
+def setacl_many(paths, acl, setacl=setacl_nfs4, **kwargs):
+    """
+    Set the same ACL on multiple paths using `setacl` (`setacl_nfs4` or `setacl_posix1e`).
+    Returns dictionary of paths that failed mapped to the raised exception.
+    """
+    errors = {}
+    for path in paths:
+        try:
+            setacl(path, acl, **kwargs)
+        except (OSError, ValueError) as e:
+            errors[path] = e
+
+    return errors
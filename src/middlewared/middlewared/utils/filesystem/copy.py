@@ -3,7 +3,9 @@
 
 import enum
 import os
+import threading
 
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from errno import EXDEV
 from middlewared.job import Job
@@ -44,10 +46,21 @@ from .directory import (
     DirectoryRequestMask,
 )
 from .stat_x import StatxEtype
-from .utils import path_in_ctldir, timespec_convert_int
+from .utils import open_fd_budget, path_in_ctldir, timespec_convert_int
 
 CLONETREE_ROOT_DEPTH = 0
 MAX_RW_SZ = 2147483647 & ~4096  # maximum size of read/write in kernel
+# Number of threads for copytree() callers that want a parallel copy
+DEF_CP_THREADS = min(os.cpu_count() or 1, 8)
+# Once this many tasks are queued, the thread that found the entry copies it itself
+MAX_CP_QUEUED = 1024
+# Directories being copied in parallel hold two open file descriptors each until everything inside
+# them was copied. At most 1/CP_FD_SHARE of the RLIMIT_NOFILE soft limit is spent on them, directories
+# found beyond that are copied depth-first by the thread that found them (as the serial copy does).
+CP_FD_SHARE = 8
+# Files of a directory are copied by a single task until it contains this many files or bytes
+CP_BATCH_FILES = 64
+CP_BATCH_BYTES = 16 * 1024 * 1024
 
 
 class CopyFlags(enum.IntFlag):
@@ -97,6 +110,9 @@ class CopyTreeConfig:
     op: copy tree operation that will be performed (see CopyTreeOp class)
 
     flags: bitmask of metadata to preserve as part of copy
+
+    threads: number of threads copying files and directories concurrently. The default
+        of 1 copies the tree depth-first in the calling thread.
     """
     job: Job | None = None
     job_msg_prefix: str = ''
@@ -106,6 +122,7 @@ class CopyTreeConfig:
     traverse: bool = False
     op: CopyTreeOp = CopyTreeOp.DEFAULT
     flags: CopyFlags = DEF_CP_FLAGS  # flags specifying which metadata to copy
+    threads: int = 1
 
 
 @dataclass(slots=True)
@@ -402,6 +419,53 @@ def _do_mkdir(
     return new_dir_hdl
 
 
+def _copytree_conf_to_copy_fn(config: CopyTreeConfig) -> callable:
+    """ internal method to convert CopyTreeConfig to the function used to copy file data """
+    match config.op:
+        case CopyTreeOp.DEFAULT:
+            return clone_or_copy_file
+        case CopyTreeOp.CLONE:
+            return clone_file
+        case CopyTreeOp.SENDFILE:
+            return copy_sendfile
+        case CopyTreeOp.USERSPACE:
+            return copy_file_userspace
+        case _:
+            raise ValueError(f'{config.op}: unexpected copy operation')
+
+
+def _copytree_skip_dir(
+    entry: dirent_struct,
+    entry_path: str,
+    d_iter: DirectoryIterator,
+    config: CopyTreeConfig,
+    target_st: stat_result
+) -> bool:
+    """ internal method to determine whether directory `entry` must not be copied """
+    if not config.traverse:
+        if entry.stat.stx_mnt_id != d_iter.stat.stx_mnt_id:
+            # traversal is disabled and entry is in different filesystem
+            # returning True here prevents entering the directory / filesystem
+            return True
+
+    if entry.name == '.zfs':
+        # User may have visible snapdir. We definitely don't want to try to copy this
+        # path_in_ctldir checks inode number to verify it's not reserved number for
+        # these special paths (definitive indication it's ctldir as opposed to random
+        # dir user named '.zfs')
+        if path_in_ctldir(entry_path):
+            return True
+
+    if entry.stat.stx_ino == target_st.st_ino:
+        # We use makedev / dev_t in this case to catch potential edge cases where bind mount
+        # in path (since bind mounts of same filesystem will have same st_dev, but different
+        # stx_mnt_id.
+        if makedev(entry.stat.stx_dev_major, entry.stat.stx_dev_minor) == target_st.st_dev:
+            return True
+
+    return False
+
+
 def _copytree_impl(
     d_iter: DirectoryIterator,
     dst_str: str,
@@ -435,17 +499,7 @@ def _copytree_impl(
         PermissionError
     """
 
-    match config.op:
-        case CopyTreeOp.DEFAULT:
-            c_fn = clone_or_copy_file
-        case CopyTreeOp.CLONE:
-            c_fn = clone_file
-        case CopyTreeOp.SENDFILE:
-            c_fn = copy_sendfile
-        case CopyTreeOp.USERSPACE:
-            c_fn = copy_file_userspace
-        case _:
-            raise ValueError(f'{config.op}: unexpected copy operation')
+    c_fn = _copytree_conf_to_copy_fn(config)
 
     for entry in d_iter:
         # We match on `etype` key because our statx wrapper will initially lstat a file
@@ -453,26 +507,8 @@ def _copytree_impl(
         # This means that S_ISLNK on mode will fail to detect whether it's a symlink.
         match entry.etype:
             case StatxEtype.DIRECTORY.name:
-                if not config.traverse:
-                    if entry.stat.stx_mnt_id != d_iter.stat.stx_mnt_id:
-                        # traversal is disabled and entry is in different filesystem
-                        # continue here prevents entering the directory / filesystem
-                        continue
-
-                if entry.name == '.zfs':
-                    # User may have visible snapdir. We definitely don't want to try to copy this
-                    # path_in_ctldir checks inode number to verify it's not reserved number for
-                    # these special paths (definitive indication it's ctldir as opposed to random
-                    # dir user named '.zfs')
-                    if path_in_ctldir(entry.path):
-                        continue
-
-                if entry.stat.stx_ino == target_st.st_ino:
-                    # We use makedev / dev_t in this case to catch potential edge cases where bind mount
-                    # in path (since bind mounts of same filesystem will have same st_dev, but different
-                    # stx_mnt_id.
-                    if makedev(entry.stat.stx_dev_major, entry.stat.stx_dev_minor) == target_st.st_dev:
-                        continue
+                if _copytree_skip_dir(entry, entry.path, d_iter, config, target_st):
+                    continue
 
                 # This can fail with OSError and errno set to ELOOP if target was maliciously
                 # replaced with symlink between our first stat and the open call
@@ -557,6 +593,257 @@ def _copytree_impl(
             ))
 
 
+class _CopyTreeDir:
+    """ Directory being copied by _ParallelCopyTree. Its timestamps are set and its handles
+    are closed once the directory and everything in it have been copied. """
+    __slots__ = ('parent', 'entry', 'src_str', 'dst_str', 'src_fd', 'dst_fd', 'pending', 'inline')
+
+    def __init__(self, parent, entry, src_str, dst_str, src_fd, dst_fd, inline):
+        self.parent = parent
+        self.entry = entry  # None for the root directory (its handles are owned by copytree)
+        self.src_str = src_str
+        self.dst_str = dst_str
+        self.src_fd = src_fd
+        self.dst_fd = dst_fd
+        self.pending = 1  # walk of the directory itself
+        # Directory and everything in it is copied by the thread that found it. Otherwise the
+        # directory holds one of `_ParallelCopyTree.dir_slots` until it is done.
+        self.inline = inline
+
+
+class _ParallelCopyTree:
+    """ Implementation of copytree() for `config.threads` > 1
+
+    Every directory and file found while walking a directory is copied by a task in a
+    thread pool. Destination directories (with their metadata) are always created before
+    anything is copied into them.
+
+    The number of directories handed out to the thread pool is limited by `dir_slots` so
+    that their open handles stay well below RLIMIT_NOFILE. When no slot is available, the
+    directory is copied depth-first in the current thread.
+    """
+
+    def __init__(self, config: CopyTreeConfig, request_mask: int, target_st: stat_result, stats: CopyTreeStats):
+        self.config = config
+        self.request_mask = request_mask
+        self.target_st = target_st
+        self.stats = stats
+        self.c_fn = _copytree_conf_to_copy_fn(config)
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.error = None
+        self.done = threading.Event()
+        self.dir_slots = threading.BoundedSemaphore(max(1, min(MAX_CP_QUEUED, open_fd_budget(CP_FD_SHARE) // 2)))
+        self.executor = ThreadPoolExecutor(config.threads, 'CopyTree')
+
+    def run(self, d_iter: DirectoryIterator, src_str: str, dst_str: str, dst_fd: int) -> None:
+        root = _CopyTreeDir(None, None, src_str, dst_str, d_iter.dir_fd, dst_fd, False)
+        try:
+            self._walk(d_iter, root)
+        except Exception as e:
+            self._set_error(e)
+        finally:
+            self._release(root)
+
+        self.done.wait()
+        self.executor.shutdown(wait=True)
+        if self.error is not None:
+            raise self.error
+
+    def _set_error(self, error: Exception) -> None:
+        with self.lock:
+            if self.error is None:
+                self.error = error
+
+    def _submit(self, fn: callable, *args) -> None:
+        with self.lock:
+            queue = self.queued < MAX_CP_QUEUED
+            if queue:
+                self.queued += 1
+
+        if queue:
+            self.executor.submit(self._run, fn, *args)
+        else:
+            fn(*args)
+
+    def _run(self, fn: callable, *args) -> None:
+        with self.lock:
+            self.queued -= 1
+
+        fn(*args)
+
+    def _processed(self, count: int, entry_path: str, dst_path: str) -> None:
+        """ Must be called with `lock` held after `count` entries were added to `stats` """
+        done = self.stats.dirs + self.stats.files
+        if self.config.job and (done // self.config.job_msg_inc) != ((done - count) // self.config.job_msg_inc):
+            self.config.job.set_progress(100, (
+                f'{self.config.job_msg_prefix}'
+                f'Copied {entry_path} -> {dst_path} ({self.stats.dirs} directories, {self.stats.files} files, '
+                f'{self.stats.bytes} bytes so far).'
+            ))
+
+    def _release(self, node: _CopyTreeDir) -> None:
+        with self.lock:
+            node.pending -= 1
+            if node.pending:
+                return
+
+        if node.entry is None:
+            self.done.set()
+            return
+
+        try:
+            if self.error is None and self.config.flags.value & CopyFlags.TIMESTAMPS.value:
+                ns_ts = (
+                    timespec_convert_int(node.entry.stat.stx_atime),
+                    timespec_convert_int(node.entry.stat.stx_mtime)
+                )
+                try:
+                    utime(node.dst_fd, ns=ns_ts)
+                except Exception:
+                    if self.config.raise_error:
+                        raise
+        except Exception as e:
+            self._set_error(e)
+        finally:
+            close(node.dst_fd)
+            close(node.src_fd)
+            if not node.inline:
+                self.dir_slots.release()
+
+        with self.lock:
+            self.stats.dirs += 1
+            self._processed(1, node.src_str, node.dst_str)
+
+        self._release(node.parent)
+
+    def _copy_dir(self, node: _CopyTreeDir) -> None:
+        try:
+            if self.error is None:
+                with DirectoryIterator(
+                    '.',
+                    request_mask=self.request_mask,
+                    dir_fd=node.src_fd,
+                    as_dict=False
+                ) as d_iter:
+                    self._walk(d_iter, node)
+        except Exception as e:
+            self._set_error(e)
+        finally:
+            self._release(node)
+
+    def _copy_files(self, node: _CopyTreeDir, entries: list[dirent_struct]) -> None:
+        batch_stats = CopyTreeStats()
+        try:
+            for entry in entries:
+                if self.error is not None:
+                    break
+
+                entry_fd = posix_open(entry.name, O_RDONLY | O_NOFOLLOW, dir_fd=node.src_fd)
+                try:
+                    flags = O_RDWR | O_NOFOLLOW | O_CREAT | O_TRUNC
+                    if not self.config.exist_ok:
+                        flags |= O_EXCL
+
+                    dst = posix_open(entry.name, flags, dir_fd=node.dst_fd)
+                    try:
+                        _do_mkfile(entry, entry_fd, dst, self.config, batch_stats, self.c_fn)
+                    finally:
+                        close(dst)
+                finally:
+                    close(entry_fd)
+
+                batch_stats.files += 1
+        except Exception as e:
+            self._set_error(e)
+        finally:
+            with self.lock:
+                self.stats.files += batch_stats.files
+                self.stats.bytes += batch_stats.bytes
+                if batch_stats.files:
+                    entry = entries[batch_stats.files - 1]
+                    self._processed(
+                        batch_stats.files, path.join(node.src_str, entry.name), path.join(node.dst_str, entry.name)
+                    )
+
+            self._release(node)
+
+    def _submit_files(self, node: _CopyTreeDir, entries: list[dirent_struct]) -> None:
+        with self.lock:
+            node.pending += 1
+
+        if node.inline:
+            self._copy_files(node, entries)
+        else:
+            self._submit(self._copy_files, node, entries)
+
+    def _walk(self, d_iter: DirectoryIterator, node: _CopyTreeDir) -> None:
+        # Files are copied in batches by other threads through handles of `node` that stay open
+        # until everything in the directory was copied
+        batch = []
+        batch_bytes = 0
+        for entry in d_iter:
+            if self.error is not None:
+                break
+
+            # We match on `etype` key because our statx wrapper will initially lstat a file
+            # and if it's a symlink, perform a stat call to get information from symlink target
+            match entry.etype:
+                case StatxEtype.DIRECTORY.name:
+                    entry_path = path.join(node.src_str, entry.name)
+                    if _copytree_skip_dir(entry, entry_path, d_iter, self.config, self.target_st):
+                        continue
+
+                    inline = node.inline or not self.dir_slots.acquire(blocking=False)
+                    try:
+                        # This can fail with OSError and errno set to ELOOP if target was maliciously
+                        # replaced with symlink between our first stat and the open call
+                        entry_fd = posix_open(entry.name, O_DIRECTORY | O_NOFOLLOW, dir_fd=d_iter.dir_fd)
+                        try:
+                            new_dst_fd = _do_mkdir(entry, entry_fd, node.dst_fd, self.config)
+                        except Exception:
+                            close(entry_fd)
+                            raise
+                    except Exception:
+                        if not inline:
+                            self.dir_slots.release()
+
+                        raise
+
+                    with self.lock:
+                        node.pending += 1
+
+                    child = _CopyTreeDir(
+                        node, entry, entry_path, path.join(node.dst_str, entry.name), entry_fd, new_dst_fd, inline
+                    )
+                    if inline:
+                        self._copy_dir(child)
+                    else:
+                        self._submit(self._copy_dir, child)
+
+                case StatxEtype.FILE.name:
+                    batch.append(entry)
+                    batch_bytes += entry.stat.stx_size
+                    if len(batch) >= CP_BATCH_FILES or batch_bytes >= CP_BATCH_BYTES:
+                        self._submit_files(node, batch)
+                        batch = []
+                        batch_bytes = 0
+
+                case StatxEtype.SYMLINK.name:
+                    dst = readlink(entry.name, dir_fd=d_iter.dir_fd)
+                    try:
+                        symlink(dst, entry.name, dir_fd=node.dst_fd)
+                    except FileExistsError:
+                        if not self.config.exist_ok:
+                            raise
+
+                    with self.lock:
+                        self.stats.symlinks += 1
+
+        if batch:
+            self._submit_files(node, batch)
+
+
 def copytree(
     src: str,
     dst: str,
@@ -604,7 +891,10 @@ def copytree(
 
     try:
         with DirectoryIterator(src, request_mask=int(dir_request_mask), as_dict=False) as d_iter:
-            _copytree_impl(d_iter, dst, dst_fd, CLONETREE_ROOT_DEPTH, config, fstat(dst_fd), stats)
+            if config.threads > 1:
+                _ParallelCopyTree(config, int(dir_request_mask), fstat(dst_fd), stats).run(d_iter, src, dst, dst_fd)
+            else:
+                _copytree_impl(d_iter, dst, dst_fd, CLONETREE_ROOT_DEPTH, config, fstat(dst_fd), stats)
 
             # Ensure that root level directory also gets metadata copied
             try:
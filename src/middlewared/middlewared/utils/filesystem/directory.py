@@ -4,13 +4,20 @@
 # provides statx output and other optional file information in the
 # returned dictionaries.
 #
+# When an `offset` is passed to DirectoryIterator the directory is read
+# with getdents64(2) instead of os.scandir so that iteration can be
+# resumed later from the offset of the last returned entry (this is
+# what filesystem.listdir_page cursors are built on).
+#
 # NOTE: tests for these utils are in src/middlewared/middlewared/pytest/unit/utils/test_directory.py
 
 
+import ctypes
 import enum
 import errno
 import os
 import pathlib
+import struct
 
 from collections import namedtuple
 from .acl import acl_is_present
@@ -59,6 +66,55 @@ dirent_struct = namedtuple('struct_dirent', [
     'name', 'path', 'realpath', 'stat', 'etype', 'acl', 'xattrs', 'zfs_attrs', 'is_in_ctldir'
 ])
 
+getdents_entry = namedtuple('getdents_entry', ['name', 'offset'])
+
+# struct linux_dirent64: d_ino, d_off, d_reclen, d_type followed by NUL-terminated d_name
+LINUX_DIRENT64 = struct.Struct('=QqHB')
+GETDENTS_BUFSIZE = 65536
+
+
+def __get_getdents_fn():
+    libc = ctypes.CDLL('libc.so.6', use_errno=True)
+    func = libc.getdents64
+    func.argtypes = (ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t)
+    func.restype = ctypes.c_ssize_t
+    return func
+
+
+__getdents_fn = __get_getdents_fn()
+
+
+def getdents(dir_fd, offset=0):
+    """
+    Generator of `getdents_entry` for directory open as `dir_fd` starting at
+    `offset`. `offset` of every entry is the position of the next one, i.e. passing it
+    back resumes iteration right after that entry. The `.` and `..` entries are skipped.
+
+    NOTE: this changes the file offset of `dir_fd`.
+    """
+    buf = ctypes.create_string_buffer(GETDENTS_BUFSIZE)
+    os.lseek(dir_fd, offset, os.SEEK_SET)
+    while True:
+        nread = __getdents_fn(dir_fd, buf, GETDENTS_BUFSIZE)
+        if nread < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        if nread == 0:
+            return
+
+        data = buf.raw[:nread]
+        pos = 0
+        while pos < nread:
+            d_ino, d_off, d_reclen, d_type = LINUX_DIRENT64.unpack_from(data, pos)
+            name_start = pos + LINUX_DIRENT64.size
+            name = data[name_start:data.index(b'\0', name_start)]
+            pos += d_reclen
+            if name in (b'.', b'..'):
+                continue
+
+            yield getdents_entry(os.fsdecode(name), d_off)
+
 
 class DirectoryFd():
     """
@@ -108,6 +164,10 @@ class DirectoryIterator():
     `as_dict` - yield entries in dictionary expected by `filesystem.listdir`.
     When set to False, then struct_direct (see above) is returned. Default is True
 
+    `offset` - read the directory with getdents64(2) starting at this offset
+    (0 is the beginning of the directory) rather than with os.scandir. The
+    `offset` property may then be used to resume iteration in a new iterator.
+
     Context manager protocol is supported and preferred for most cases as it
     will more aggressively free resources.
 
@@ -124,14 +184,19 @@ class DirectoryIterator():
        entries.
     """
 
-    def __init__(self, path, file_type=None, request_mask=None, dir_fd=None, as_dict=True):
+    def __init__(self, path, file_type=None, request_mask=None, dir_fd=None, as_dict=True, offset=None):
         self.__dir_fd = None
         self.__path_iter = None
         self.__path = path
+        self.__offset = offset
 
         self.__dir_fd = DirectoryFd(path, dir_fd)
         self.__file_type = FileType(file_type).name if file_type else None
-        self.__path_iter = os.scandir(self.__dir_fd.fileno)
+        if offset is None:
+            self.__path_iter = os.scandir(self.__dir_fd.fileno)
+        else:
+            self.__path_iter = getdents(self.__dir_fd.fileno, offset)
+
         self.__stat = statx('', dir_fd=self.__dir_fd.fileno, flags=ATFlags.EMPTY_PATH.value)
 
         # Explicitly allow zero for request_mask
@@ -160,6 +225,13 @@ class DirectoryIterator():
         # we can more aggressively close resources
         self.close(force=True)
 
+    def __next_dirent(self):
+        dirent = next(self.__path_iter)
+        if self.__offset is not None:
+            self.__offset = dirent.offset
+
+        return dirent
+
     def __check_dir_entry(self, dirent):
         stat_info = statx_entry_impl(pathlib.Path(dirent.name), dir_fd=self.dir_fd)
         if stat_info is None:
@@ -212,10 +284,10 @@ class DirectoryIterator():
         }
 
     def __next__(self):
-        # dirent here is os.DirEntry yielded from os.scandir()
-        dirent = next(self.__path_iter)
+        # dirent here is os.DirEntry yielded from os.scandir() or getdents_entry
+        dirent = self.__next_dirent()
         while (st := self.__check_dir_entry(dirent)) is None:
-            dirent = next(self.__path_iter)
+            dirent = self.__next_dirent()
 
         if self.__request_mask == 0:
             # Skip an unnecessary file open/close if we only need stat info
@@ -293,6 +365,14 @@ class DirectoryIterator():
     def stat(self) -> StructStatx:
         return self.__stat
 
+    @property
+    def offset(self) -> int | None:
+        """
+        getdents offset following the last entry read from the directory
+        (None if iterator was created without `offset`).
+        """
+        return self.__offset
+
     def close(self, force=False) -> None:
         try:
             if self.__path_iter is not None:
@@ -0,0 +1,337 @@
+# Recursively change ownership and permissions of a file tree
+#
+# Subdirectories are handed out to a pool of worker threads and every change
+# is made through file descriptors / *at() syscalls relative to an open handle
+# of the parent directory so that paths are never re-resolved while walking.
+#
+# NOTE: tests are in src/middlewared/middlewared/pytest/unit/utils/test_permtree.py
+
+import enum
+import errno
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from middlewared.job import Job
+from stat import S_IMODE
+from . import acl
+from .directory import DirectoryIterator
+from .stat_x import StatxEtype
+from .utils import open_fd_budget, path_in_ctldir
+
+PERMTREE_MAX_THREADS = 8
+# Directories waiting for a worker each hold an open file descriptor. Once this many are
+# queued (or 1/PERMTREE_FD_SHARE of the RLIMIT_NOFILE soft limit if that is lower), workers
+# walk newly found directories themselves instead of queueing them.
+PERMTREE_MAX_QUEUED = 1024
+PERMTREE_FD_SHARE = 8
+
+
+class PermTreeAction(enum.Enum):
+    CHOWN = enum.auto()  # only change owner and / or group
+    STRIP = enum.auto()  # remove ACLs (NFSv4 ACLs are replaced with trivial ones) and optionally set mode
+    CLONE = enum.auto()  # replace ACLs with the ones inherited from ACL of the root directory
+
+
+@dataclass(frozen=True, slots=True)
+class PermTreeConfig:
+    """
+    Configuration for permtree() operation.
+
+    action: what to do with every file and directory (see PermTreeAction)
+
+    acltype: ACL type of the filesystem (`NFS4` or `POSIX1E`), required for STRIP and CLONE
+
+    uid / gid: new owner and group, -1 to leave unchanged
+
+    mode: mode to set after stripping ACLs. If None, trivial NFSv4 ACL is derived from the
+        current mode of the file.
+
+    traverse: recurse into child datasets
+
+    threads: number of worker threads. This is the CPU budget of the operation.
+
+    max_ops: maximum number of files + dirs changed per second (IOPS budget), None for unlimited
+
+    job: middleware Job object used to report progress
+
+    job_msg_prefix: prefix for progress messages
+
+    job_progress_interval: number of seconds between progress reports
+    """
+    action: PermTreeAction
+    acltype: str | None = None
+    uid: int = -1
+    gid: int = -1
+    mode: int | None = None
+    traverse: bool = False
+    threads: int = min(os.cpu_count() or 1, PERMTREE_MAX_THREADS)
+    max_ops: int | None = None
+    job: Job | None = None
+    job_msg_prefix: str = ''
+    job_progress_interval: float = 5
+
+
+@dataclass(slots=True)
+class PermTreeStats:
+    dirs: int = 0
+    files: int = 0
+    elapsed: float = 0
+
+
+class RateLimiter:
+    """ Spread calls to `wait()` (from any number of threads) so that at most `rate` calls return per second """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.lock = threading.Lock()
+        self.next_at = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            at = max(self.next_at, now)
+            self.next_at = at + self.interval
+
+        if at > now:
+            time.sleep(at - now)
+
+
+class _PermTreeWalker:
+    def __init__(self, config: PermTreeConfig, root_fd: int):
+        self.config = config
+        self.stats = PermTreeStats()
+        self.lock = threading.Condition()
+        self.pending = 0
+        self.max_pending = max(1, min(PERMTREE_MAX_QUEUED, open_fd_budget(PERMTREE_FD_SHARE)))
+        self.error = None
+        self.limiter = RateLimiter(config.max_ops) if config.max_ops else None
+        self.xattrs = self._clone_xattrs(root_fd) if config.action is PermTreeAction.CLONE else None
+        self.executor = ThreadPoolExecutor(config.threads, 'PermTree')
+
+    def _clone_xattrs(self, root_fd):
+        """
+        ACL xattrs to set keyed by `(is_dir, depth > 1)`. ACEs with NO_PROPAGATE_INHERIT are
+        only inherited by immediate children of the root directory.
+        """
+        match self.config.acltype:
+            case 'NFS4':
+                aclflags, aces = acl.nfs4acl_xdr_decode(os.getxattr(root_fd, acl.ACLXattr.ZFS_NATIVE.value))
+                aclflags &= acl.NFS4ACLFlag.AUTO_INHERIT
+                inherited = {
+                    (False, False): acl.nfs4acl_inherit(aces, False),
+                    (True, False): acl.nfs4acl_inherit(aces, True),
+                }
+                inherited[(False, True)] = acl.nfs4acl_inherit(inherited[(True, False)], False)
+                inherited[(True, True)] = acl.nfs4acl_inherit(inherited[(True, False)], True)
+                if not all(inherited.values()):
+                    raise ValueError('ACL does not contain entries that are inherited by both files and directories')
+
+                return {
+                    key: [(acl.ACLXattr.ZFS_NATIVE.value, acl.nfs4acl_xdr_encode(aclflags, aces))]
+                    for key, aces in inherited.items()
+                }
+            case 'POSIX1E':
+                try:
+                    default = os.getxattr(root_fd, acl.ACLXattr.POSIX_DEFAULT.value)
+                except OSError as e:
+                    if e.errno != errno.ENODATA:
+                        raise
+
+                    raise ValueError('Default ACL entries are required in order to apply ACL recursively') from None
+
+                file_xattrs = [(acl.ACLXattr.POSIX_ACCESS.value, default)]
+                dir_xattrs = file_xattrs + [(acl.ACLXattr.POSIX_DEFAULT.value, default)]
+                return {
+                    (False, False): file_xattrs,
+                    (True, False): dir_xattrs,
+                    (False, True): file_xattrs,
+                    (True, True): dir_xattrs,
+                }
+            case _:
+                raise ValueError(f'{self.config.acltype}: unexpected ACL type')
+
+    def apply(self, fd: int, is_dir: bool, depth: int) -> None:
+        """ Change file or directory opened as `fd` """
+        config = self.config
+        match config.action:
+            case PermTreeAction.STRIP:
+                if config.acltype == 'NFS4':
+                    mode = S_IMODE(os.fstat(fd).st_mode) if config.mode is None else config.mode
+                    os.setxattr(fd, acl.ACLXattr.ZFS_NATIVE.value, acl.nfs4acl_xdr_encode(
+                        0, acl.nfs4acl_trivial(mode, is_dir)
+                    ))
+                else:
+                    for xat in (acl.ACLXattr.POSIX_ACCESS, acl.ACLXattr.POSIX_DEFAULT):
+                        try:
+                            os.removexattr(fd, xat.value)
+                        except OSError as e:
+                            if e.errno != errno.ENODATA:
+                                raise
+
+                if config.mode is not None:
+                    os.fchmod(fd, config.mode)
+
+            case PermTreeAction.CLONE:
+                for name, value in self.xattrs[(is_dir, depth > 1)]:
+                    os.setxattr(fd, name, value)
+
+        if config.uid != -1 or config.gid != -1:
+            os.fchown(fd, config.uid, config.gid)
+
+    def submit(self, fd: int, path: str, depth: int) -> None:
+        """ Walk directory opened as `fd` in a worker thread (takes ownership of `fd`) """
+        with self.lock:
+            queue = self.pending < self.max_pending
+            if queue:
+                self.pending += 1
+
+        if queue:
+            self.executor.submit(self._run, fd, path, depth)
+        else:
+            try:
+                self.walk(fd, path, depth)
+            finally:
+                os.close(fd)
+
+    def _run(self, fd: int, path: str, depth: int) -> None:
+        try:
+            if self.error is None:
+                self.walk(fd, path, depth)
+        except Exception as e:
+            with self.lock:
+                if self.error is None:
+                    self.error = e
+        finally:
+            os.close(fd)
+            with self.lock:
+                self.pending -= 1
+                if self.pending == 0:
+                    self.lock.notify_all()
+
+    def walk(self, fd: int, path: str, depth: int) -> None:
+        config = self.config
+        with DirectoryIterator('.', request_mask=0, dir_fd=fd, as_dict=False) as d_iter:
+            for entry in d_iter:
+                if self.error is not None:
+                    return
+
+                # statx wrapper follows symlinks, `etype` is used to skip them (same as in copytree)
+                match entry.etype:
+                    case StatxEtype.DIRECTORY.name:
+                        if not config.traverse and entry.stat.stx_mnt_id != d_iter.stat.stx_mnt_id:
+                            continue
+
+                        entry_path = os.path.join(path, entry.name)
+                        if entry.name == '.zfs' and path_in_ctldir(entry_path):
+                            continue
+
+                        try:
+                            entry_fd = os.open(entry.name, os.O_DIRECTORY | os.O_NOFOLLOW, dir_fd=d_iter.dir_fd)
+                        except FileNotFoundError:
+                            continue
+
+                        try:
+                            self.apply(entry_fd, True, depth + 1)
+                        except Exception:
+                            os.close(entry_fd)
+                            raise
+
+                        with self.lock:
+                            self.stats.dirs += 1
+
+                        self.submit(entry_fd, entry_path, depth + 1)
+
+                    case StatxEtype.FILE.name:
+                        try:
+                            if config.action is PermTreeAction.CHOWN:
+                                os.chown(entry.name, config.uid, config.gid, dir_fd=d_iter.dir_fd, follow_symlinks=False)
+                            else:
+                                entry_fd = os.open(entry.name, os.O_RDONLY | os.O_NOFOLLOW, dir_fd=d_iter.dir_fd)
+                                try:
+                                    self.apply(entry_fd, False, depth + 1)
+                                finally:
+                                    os.close(entry_fd)
+                        except FileNotFoundError:
+                            continue
+
+                        with self.lock:
+                            self.stats.files += 1
+
+                    case _:
+                        continue
+
+                if self.limiter:
+                    self.limiter.wait()
+
+    def report_progress(self, started: float) -> None:
+        elapsed = time.monotonic() - started
+        with self.lock:
+            processed = self.stats.dirs + self.stats.files
+
+        self.config.job.set_progress(description=(
+            f'{self.config.job_msg_prefix}Processed {processed} files and directories '
+            f'({processed / elapsed if elapsed else 0:.0f}/sec).'
+        ))
+
+    def run(self, root_fd: int, path: str) -> PermTreeStats:
+        started = time.monotonic()
+        try:
+            self.submit(os.dup(root_fd), path, 0)
+            with self.lock:
+                while self.pending:
+                    if self.lock.wait(self.config.job_progress_interval) or self.config.job is None:
+                        continue
+
+                    self.lock.release()
+                    try:
+                        self.report_progress(started)
+                    finally:
+                        self.lock.acquire()
+        finally:
+            self.executor.shutdown(wait=True)
+
+        if self.error is not None:
+            raise self.error
+
+        self.stats.elapsed = time.monotonic() - started
+        if self.config.job:
+            self.report_progress(started)
+
+        return self.stats
+
+
+def permtree(path: str, config: PermTreeConfig) -> PermTreeStats:
+    """
+    Apply ownership and / or permissions to all files and directories under `path`. Owner and
+    group of `path` itself are changed as well, its ACL and mode are left as-is (for CLONE it
+    is the source of the ACLs).
+
+    Params:
+        path: the root directory
+        config: configuration parameters for the operation
+
+    Returns:
+        PermTreeStats
+
+    Raises:
+        ValueError: ACL of the root directory can not be cloned
+        OSError: <generic>: various reasons listed in syscall manpages. Operation stops on first error.
+    """
+    if not os.path.isabs(path):
+        raise ValueError(f'{path}: absolute path is required')
+
+    if config.action is not PermTreeAction.CHOWN and config.acltype not in ('NFS4', 'POSIX1E'):
+        raise ValueError(f'{config.acltype}: unexpected ACL type')
+
+    root_fd = os.open(path, os.O_DIRECTORY)
+    try:
+        walker = _PermTreeWalker(config, root_fd)
+        if config.uid != -1 or config.gid != -1:
+            os.fchown(root_fd, config.uid, config.gid)
+
+        return walker.run(root_fd, path)
+    finally:
+        os.close(root_fd)
@@ -5,6 +5,9 @@
 # timespec_convert_int() has test coverage via copytree util tests
 # path_in_ctldir() has test coverage via api tests for filesystem.stat
 # and filesystem.listdir methods since it requires access to zpool.
+# open_fd_budget() has test coverage via permtree and copytree util tests
+
+import resource
 
 from .constants import ZFSCTL
 from pathlib import Path
@@ -51,3 +54,13 @@ def timespec_convert_int(timespec):
     when a timespec needs to be passed to os.utime()
     """
     return timespec.tv_sec * 1000000000 + timespec.tv_nsec
+
+
+def open_fd_budget(share):
+    """
+    Number of file descriptors that a single filesystem tree operation may
+    keep open for its own bookkeeping: 1/`share` of the RLIMIT_NOFILE soft
+    limit. middlewared runs with the default soft limit of 1024 and the rest
+    of the process needs its descriptors as well.
+    """
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0] // share
@@ -0,0 +1,176 @@
+import asyncio
+from collections import defaultdict
+import concurrent.futures
+from dataclasses import asdict, dataclass
+import functools
+import os
+import time
+
+__all__ = ['ProcessPool']
+
+# Pool never grows past `max(PROCESS_POOL_MIN_SIZE, min(os.cpu_count(), PROCESS_POOL_MAX_SIZE))` workers
+PROCESS_POOL_MIN_SIZE = 5
+PROCESS_POOL_MAX_SIZE = 16
+# Number of workers that are kept alive (with all the plugins loaded) even if the pool is idle
+PROCESS_POOL_WARM_WORKERS = 2
+# Workers are recycled after this many calls so that memory leaked by the libraries used in them is released. Every new
+# worker has to load all the plugins again, so this should be high enough to make that cost negligible.
+PROCESS_POOL_MAX_TASKS_PER_CHILD = 1000
+
+
+def timed_call(method, *args, **kwargs):
+    # Executed in the worker process. `time.monotonic` uses the system-wide `CLOCK_MONOTONIC` so it can be compared
+    # with the timestamps taken in the main process.
+    started = time.monotonic()
+    return started, method(*args, **kwargs)
+
+
+@dataclass(slots=True)
+class ProcessPoolServiceStats:
+    calls: int = 0
+    errors: int = 0
+    in_flight: int = 0
+    queue_wait_total: float = 0
+    queue_wait_max: float = 0
+    exec_time_total: float = 0
+    exec_time_max: float = 0
+
+    def add(self, queue_wait, exec_time):
+        self.queue_wait_total += queue_wait
+        self.queue_wait_max = max(self.queue_wait_max, queue_wait)
+        self.exec_time_total += exec_time
+        self.exec_time_max = max(self.exec_time_max, exec_time)
+
+
+class ProcessPoolExecutor(concurrent.futures.ProcessPoolExecutor):
+    """
+    `concurrent.futures.ProcessPoolExecutor` that can start idle workers ahead of time.
+
+    The standard executor only spawns a worker when a call is submitted and no worker is idle. Starting workers
+    without submitting calls to them requires the internals of the CPython 3.11 implementation, all of which are only
+    used in this class.
+    """
+
+    def spawn_workers(self, count):
+        """
+        Start idle workers until there are at least `count` of them (but no more than `max_workers`).
+        """
+        with self._shutdown_lock:
+            if self._broken or self._shutdown_thread:
+                return
+
+            for i in range(min(count, self._max_workers) - len(self._processes)):
+                self._spawn_process()
+                # The new worker is idle, the next `submit` must not spawn another one for its call
+                self._idle_worker_semaphore.release()
+
+            # Executor manager thread must start watching the new workers
+            self._executor_manager_thread_wakeup.wakeup()
+            self._start_executor_manager_thread()
+
+    def worker_count(self):
+        return len(self._processes or {})
+
+
+class ProcessPool:
+    """
+    Process pool used to run methods of `process_pool = True` services.
+
+    Workers are spawned on demand (i.e. the pool grows with the queue depth) up to a limit derived from the CPU count.
+    `PROCESS_POOL_WARM_WORKERS` workers are pre-forked on start and replaced as soon as they are recycled so that
+    calls do not have to wait for a new worker to load all the plugins. Warm workers are started without submitting
+    any calls to them, so they keep their whole `max_tasks_per_child` budget for real calls.
+
+    Concurrency of a single service can be limited with the `process_pool_concurrency` service config option so that
+    a burst of calls to one service does not occupy the whole pool.
+    """
+
+    def __init__(self, initializer, max_workers=None, warm_workers=PROCESS_POOL_WARM_WORKERS,
+                 max_tasks_per_child=PROCESS_POOL_MAX_TASKS_PER_CHILD):
+        self.initializer = initializer
+        self.max_workers = max_workers or max(PROCESS_POOL_MIN_SIZE, min(os.cpu_count() or 1, PROCESS_POOL_MAX_SIZE))
+        self.warm_workers = min(warm_workers, self.max_workers)
+        self.max_tasks_per_child = max_tasks_per_child
+        self.executor = None
+        self.pending = 0
+        self.concurrency = {}
+        self.semaphores = {}
+        self.service_stats = defaultdict(ProcessPoolServiceStats)
+        self.init()
+
+    def init(self):
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            max_tasks_per_child=self.max_tasks_per_child,
+            initializer=self.initializer,
+        )
+
+    def start(self):
+        self.warm_up()
+
+    def warm_up(self):
+        self.executor.spawn_workers(self.warm_workers)
+
+    async def run(self, service, concurrency, method, *args, **kwargs):
+        """
+        Run `method` in the process pool accounting it to `service` and running at most `concurrency` calls of that
+        service at once (if specified).
+        """
+        stats = self.service_stats[service]
+        stats.calls += 1
+        stats.in_flight += 1
+        queued = time.monotonic()
+        try:
+            if concurrency:
+                if (semaphore := self.semaphores.get(service)) is None:
+                    self.concurrency[service] = concurrency
+                    semaphore = self.semaphores[service] = asyncio.Semaphore(concurrency)
+
+                async with semaphore:
+                    return await self._run(stats, queued, method, *args, **kwargs)
+            else:
+                return await self._run(stats, queued, method, *args, **kwargs)
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.in_flight -= 1
+
+    async def _run(self, stats, queued, method, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        retries = 2
+        self.pending += 1
+        try:
+            for i in range(retries):
+                try:
+                    started, result = await loop.run_in_executor(
+                        self.executor, functools.partial(timed_call, method, *args, **kwargs),
+                    )
+                except concurrent.futures.process.BrokenProcessPool:
+                    if i == retries - 1:
+                        raise
+                    self.init()
+                    self.warm_up()
+                else:
+                    stats.add(started - queued, time.monotonic() - started)
+                    # Replace workers that were recycled after this call
+                    self.warm_up()
+                    return result
+        finally:
+            self.pending -= 1
+
+    def stats(self):
+        return {
+            'max_workers': self.max_workers,
+            'warm_workers': self.warm_workers,
+            'max_tasks_per_child': self.max_tasks_per_child,
+            'workers': self.executor.worker_count(),
+            'pending': self.pending,
+            'services': {
+                service or '': {
+                    **asdict(stats),
+                    'concurrency': self.concurrency.get(service),
+                }
+                for service, stats in self.service_stats.items()
+            },
+        }
@@ -1,9 +1,19 @@
-import os
+import asyncio
 import syslog
-import uuid
+import time
+
+from anyio import BrokenResourceError, ClosedResourceError, create_connected_unix_datagram_socket
 
 from middlewared.utils.time_utils import utc_now
 
+# Number of encoded messages waiting to be sent. When it is full, senders wait up to `SYSLOG_QUEUE_TIMEOUT`
+# seconds for space before the message is dropped.
+SYSLOG_QUEUE_SIZE = 10000
+SYSLOG_QUEUE_TIMEOUT = 5
+# Maximum number of messages sent without yielding to the event loop
+SYSLOG_BATCH_SIZE = 100
+SOCKET_ERRORS = (OSError, BrokenResourceError, ClosedResourceError)
+
 
 def syslog_message(message):
     data = f'<{syslog.LOG_USER | syslog.LOG_INFO}>'
@@ -17,3 +27,126 @@ def syslog_message(message):
     data = data.encode('ascii', 'ignore')
 
     return data
+
+
+class SyslogSender:
+    """
+    Sends syslog messages (one datagram per message) over a single long-lived connection to `path`.
+
+    Messages are queued by `send()` and written in batches by a background task started on first use.
+    """
+
+    def __init__(self, path, logger, queue_size=SYSLOG_QUEUE_SIZE, batch_size=SYSLOG_BATCH_SIZE):
+        self.path = path
+        self.logger = logger
+        self.queue = asyncio.Queue(queue_size)
+        self.batch_size = batch_size
+        self.socket = None
+        self.task = None
+        self.sent = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+        # Seconds between queueing a message and writing it to the socket
+        self.last_latency = 0
+        self.max_latency = 0
+
+    async def send(self, data):
+        """
+        Queue encoded syslog message `data`. Waits while the queue is full.
+        """
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+        item = (time.monotonic(), data)
+        try:
+            self.queue.put_nowait(item)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        try:
+            await asyncio.wait_for(self.queue.put(item), SYSLOG_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            if not self.dropped:
+                self.logger.warning('Syslog queue for %r is full, dropping messages', self.path)
+
+            self.dropped += 1
+
+    async def flush(self):
+        if self.task is not None:
+            await self.queue.join()
+
+    def stats(self):
+        return {
+            'queued': self.queue.qsize(),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'healthy': self.last_error is None,
+            'last_error': self.last_error,
+            'latency': {
+                'last': self.last_latency,
+                'max': self.max_latency,
+            },
+        }
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            try:
+                for queued_at, data in batch:
+                    try:
+                        await self._send(data)
+                    except Exception as e:
+                        # Sending must go on for the following messages
+                        self.logger.error('Unexpected error sending syslog message to %r', self.path, exc_info=True)
+                        self.errors += 1
+                        self.dropped += 1
+                        self.last_error = str(e)
+                        await self._close()
+                        continue
+
+                    latency = time.monotonic() - queued_at
+                    self.last_latency = latency
+                    self.max_latency = max(self.max_latency, latency)
+            finally:
+                for i in batch:
+                    self.queue.task_done()
+
+    async def _send(self, data):
+        # Reconnect once if syslog daemon was restarted
+        for attempt in range(2):
+            try:
+                if self.socket is None:
+                    self.socket = await create_connected_unix_datagram_socket(self.path)
+
+                await self.socket.send(data)
+            except SOCKET_ERRORS as e:
+                await self._close()
+                if attempt == 0:
+                    continue
+
+                if self.last_error is None:
+                    self.logger.warning('Error sending syslog message to %r: %r', self.path, e)
+
+                self.errors += 1
+                self.dropped += 1
+                self.last_error = str(e)
+            else:
+                self.sent += 1
+                self.last_error = None
+
+            return
+
+    async def _close(self):
+        if self.socket is not None:
+            try:
+                await self.socket.aclose()
+            except SOCKET_ERRORS:
+                pass
+
+            self.socket = None
@@ -1,9 +1,12 @@
 import asyncio
+import errno
 import inspect
 import os
 import setproctitle
+import threading
+import time
 
-from truenas_api_client import Client
+from truenas_api_client import Client, ClientException
 
 from . import logger
 from .common.environ import environ_update
@@ -14,6 +17,68 @@ from .utils.service.call import MethodNotFoundError, ServiceCallMixin
 
 
 MIDDLEWARE = None
+# Minimum interval between job progress updates sent to the main middleware process
+JOB_PROGRESS_INTERVAL = 0.5
+
+
+class WorkerClient:
+    """
+    Long-lived connection from a process pool worker to the main middleware process.
+
+    Calls made from any thread are multiplexed over the same websocket. If a call fails because the connection was
+    closed, the error is raised to the caller (the request might have been received by the main middleware process, so
+    it is not sent again) and the connection is re-established (and `on_connect` callbacks are run again) by the next
+    call.
+    """
+
+    def __init__(self, uri):
+        self.uri = uri
+        self.lock = threading.Lock()
+        self.client = None
+        self.on_connect_callbacks = []
+
+    def get(self):
+        with self.lock:
+            if self.client is None:
+                self._connect()
+
+            return self.client
+
+    def register_on_connect(self, callback):
+        with self.lock:
+            self.on_connect_callbacks.append(callback)
+            if self.client is not None:
+                callback(self.client)
+
+    def call(self, method, *params, **kwargs):
+        client = self.get()
+        try:
+            return client.call(method, *params, **kwargs)
+        except (ClientException, ConnectionError) as e:
+            if not isinstance(e, ClientException) or getattr(e, 'errno', None) == errno.ECONNABORTED:
+                self._disconnected(client)
+
+            raise
+
+    def _disconnected(self, client):
+        with self.lock:
+            if self.client is client:
+                self._close()
+
+    def _connect(self):
+        self._close()
+        self.client = Client(self.uri, py_exceptions=True)
+        for callback in self.on_connect_callbacks:
+            callback(self.client)
+
+    def _close(self):
+        if self.client is not None:
+            try:
+                self.client.close()
+            except Exception:
+                pass
+
+            self.client = None
 
 
 class FakeMiddleware(LoadPluginsMixin, ServiceCallMixin):
@@ -23,23 +88,25 @@ class FakeMiddleware(LoadPluginsMixin, ServiceCallMixin):
 
     def __init__(self):
         super().__init__()
-        self.client = None
+        self.client = WorkerClient(f'ws+unix://{MIDDLEWARE_RUN_DIR}/middlewared-internal.sock')
         _logger = logger.Logger('worker')
         self.logger = _logger.getLogger()
         _logger.configure_logging('console')
         self.loop = asyncio.get_event_loop()
 
     def _call(self, name, serviceobj, methodobj, params=None, app=None, pipes=None, job=None):
+        fake_job = None
+        job_options = getattr(methodobj, '_job', None)
+        if job and job_options:
+            fake_job = FakeJob(job['id'], self.client)
+            params = list(params) if params else []
+            params.insert(0, fake_job)
+
         try:
-            with Client(f'ws+unix://{MIDDLEWARE_RUN_DIR}/middlewared-internal.sock', py_exceptions=True) as c:
-                self.client = c
-                job_options = getattr(methodobj, '_job', None)
-                if job and job_options:
-                    params = list(params) if params else []
-                    params.insert(0, FakeJob(job['id'], self.client))
-                return methodobj(*params)
+            return methodobj(*params)
         finally:
-            self.client = None
+            if fake_job is not None:
+                fake_job.flush_progress()
 
     def _run(self, name, args, job):
         serviceobj, methodobj = self.get_method(name)
@@ -82,8 +149,7 @@ class FakeMiddleware(LoadPluginsMixin, ServiceCallMixin):
         return []
 
     def send_event(self, name, event_type, **kwargs):
-        with Client(py_exceptions=True) as c:
-            return c.call('core.event_send', name, event_type, kwargs)
+        return self.client.call('core.event_send', name, event_type, kwargs)
 
 
 class FakeJob(object):
@@ -96,14 +162,47 @@ class FakeJob(object):
             'description': None,
             'extra': None,
         }
+        self.progress_lock = threading.Lock()
+        self.progress_sent_at = 0
+        self.progress_pending = False
+        self.progress_timer = None
 
     def set_progress(self, percent, description=None, extra=None):
-        self.progress['percent'] = percent
-        if description:
-            self.progress['description'] = description
-        if extra:
-            self.progress['extra'] = extra
-        self.client.call('core.job_update', self.id, {'progress': self.progress})
+        """
+        Progress updates are coalesced: at most one update is sent to the main middleware process every
+        `JOB_PROGRESS_INTERVAL` seconds, the latest pending one is sent when the interval expires.
+        """
+        with self.progress_lock:
+            self.progress['percent'] = percent
+            if description:
+                self.progress['description'] = description
+            if extra:
+                self.progress['extra'] = extra
+
+            self.progress_pending = True
+            delay = self.progress_sent_at + JOB_PROGRESS_INTERVAL - time.monotonic()
+            if delay > 0 and percent != 100:
+                if self.progress_timer is None:
+                    self.progress_timer = threading.Timer(delay, self.flush_progress)
+                    self.progress_timer.daemon = True
+                    self.progress_timer.start()
+
+                return
+
+        self.flush_progress()
+
+    def flush_progress(self):
+        with self.progress_lock:
+            if self.progress_timer is not None:
+                self.progress_timer.cancel()
+                self.progress_timer = None
+
+            if not self.progress_pending:
+                return
+
+            self.progress_pending = False
+            self.progress_sent_at = time.monotonic()
+            self.client.call('core.job_update', self.id, {'progress': dict(self.progress)})
 
 
 def main_worker(*call_args):
@@ -120,10 +219,9 @@ def main_worker(*call_args):
     return res
 
 
-def receive_events():
-    c = Client(f'ws+unix://{MIDDLEWARE_RUN_DIR}/middlewared-internal.sock', py_exceptions=True)
-    c.subscribe('core.environ', lambda *args, **kwargs: environ_update(kwargs['fields']))
-    environ_update(c.call('core.environ'))
+def receive_events(client):
+    client.subscribe('core.environ', lambda *args, **kwargs: environ_update(kwargs['fields']))
+    environ_update(client.call('core.environ'))
 
 
 def worker_init(debug_level, log_handler):
@@ -135,4 +233,6 @@ def worker_init(debug_level, log_handler):
     setproctitle.setproctitle('middlewared (worker)')
     die_with_parent()
     logger.setup_logging('worker', debug_level, log_handler)
-    receive_events()
+    # Also establishes the connection to the main middleware process before the first call is made
+    MIDDLEWARE.client.register_on_connect(receive_events)
+    MIDDLEWARE.client.get()
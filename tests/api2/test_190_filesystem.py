@@ -301,6 +301,30 @@ def test_type_filter(file_and_directory, query, result):
     assert {item["name"] for item in listdir} == result, listdir
 
 
+def test_listdir_page():
+    with create_dataset("test_listdir_page") as ds:
+        path = f"/mnt/{ds}"
+        ssh(f"mkdir {path}/dir; touch {path}/file{{1..25}}")
+
+        names = []
+        cursor = None
+        for i in range(4):
+            page = call("filesystem.listdir_page", path, [["type", "=", "FILE"]], {
+                "cursor": cursor, "limit": 10, "select": ["name"],
+            })
+            names.extend(item["name"] for item in page["entries"])
+            if (cursor := page["cursor"]) is None:
+                break
+
+        assert cursor is None
+        assert sorted(names) == sorted(f"file{i}" for i in range(1, 26))
+
+        first_page = call("filesystem.listdir_page", path, [], {"limit": 1})
+        with pytest.raises(CallError) as ce:
+            call("filesystem.listdir_page", f"{path}/dir", [], {"cursor": first_page["cursor"]})
+        assert ce.value.errno == errno.EINVAL
+
+
 def test_mkdir_mode():
     with create_dataset("test_mkdir_mode") as ds:
         testdir = os.path.join("/mnt", ds, "testdir")
@@ -3,6 +3,7 @@ import gc
 import os
 import pytest
 import random
+import resource
 import stat
 
 from middlewared.utils.filesystem import copy
@@ -451,6 +452,84 @@ def test__copytree_job_log_prefix(directory_for_test, fd_count):
     assert last.startswith('Canary: Successfully copied')
 
 
+@pytest.mark.parametrize('flags', [copy.DEF_CP_FLAGS, copy.CopyFlags.TIMESTAMPS, copy.CopyFlags(0)])
+def test__copytree_parallel(directory_for_test, fd_count, flags):
+    """ copy the tree with multiple threads """
+    src = os.path.join(directory_for_test, 'SOURCE')
+    dst = os.path.join(directory_for_test, 'DEST')
+    job = Job()
+
+    serial = copy.copytree(src, os.path.join(directory_for_test, 'SERIAL'), copy.CopyTreeConfig(flags=flags))
+    stats = copy.copytree(src, dst, copy.CopyTreeConfig(flags=flags, threads=4, job=job, job_msg_inc=1))
+
+    validate_copy_tree(src, dst, flags)
+    assert stats == serial
+    assert any('directories' in msg and 'so far' in msg for msg in job.log)
+
+    assert get_fd_count() == fd_count
+
+
+@pytest.mark.parametrize('max_queued', [0, 1024])
+def test__copytree_parallel_into_itself(directory_for_test, fd_count, max_queued):
+    """ recursion guard and ctldir protection also apply to parallel copies """
+    src = os.path.join(directory_for_test, 'SOURCE')
+    dst = os.path.join(directory_for_test, 'SOURCE', 'FOO', 'BAR', 'DEST')
+
+    os.makedirs(os.path.join(directory_for_test, 'SOURCE', 'FOO', 'BAR'))
+    os.makedirs(os.path.join(src, '.zfs', 'snapshot', 'now'))
+
+    with (
+        patch('middlewared.utils.filesystem.copy.MAX_CP_QUEUED', max_queued),
+        patch('middlewared.utils.filesystem.copy.path_in_ctldir', Mock(return_value=True)),
+    ):
+        copy.copytree(src, dst, copy.CopyTreeConfig(threads=4))
+
+    assert os.path.exists(os.path.join(dst, 'FOO', 'BAR'))
+    assert not os.path.exists(os.path.join(dst, 'FOO', 'BAR', 'DEST'))
+    assert not os.path.exists(os.path.join(dst, '.zfs'))
+
+    assert get_fd_count() == fd_count
+
+
+def test__copytree_parallel_error(directory_for_test, fd_count):
+    """ first error stops the copy and is raised once all threads finished """
+    src = os.path.join(directory_for_test, 'SOURCE')
+    dst = os.path.join(directory_for_test, 'DEST')
+
+    with patch(
+        'middlewared.utils.filesystem.copy.clone_or_copy_file', Mock(side_effect=OSError(errno.ENOSPC, 'No space'))
+    ):
+        with pytest.raises(OSError) as ose:
+            copy.copytree(src, dst, copy.CopyTreeConfig(threads=4))
+
+    assert ose.value.errno == errno.ENOSPC
+    assert get_fd_count() == fd_count
+
+
+def test__copytree_parallel_nofile_limit(tmpdir, fd_count):
+    """ parallel copy of a wide tree must not need more file descriptors than middlewared has """
+    src = os.path.join(tmpdir, 'SOURCE')
+    for i in range(3000):
+        for j in range(3):
+            os.makedirs(os.path.join(src, f'dir{i}', f'dir{j}'))
+
+        with open(os.path.join(src, f'dir{i}', 'file'), 'wb') as f:
+            f.write(b'canary')
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (fd_count + 256, hard))
+    try:
+        serial = copy.copytree(src, os.path.join(tmpdir, 'SERIAL'), copy.CopyTreeConfig())
+        stats = copy.copytree(src, os.path.join(tmpdir, 'DEST'), copy.CopyTreeConfig(threads=8))
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    assert stats == serial
+    assert (stats.dirs, stats.files) == (12000, 3000)
+    assert sorted(os.listdir(os.path.join(tmpdir, 'DEST', 'dir2999'))) == ['dir0', 'dir1', 'dir2', 'file']
+    assert get_fd_count() == fd_count
+
+
 def test__clone_file_somewhat_large(tmpdir):
 
     src_fd = os.open(os.path.join(tmpdir, 'test_large_clone_src'), os.O_CREAT | os.O_RDWR)
@@ -218,3 +218,50 @@ def test__directory_fd(directory_for_test, fd_count):
 
     # we still have reference to dfd2
     assert get_fd_count() == fd_count + 1
+
+
+def test__directory_offset_resume(directory_for_test, fd_count):
+    with directory.DirectoryIterator(directory_for_test, request_mask=0) as d_iter:
+        expected = sorted(entry['name'] for entry in d_iter)
+
+    names = []
+    offset = 0
+    while True:
+        with directory.DirectoryIterator(directory_for_test, request_mask=0, offset=offset) as d_iter:
+            page = [entry['name'] for _, entry in zip(range(3), d_iter)]
+            offset = d_iter.offset
+
+        if not page:
+            break
+
+        names.extend(page)
+
+    assert sorted(names) == expected
+    assert get_fd_count() == fd_count
+
+
+def test__directory_offset_file_type(directory_for_test):
+    with directory.DirectoryIterator(
+        directory_for_test, file_type=constants.FileType.DIRECTORY, request_mask=0, offset=0
+    ) as d_iter:
+        assert sorted(entry['name'] for entry in d_iter) == sorted(TEST_DIRS)
+
+
+def test__getdents_many_entries(tmpdir):
+    # enough entries to require multiple getdents64 calls
+    expected = {f'{"x" * 200}{i}' for i in range(1000)}
+    for name in expected:
+        with open(os.path.join(tmpdir, name), 'w'):
+            pass
+
+    fd = os.open(tmpdir, os.O_DIRECTORY)
+    try:
+        entries = list(directory.getdents(fd))
+        assert {entry.name for entry in entries} == expected
+
+        # resuming from any offset yields the remaining entries
+        assert [entry.name for entry in directory.getdents(fd, entries[499].offset)] == [
+            entry.name for entry in entries[500:]
+        ]
+    finally:
+        os.close(fd)